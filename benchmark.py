@@ -0,0 +1,252 @@
+"""
+Benchmarks for move generation and search, to catch performance regressions (and movegen bugs).
+
+    python benchmark.py                          # run everything, print JSON
+    python benchmark.py --output bench.json      # ... and save it
+    python benchmark.py --baseline bench.json    # fail (exit 1) if anything got more than 20% slower
+    python benchmark.py --perft 5                # just the perft check, to depth 5
+
+There are three parts:
+    perft  Counts the positions reachable from FULL_BOARD in exactly N plies (games that end early count
+           as one position), once with the pure Python CheckersGame.get_legal and once with ffi.legal_moves.
+           The move lists get compared at every node, so any disagreement between them is an error.
+    micro  Time per call of CheckersGame.move + _unmove, hash and get_legal, of ffi.legal_moves,
+           and of MiniMaxer.heuristic.
+    search Nodes per second of MiniMaxer.find_move on some fixed positions, in Python and in C,
+           and playouts per second of MCTS.find_move.
+
+Every timing is the best of a few repeats, which is much less noisy than the average.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import game
+from ffi import legal_moves # type: ignore
+from mcts import MCTS
+from minimax import MiniMaxer
+
+# Number of times each timing gets repeated (we keep the best)
+REPEATS = 5
+# Seeds of the random positions used by the search benchmarks
+SEARCH_SEEDS = (1, 2, 3)
+# Playouts per position for the MCTS benchmark
+MCTS_PLAYOUTS = 2000
+
+
+def python_moves(board: game.CheckersGame):
+    return list(board.get_legal(board.player_turn))
+
+
+def perft(board: game.CheckersGame, depth: int, generator = legal_moves) -> int:
+    """
+    Count the leaf positions of the game tree below board, depth plies deep.
+
+        Parameters:
+            board (CheckersGame): The position to start from. It's left as it was.
+            depth          (int): How many plies to go.
+            generator (function): Takes a board and returns its legal moves.
+    """
+    if depth == 0 or board.winner is not None:
+        return 1
+    moves = generator(board)
+    if depth == 1:
+        return len(moves)
+    count = 0
+    for (start, end) in moves:
+        board.move(start, end, verify=False)
+        count += perft(board, depth - 1, generator)
+        board._unmove()
+    return count
+
+
+def perft_check(board: game.CheckersGame, depth: int) -> int:
+    """
+    Like perft, but generates the moves both in Python and in C, and raises an AssertionError
+    at the first position where they don't agree.
+    """
+    if depth == 0 or board.winner is not None:
+        return 1
+    moves = legal_moves(board)
+    python = python_moves(board)
+    if sorted(moves) != sorted(python):
+        raise AssertionError(f"move generators disagree ({board.player_turn} to move):\n{board}\n"
+                f"only in C: {sorted(set(moves) - set(python))}\n"
+                f"only in Python: {sorted(set(python) - set(moves))}")
+    count = 0
+    for (start, end) in moves:
+        board.move(start, end, verify=False)
+        count += perft_check(board, depth - 1)
+        board._unmove()
+    return count
+
+
+def best_time(function, number: int, repeats: int = REPEATS) -> float:
+    """Best time, over repeats, of calling function number times. In seconds per call."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def random_position(seed: int, plies: int = 30) -> game.CheckersGame:
+    """The position after plies random moves from the start, or earlier if the game ends."""
+    rng = random.Random(seed)
+    board = game.CheckersGame()
+    for _ in range(plies):
+        moves = legal_moves(board)
+        board.move(*rng.choice(moves), verify=False)
+        if board.winner is not None:
+            board._unmove()
+            break
+    return game.CheckersGame(board._board, board.player_turn)
+
+
+def bench_perft(depth: int) -> dict:
+    results = {}
+    start = time.perf_counter()
+    count = perft_check(game.CheckersGame(), depth)
+    results["perft_check_nodes"] = {"value": count, "unit": "positions", "exact": True}
+    elapsed = time.perf_counter() - start
+    results["perft_check_time"] = {"value": elapsed, "unit": "s", "higher_is_better": False}
+
+    for (name, generator) in (("python", python_moves), ("native", legal_moves)):
+        start = time.perf_counter()
+        assert perft(game.CheckersGame(), depth, generator) == count
+        elapsed = time.perf_counter() - start
+        results[f"perft_{name}_nps"] = {"value": count / elapsed, "unit": "positions/s", "higher_is_better": True}
+    return results
+
+
+def bench_micro() -> dict:
+    board = random_position(SEARCH_SEEDS[0])
+    moves = legal_moves(board)
+    engine = MiniMaxer()
+
+    def move_unmove():
+        for (start, end) in moves:
+            board.move(start, end, verify=False)
+            board._unmove()
+
+    timings = {
+        "move_unmove": best_time(move_unmove, 200) / len(moves),
+        "hash": best_time(board.hash, 100000),
+        "heuristic": best_time(lambda: engine.heuristic(board), 20000),
+        "get_legal_python": best_time(lambda: python_moves(board), 200),
+        "legal_moves_native": best_time(lambda: legal_moves(board), 2000),
+        "is_legal": best_time(lambda: [board.is_legal(*m) for m in moves], 100) / len(moves),
+    }
+    return {f"{name}_ns": {"value": t * 1e9, "unit": "ns/call", "higher_is_better": False}
+            for (name, t) in timings.items()}
+
+
+def bench_search(python_depth: int, native_depth: int) -> dict:
+    results = {}
+    for (name, native, depth) in (("python", False, python_depth), ("native", True, native_depth)):
+        nodes = 0
+        elapsed = 0.0
+        for seed in SEARCH_SEEDS:
+            engine = MiniMaxer()
+            engine.find_move(random_position(seed), depth, native=native)
+            nodes += engine.stats.nodes
+            elapsed += engine.stats.time
+        # The node count only changes if the search itself does
+        results[f"search_{name}_nodes"] = {"value": nodes, "unit": "nodes", "exact": True}
+        results[f"search_{name}_nps"] = {"value": nodes / elapsed, "unit": "nodes/s", "higher_is_better": True}
+
+    playouts = 0
+    elapsed = 0.0
+    for seed in SEARCH_SEEDS:
+        engine = MCTS()
+        engine.find_move(random_position(seed), nodes=MCTS_PLAYOUTS)
+        playouts += engine.stats.nodes
+        elapsed += engine.stats.time
+    results["search_mcts_playouts"] = {"value": playouts / elapsed, "unit": "playouts/s", "higher_is_better": True}
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results with a baseline from an earlier run.
+
+        Parameters:
+            threshold (float): How much worse (as a fraction) a timing may get before it counts as a regression.
+
+        Returns:
+            A list of messages, one per regression.
+    """
+    regressions = []
+    for (name, old) in baseline.get("results", {}).items():
+        new = results.get(name)
+        if new is None:
+            continue
+        (a, b) = (old["value"], new["value"])
+        if new.get("exact"):
+            if a != b:
+                regressions.append(f"{name}: {b} instead of {a}")
+        elif new.get("higher_is_better"):
+            if b < a * (1 - threshold):
+                regressions.append(f"{name}: {b:.4g} {new['unit']}, down from {a:.4g}")
+        elif b > a * (1 + threshold):
+            regressions.append(f"{name}: {b:.4g} {new['unit']}, up from {a:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--perft", type=int, default=4, help="perft depth (default 4, 0 to skip)")
+    parser.add_argument("--python-depth", type=int, default=4, help="depth of the Python search benchmark")
+    parser.add_argument("--native-depth", type=int, default=6, help="depth of the C search benchmark")
+    parser.add_argument("--only", choices=("perft", "micro", "search"), action="append",
+            help="only run these parts (can be given more than once)")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+            help="fail if a timing is worse than the baseline by more than this fraction (default 0.2)")
+    args = parser.parse_args()
+    parts = args.only or ["perft", "micro", "search"]
+
+    results = {}
+    try:
+        if "perft" in parts and args.perft > 0:
+            results.update(bench_perft(args.perft))
+    except AssertionError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if "micro" in parts:
+        results.update(bench_micro())
+    if "search" in parts:
+        results.update(bench_search(args.python_depth, args.native_depth))
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "settings": {"perft": args.perft, "python_depth": args.python_depth, "native_depth": args.native_depth},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("warning: the baseline was run with different settings", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print("regression:", message, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
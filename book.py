@@ -0,0 +1,321 @@
+"""
+Precomputed moves for both ends of the game, which MiniMaxer looks up before it searches.
+
+OpeningBook: the moves a (deep) search picks in the positions near the start. It's built by following the book's
+own moves for one side and every reply of the other, for either color, so whatever the opponent does in the
+first --plies moves, the position is in the book.
+
+RaceDatabase: once the armies have passed each other, each side just races for its goal, and the side that
+needs fewer moves wins. For every arrangement of ten pieces within --radius diagonals of the goal (the goal
+triangle itself is 3), the database has the fewest moves that get them home without any of them ending a move
+outside the radius. That's a number of moves that is enough, but a route that steps outside for a while could
+be shorter, so it isn't necessarily the fewest. The lookup only answers races whose result is certain anyway.
+It's a table for player 1; player 2's positions are looked up rotated half a turn.
+
+Both are .npy files that get memory mapped: the book is a sorted array of Zobrist keys, searched by bisection,
+and the race database is indexed directly by the rank of the set of cells the pieces are on.
+So it costs nothing to load them, and only the pages we look at get read.
+
+    python book.py opening --plies 6 --depth 6 --output book.npy
+    python book.py race --radius 5 --output race.npy
+
+    class MyBot(MiniMaxer):
+        opening_book = OpeningBook("book.npy")
+        race_database = RaceDatabase("race.npy")
+"""
+import argparse
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, Union
+import numpy as np
+import game
+from ffi import legal_moves, legal_moves_batch # type: ignore
+from minimax import MiniMaxer, WIN_VALUE
+
+Move = Tuple[Tuple[int, int], Tuple[int, int]]
+
+# Pieces per side
+PIECES = 10
+# Distance of positions the race database can't get to the goal from (staying inside its radius).
+#   That doesn't mean they can't get there at all.
+UNREACHABLE = 255
+
+
+class OpeningBook:
+    """
+    Book moves by Zobrist key. The file is a (2, N) uint64 array: the sorted keys,
+    then for each one its move (low 16 bits, packed) and the search value for the side to move (the 32 above).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._table = np.load(path, mmap_mode="r")
+        self._keys = self._table[0]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def lookup(self, board: game.CheckersGame) -> Union[Tuple[Move, int], None]:
+        """The book move and its value for the side to move, or None if the position isn't in the book."""
+        key = np.uint64(board._key)
+        i = int(np.searchsorted(self._keys, key))
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        entry = int(self._table[1, i])
+        move = game.unpack_move(entry & 0xFFFF)
+        value = np.int32(np.uint32(entry >> 16)).item()
+        # A different position with the same key would be very bad luck, but it's cheap to make sure
+        if board.winner is not None or not board.is_legal(*move):
+            return None
+        return (move, value)
+
+
+def save_opening_book(path: str, entries: Dict[int, Tuple[Move, int]]):
+    """Write {key: (move, value)} as an OpeningBook file."""
+    keys = np.array(list(entries), dtype=np.uint64)
+    payload = np.array([(int(np.uint32(np.int32(value))) << 16) | game.pack_move(move)
+            for (move, value) in entries.values()], dtype=np.uint64)
+    order = np.argsort(keys)
+    with open(path, "wb") as f:
+        np.save(f, np.stack([keys[order], payload[order]]))
+
+
+# Engine of this worker process, so its transposition table stays warm between positions
+_engine = None
+
+def _book_move(cls, board: np.ndarray, player: int, depth: int) -> Tuple[Move, int]:
+    """Runs in a worker: the move that cls picks for the position, and its value."""
+    global _engine
+    if _engine is None or type(_engine) is not cls:
+        _engine = cls()
+    move = _engine.find_move(game.CheckersGame(board, player), depth)
+    return (move, _engine.stats.value)
+
+
+def build_opening_book(plies: int = 6, depth: int = 6, cls = MiniMaxer, workers: Union[int, None] = None,
+        progress = print) -> Dict[int, Tuple[Move, int]]:
+    """
+    Search every position that the book's side can get to in the first plies moves of the game
+    (playing the book's moves, against any replies), for either color.
+
+        Parameters:
+            plies  (int): How many moves from the start the book goes.
+            depth  (int): Search depth for each book move.
+            cls         : The engine that picks the moves (a MiniMaxer subclass, importable by the workers).
+            workers (int): Processes to search in (default: one per core).
+
+        Returns:
+            {Zobrist key: (move, value for the side to move)}
+    """
+    entries: Dict[int, Tuple[Move, int]] = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for book_side in (1, 2):
+            frontier = {game.CheckersGame()._key: game.CheckersGame()}
+            for ply in range(plies):
+                todo = [board for (key, board) in frontier.items()
+                        if board.player_turn == book_side and key not in entries]
+                results = pool.map(_book_move, itertools.repeat(cls), [b._board for b in todo],
+                        [b.player_turn for b in todo], itertools.repeat(depth), chunksize=4)
+                for (board, result) in zip(todo, results):
+                    entries[board._key] = result
+                progress(f"player {book_side}, ply {ply + 1}/{plies}: {len(frontier)} positions, "
+                        f"{len(entries)} in the book")
+
+                following = {}
+                for (key, board) in frontier.items():
+                    if board.player_turn == book_side:
+                        moves = [entries[key][0]]
+                    else:
+                        moves = legal_moves(board)
+                    for move in moves:
+                        child = game.CheckersGame(board._board, board.player_turn)
+                        child.move(*move, verify=False)
+                        if child.winner is None:
+                            following[child._key] = child
+                frontier = following
+    return entries
+
+
+class RaceDatabase:
+    """
+    Move counts to the goal, for one side's pieces on their own, when all of them are within radius
+    diagonals of the goal: the fewest moves that don't end outside the region. That many moves are enough,
+    but the fewest over the whole board can be less. The file is a uint8 array with an entry for every set of
+    PIECES cells in that region, at the set's rank in the combinatorial number system.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._distances = np.load(path, mmap_mode="r")
+        for radius in range(16):
+            if math.comb(len(_region(radius)), PIECES) == len(self._distances):
+                break
+        else:
+            raise ValueError(f"{path} isn't a race database")
+        self.radius = radius
+        (self._local, self._binomials) = _ranking(radius)
+        # The cells each player's pieces have to be in
+        self._masks = [0, sum(1 << c for c in _region(radius)), sum(1 << (80 - c) for c in _region(radius))]
+
+    def __len__(self) -> int:
+        return len(self._distances)
+
+    def separated(self, board: game.CheckersGame) -> bool:
+        """Whether both sides have all their pieces within the radius of their goals
+        (and so are too far apart to get in each other's way)."""
+        return (board._pieces[1] & ~self._masks[1]) == 0 and (board._pieces[2] & ~self._masks[2]) == 0
+
+    def distance(self, board: game.CheckersGame, player: int) -> Union[int, None]:
+        """How many moves are enough for player to fill their goal, or None if their pieces aren't all in the region
+        (or can't get there without leaving it)."""
+        cells = [c if player == 1 else 80 - c for c in game._bits(board._pieces[player])]
+        local = self._local[cells]
+        if len(local) != PIECES or np.any(local < 0):
+            return None
+        d = int(self._distances[_rank(np.sort(local)[None], self._binomials)[0]])
+        return None if d == UNREACHABLE else d
+
+    @staticmethod
+    def needed(board: game.CheckersGame, player: int) -> int:
+        """The fewest moves player could possibly fill their goal in: every piece outside it has to move."""
+        return bin(board._pieces[player] & ~game.GOAL_MASKS[player]).count("1")
+
+    def lookup(self, board: game.CheckersGame) -> Union[Tuple[Move, int], None]:
+        """
+        In a separated race whose result is certain, the fastest move the database knows of for the side to move,
+        and the value of the position for them: close to WIN_VALUE if they get there first, and close to
+        -WIN_VALUE if they can't. None for other positions.
+        Since the distances are only moves that are enough, a side is sure to win if that's no more than
+        the moves its opponent needs at the very least (the side to move wins a tie, since it moves first).
+        Races that are too close to call this way get searched as usual.
+        """
+        if board.winner is not None or not self.separated(board):
+            return None
+        player = board.player_turn
+        other = game.CheckersGame.opposite[player]
+        theirs = self.distance(board, other)
+        if self.distance(board, player) is None or theirs is None:
+            return None
+        best = None
+        for move in legal_moves(board):
+            board.move(*move, verify=False)
+            d = 0 if board.winner == player else self.distance(board, player)
+            board._unmove()
+            if d is not None and (best is None or d < best[1]):
+                best = (move, d)
+        if best is None:
+            return None
+        (move, d) = best
+        ours = d + 1
+        if ours <= self.needed(board, other):
+            return (move, WIN_VALUE - ours)
+        if theirs < self.needed(board, player):
+            return (move, -(WIN_VALUE - theirs))
+        return None
+
+def _region(radius: int):
+    """Cells within radius diagonals of player 1's goal corner, in order."""
+    return [c for (c, d) in enumerate(game.DIAGONAL) if d <= radius]
+
+
+def _ranking(radius: int):
+    """Region index of every cell (-1 outside), and the binomials that rank sets of region cells."""
+    region = _region(radius)
+    local = np.full(81, -1, dtype=np.int64)
+    local[region] = np.arange(len(region))
+    binomials = np.array([[math.comb(n, k) for k in range(PIECES + 1)] for n in range(len(region))], dtype=np.int64)
+    return (local, binomials)
+
+
+def _rank(sets: np.ndarray, binomials: np.ndarray) -> np.ndarray:
+    """Ranks of sorted (N, PIECES) arrays of region cells: sum over i of comb(cell_i, i + 1)."""
+    return np.sum(binomials[sets, np.arange(1, PIECES + 1)], axis=1)
+
+
+def build_race_database(radius: int = 5, chunk: int = 1 << 14, progress = print) -> np.ndarray:
+    """
+    Move counts to the goal for player 1, for every set of cells within radius diagonals of it.
+    Generates the moves of every set (in C, a chunk of boards at a time), keeps the ones that stay in the region,
+    and then relaxes distance = 1 + the smallest distance of any successor until nothing changes.
+    """
+    region = np.array(_region(radius))
+    (local, binomials) = _ranking(radius)
+    n = math.comb(len(region), PIECES)
+    progress(f"{len(region)} cells, {n} positions")
+    sets = np.empty((n, PIECES), dtype=np.int64)
+    combinations = np.array(list(itertools.combinations(range(len(region)), PIECES)), dtype=np.int64)
+    sets[_rank(combinations, binomials)] = combinations
+    del combinations
+
+    successors = []
+    counts = np.empty(n, dtype=np.int64)
+    for first in range(0, n, chunk):
+        cells = region[sets[first:first + chunk]]
+        m = len(cells)
+        boards = np.zeros((m, 81), dtype=np.int8)
+        boards[np.arange(m)[:, None], cells] = 1
+        (moves, offsets) = legal_moves_batch(boards.reshape(m, 9, 9), np.ones(m, dtype=np.uint8))
+        moves = moves.astype(np.int64)
+        owner = np.repeat(np.arange(m), np.diff(offsets))
+        start = moves[:, 0] * 9 + moves[:, 1]
+        end = moves[:, 2] * 9 + moves[:, 3]
+        inside = local[end] >= 0
+        (owner, start, end) = (owner[inside], start[inside], end[inside])
+        pieces = cells[owner]
+        pieces = np.where(pieces == start[:, None], end[:, None], pieces)
+        successors.append(_rank(np.sort(local[pieces], axis=1), binomials).astype(np.int32))
+        counts[first:first + m] = np.bincount(owner, minlength=m)
+        progress(f"moves of {min(first + chunk, n)}/{n} positions")
+    successors = np.concatenate(successors)
+
+    goal = np.sort(local[list(game._bits(game.GOAL_MASKS[1]))])
+    distances = np.full(n, UNREACHABLE, dtype=np.int64)
+    distances[_rank(goal[None], binomials)[0]] = 0
+    has_moves = counts > 0
+    starts = (np.cumsum(counts) - counts)[has_moves]
+    for iteration in itertools.count(1):
+        best = np.full(n, UNREACHABLE, dtype=np.int64)
+        best[has_moves] = np.minimum.reduceat(distances[successors], starts)
+        updated = np.minimum(distances, np.where(best < UNREACHABLE, best + 1, UNREACHABLE))
+        if np.array_equal(updated, distances):
+            break
+        distances = updated
+        progress(f"iteration {iteration}: {np.sum(distances < UNREACHABLE)} positions solved")
+    assert distances.max() <= UNREACHABLE
+    return distances.astype(np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    o = commands.add_parser("opening", help="build an opening book")
+    o.add_argument("--plies", type=int, default=6, help="how far into the game the book goes (default 6)")
+    o.add_argument("--depth", type=int, default=6, help="search depth of the book moves (default 6)")
+    o.add_argument("--engine", default="minimax:MiniMaxer", help="module:Class that picks the moves")
+    o.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    o.add_argument("--output", default="book.npy")
+    r = commands.add_parser("race", help="build a race database")
+    r.add_argument("--radius", type=int, default=5,
+            help="diagonals from the goal corner that the pieces can be on (default 5: 21 cells, 352716 positions)")
+    r.add_argument("--output", default="race.npy")
+    args = parser.parse_args()
+
+    if args.command == "opening":
+        from tournament import Engine
+        cls = Engine.parse(args.engine).cls
+        entries = build_opening_book(args.plies, args.depth, cls, args.workers)
+        save_opening_book(args.output, entries)
+        print(f"{len(entries)} positions written to {args.output}")
+    else:
+        distances = build_race_database(args.radius)
+        with open(args.output, "wb") as f:
+            np.save(f, distances)
+        solved = distances[distances < UNREACHABLE]
+        print(f"{len(distances)} positions ({len(solved)} can reach the goal inside the region, in at most {solved.max()} moves)"
+                f" written to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
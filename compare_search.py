@@ -0,0 +1,108 @@
+"""
+Compare the search enhancements of MiniMaxer (PVS, aspiration windows and late move reductions)
+against plain alpha-beta on a set of random positions.
+
+For every configuration this reports the nodes searched and the time taken, relative to plain alpha-beta,
+and how good the chosen moves are: how often it picks the same move as plain alpha-beta, and how many
+points its moves lose on average according to a deeper (plain) reference search.
+
+    python compare_search.py --depth 4 --positions 20
+    python compare_search.py --depth 6 --native
+"""
+import argparse
+import json
+import random
+import game
+from ffi import legal_moves # type: ignore
+from minimax import MiniMaxer
+
+CONFIGS = {
+    "plain": {},
+    "pvs": {"use_pvs": True},
+    "aspiration": {"aspiration_window": 3},
+    "lmr": {"lmr_reduction": 1},
+    "all": {"use_pvs": True, "aspiration_window": 3, "lmr_reduction": 1},
+}
+
+
+def random_positions(n: int, max_plies: int, seed: int):
+    """n positions reached by playing up to max_plies random moves from the start."""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        board = game.CheckersGame()
+        for _ in range(rng.randrange(max_plies + 1)):
+            board.move(*rng.choice(legal_moves(board)), verify=False)
+            if board.winner is not None:
+                break
+        if board.winner is None:
+            positions.append(game.CheckersGame(board._board, board.player_turn))
+    return positions
+
+
+def move_values(board: game.CheckersGame, depth: int, native: bool):
+    """Value of every legal move for the player to move, according to a plain search to depth."""
+    reference = MiniMaxer()
+    values = {}
+    for move in legal_moves(board):
+        child = game.CheckersGame(board._board, board.player_turn)
+        child.move(move[0], move[1], verify=False)
+        if child.winner is not None:
+            values[move] = -reference.score(child) if child.player_turn == 1 else reference.score(child)
+        else:
+            reference.find_move(child, depth, native=native)
+            values[move] = -reference.stats.value
+    return values
+
+
+def compare(positions, depth: int, native: bool, reference_depth: int, configs = CONFIGS):
+    results = {name: {"nodes": 0, "time": 0.0, "same_move": 0, "loss": 0} for name in configs}
+    for board in positions:
+        chosen = {}
+        for (name, config) in configs.items():
+            engine = MiniMaxer()
+            for (attribute, value) in config.items():
+                setattr(engine, attribute, value)
+            chosen[name] = engine.find_move(board, depth, native=native)
+            results[name]["nodes"] += engine.stats.nodes
+            results[name]["time"] += engine.stats.time
+
+        values = move_values(board, reference_depth, native)
+        best = max(values.values())
+        for name in configs:
+            results[name]["same_move"] += chosen[name] == chosen["plain"]
+            results[name]["loss"] += best - values[chosen[name]]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=4, help="search depth (default 4)")
+    parser.add_argument("--positions", type=int, default=20, help="number of positions (default 20)")
+    parser.add_argument("--plies", type=int, default=40, help="at most this many random moves per position")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--native", action="store_true", help="run the searches in C")
+    parser.add_argument("--reference-depth", type=int, default=None,
+            help="depth of the search that judges the moves (default: depth + 1)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    positions = random_positions(args.positions, args.plies, args.seed)
+    reference_depth = args.depth + 1 if args.reference_depth is None else args.reference_depth
+    # The reference search looks at each child, so it gets one ply less
+    results = compare(positions, args.depth, args.native, reference_depth - 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    plain = results["plain"]
+    print(f"{len(positions)} positions, depth {args.depth}, {'native' if args.native else 'python'} search,"
+            f" moves judged at depth {reference_depth}")
+    print(f"{'config':<12}{'nodes':>12}{'vs plain':>10}{'time':>9}{'same move':>11}{'avg loss':>10}")
+    for (name, r) in results.items():
+        print(f"{name:<12}{r['nodes']:>12}{r['nodes'] / max(plain['nodes'], 1):>10.2f}{r['time']:>8.2f}s"
+                f"{r['same_move'] / len(positions):>11.0%}{r['loss'] / len(positions):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
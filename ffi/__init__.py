@@ -1,19 +1,210 @@
 from ._legal_moves import ffi, lib # type: ignore
-from typing import List, Tuple
+from typing import List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
 
 Move = Tuple[Tuple[int, int], Tuple[int, int]]
 
+MAX_MOVES = lib.MAX_MOVES
+
+# One scratch buffer per thread, since cffi lets go of the GIL during C calls.
+_scratch = threading.local()
+
+def move_buffer() -> np.ndarray:
+    """Allocate a buffer big enough to hold every legal move of any position."""
+    return np.empty((MAX_MOVES, 4), dtype=np.int8)
+
+def legal_moves_array(board, out=None) -> np.ndarray:
+    """Legal moves for the player whose turn it is, as an (N, 4) int8 array
+       with rows of (y0, x0, y1, x1).
+
+            Parameters:
+                board (CheckersGame): The position.
+                out    (np.ndarray): Optional buffer from move_buffer() to write into.
+                                     By default a per-thread buffer is reused.
+
+            Returns:
+                A view into the buffer. It gets overwritten by the next call that uses the same buffer,
+                so copy it if you need to keep it around.
+    """
+    if out is None:
+        out = getattr(_scratch, "moves", None)
+        if out is None:
+            out = _scratch.moves = move_buffer()
+    _board = ffi.from_buffer('unsigned char[9][9]', board._board)
+    _out = ffi.from_buffer('int8_t[][4]', out)
+
+    n = lib.legalMovesInto(_board, board.player_turn, _out, len(out))
+    assert n >= 0, "move buffer is too small"
+    return out[:n]
+
+def count_legal_moves(board) -> int:
+    return len(legal_moves_array(board))
+
 def legal_moves(board) -> List[Move]:
-    _board = ffi.from_buffer('unsigned char[9][9]', board._board);
+    return [((y0, x0), (y1, x1)) for (y0, x0, y1, x1) in legal_moves_array(board).tolist()]
+
+def _batch(boards: np.ndarray, players: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    out = np.empty((len(boards) * MAX_MOVES, 4), dtype=np.int8)
+    offsets = np.empty(len(boards) + 1, dtype=np.int32)
+
+    total = lib.legalMovesBatch(
+            ffi.from_buffer('unsigned char[][9][9]', boards),
+            ffi.from_buffer('unsigned char[]', players),
+            len(boards),
+            ffi.from_buffer('int8_t[][4]', out), len(out),
+            ffi.from_buffer('int32_t[]', offsets))
+    assert total >= 0
+    # Copy so we don't hang on to the worst-case sized buffer
+    return (out[:total].copy(), offsets)
+
+def legal_moves_batch(boards, players, threads: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Legal moves for many positions in one call.
+
+            Parameters:
+                boards  (array): (N, 9, 9) array of boards, in the same encoding as CheckersGame._board.
+                players (array): (N,) array with the player to move on each board.
+                threads   (int): Split the batch over this many threads. The C code runs without the GIL
+                                 (cffi releases it for every call), so this uses more cores.
+                                 The function doesn't share any buffers, so you can also call it
+                                 from your own threads.
+
+            Returns:
+                (moves, offsets): moves is an (M, 4) int8 array with rows of (y0, x0, y1, x1),
+                    and the moves of board i are moves[offsets[i]:offsets[i + 1]].
+    """
+    boards = np.ascontiguousarray(boards, dtype=np.int8).view(np.uint8)
+    players = np.ascontiguousarray(players, dtype=np.uint8)
+    assert boards.shape[1:] == (9, 9) and players.shape == boards.shape[:1]
+
+    if threads <= 1 or len(boards) < 2 * threads:
+        return _batch(boards, players)
+
+    chunks = np.array_split(np.arange(len(boards)), threads)
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda c: _batch(boards[c[0]:c[-1] + 1], players[c[0]:c[-1] + 1]), chunks))
+
+    # Stitch the chunks back together
+    moves = np.concatenate([m for (m, _) in results])
+    starts = np.cumsum([0] + [len(m) for (m, _) in results[:-1]])
+    offsets = np.concatenate([o[:-1] + s for ((_, o), s) in zip(results, starts)] + [[len(moves)]])
+    return (moves, offsets.astype(np.int32))
+
+class NativeSearch():
+    """
+    Negamax alpha-beta search that runs entirely in C: move generation, make/unmake,
+    transposition table and evaluation. Positions are evaluated with piece-square tables.
+
+            Parameters:
+                weights      (array): (3, 9, 9) table. weights[p][y][x] is what a piece of player p
+                                      on (y, x) is worth to player 1. weights[0] is ignored.
+                bias           (int): Added to the sum of the weights.
+                win_value      (int): Value of a won game for player 1.
+                zobrist      (array): (3, 81) Zobrist keys, laid out like game.ZOBRIST.
+                zobrist_turn (array): (3,) Zobrist keys for the side to move, like game.ZOBRIST_TURN.
+                tt_mb        (float): Memory budget of the transposition table, in megabytes.
+    """
+
+    def __init__(self, weights, bias, win_value, zobrist, zobrist_turn, tt_mb: float = 16):
+        # The params struct only points at these, so we have to keep them alive
+        self._weights = np.ascontiguousarray(weights, dtype=np.int32).reshape(3, 81)
+        self._zobrist = np.ascontiguousarray(zobrist, dtype=np.uint64).reshape(3, 81)
+        self._zobrist_turn = np.ascontiguousarray(zobrist_turn, dtype=np.uint64)
+        self._c_weights = ffi.from_buffer('int32_t[]', self._weights)
+        self._c_zobrist = ffi.from_buffer('uint64_t[]', self._zobrist)
+        self._c_zobrist_turn = ffi.from_buffer('uint64_t[]', self._zobrist_turn)
+
+        n_buckets = max(1, int(tt_mb * 2**20) // (2 * ffi.sizeof('TTEntry')))
+        n_buckets = 1 << (n_buckets.bit_length() - 1)
+        self._table = ffi.new('TTEntry[]', 2 * n_buckets)
+
+        self._params = ffi.new('SearchParams*')
+        self._params.weights = self._c_weights
+        self._params.bias = int(bias)
+        self._params.win_value = int(win_value)
+        self._params.zobrist = self._c_zobrist
+        self._params.zobrist_turn = self._c_zobrist_turn
+        self._params.table = self._table
+        self._params.table_mask = n_buckets - 1
+        self._params.generation = 0
+        self._history = np.zeros(81 * 81, dtype=np.int64)
+        self._killers = np.full(2 * lib.MAX_PLY, 0xFFFF, dtype=np.uint16)
+        self._c_history = ffi.from_buffer('int64_t[]', self._history)
+        self._c_killers = ffi.from_buffer('uint16_t[]', self._killers)
+        self._params.history = self._c_history
+        self._params.killers = self._c_killers
+
+        self.stats = ffi.new('SearchStats*')
+        self._best = ffi.new('int8_t[4]')
+
+    def new_search(self):
+        """Age the transposition table and the move ordering tables before searching a new move,
+        and reset the stats."""
+        self._params.generation = (self._params.generation + 1) & 0xFF
+        self._history >>= 1
+        self._killers.fill(0xFFFF)
+        self.stats = ffi.new('SearchStats*')
+
+    def set_pruning(self, pvs: bool = False, lmr_depth: int = 3, lmr_moves: int = 3, lmr_reduction: int = 0):
+        """Switch principal variation search and late move reductions on or off
+        (see SearchParams in search.h). Both are off to begin with."""
+        self._params.pvs = int(pvs)
+        self._params.lmr_depth = lmr_depth
+        self._params.lmr_moves = lmr_moves
+        self._params.lmr_reduction = lmr_reduction
+
+    def search(self, board, depth: int, alpha: Union[int, None] = None, beta: Union[int, None] = None,
+            max_nodes: int = 0, time_limit_ms: int = 0, count_stats: bool = True):
+        """Search a CheckersGame to a fixed depth, by default with a full window.
+
+                Parameters:
+                    max_nodes     (int): Give up once stats.nodes reaches this. 0 means no limit.
+                    time_limit_ms (int): Give up after this many milliseconds. 0 means no limit.
+                    count_stats  (bool): Keep all of stats. Off, only nodes and aborted are kept.
 
-    _ret = lib.getLegalMoves(_board, board.player_turn)
+                Returns:
+                    (value, move): value is from the point of view of the player to move, and move is
+                        ((y0, x0), (y1, x1)) or None if there was nothing to play.
+                        If the search gave up, stats.aborted is set and the result is meaningless.
+        """
+        # The killer moves are kept for MAX_PLY plies
+        assert 0 <= depth < lib.MAX_PLY, f"can't search deeper than {lib.MAX_PLY - 1} plies"
+        self._params.max_nodes = max_nodes
+        self._params.time_limit_ms = time_limit_ms
+        self._params.count_stats = int(count_stats)
+        if alpha is None:
+            alpha = -2 * self._params.win_value
+        if beta is None:
+            beta = 2 * self._params.win_value
+        _board = ffi.from_buffer('unsigned char[9][9]', board._board)
+        value = lib.negamaxSearch(_board, board.player_turn, depth, alpha, beta,
+                self._params, self.stats, self._best)
+        (y0, x0, y1, x1) = self._best
+        return (value, None if y0 < 0 else ((y0, x0), (y1, x1)))
 
-    moves = []
-    while _ret != ffi.NULL:
-        move = _ret.data
-        (start, end) = (move.start, move.end)
-        moves.append(((start.y, start.x), (end.y, end.x)))
+    def playouts(self, board, n: int, max_plies: int, greedy: float = 0.0, seed: int = 0):
+        """Play n games out from a CheckersGame, for Monte Carlo tree search (see playoutBatch in search.h).
+        Nothing is shared between calls, so different threads can run playouts on the same NativeSearch at once.
 
-        _ret = _ret.next
+                Returns:
+                    (winners, values, moves): (n,) arrays of the winner of each playout (0 if it ran out of plies),
+                        and of the piece-square evaluation for player 1 where it stopped,
+                        and how many moves were played in all.
+        """
+        winners = np.empty(n, dtype=np.uint8)
+        values = np.empty(n, dtype=np.int32)
+        _board = ffi.from_buffer('unsigned char[9][9]', board._board)
+        moves = lib.playoutBatch(_board, board.player_turn, n, max_plies, greedy,
+                seed & 0xFFFFFFFFFFFFFFFF, self._params,
+                ffi.from_buffer('uint8_t[]', winners), ffi.from_buffer('int32_t[]', values))
+        return (winners, values, moves)
 
-    return moves
+    def principal(self, key: int) -> Union[Move, None]:
+        """The best move stored in the transposition table for a position's Zobrist key, if any."""
+        i = (key & self._params.table_mask) << 1
+        for entry in (self._table[i], self._table[i + 1]):
+            if entry.key == key and entry.depth > 0 and entry.move != 0xFFFF:
+                (start, end) = (entry.move >> 8, entry.move & 0xFF)
+                return ((start // 9, start % 9), (end // 9, end % 9))
+        return None
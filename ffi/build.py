@@ -18,17 +18,73 @@ ffibuilder.cdef("""
      } MoveNode;
 
      MoveNode* getLegalMoves(unsigned char board[9][9], unsigned char player);
+     void freeMoveList(MoveNode* list);
+
+     #define MAX_MOVES ...
+     int legalMovesInto(const unsigned char board[9][9], unsigned char player,
+                        int8_t out[][4], int max_moves);
+     int legalMovesBatch(const unsigned char boards[][9][9], const unsigned char players[], int n,
+                         int8_t out[][4], int max_moves, int32_t offsets[]);
+
+     typedef struct tt_entry {
+        uint64_t key;
+        int32_t value;
+        uint16_t move;
+        int8_t depth;
+        uint8_t flag;
+        uint8_t generation;
+     } TTEntry;
+
+     typedef struct search_stats {
+        int64_t nodes;
+        int64_t leaves;
+        int64_t tt_probes;
+        int64_t tt_hits;
+        int64_t tt_cutoffs;
+        int64_t beta_cutoffs;
+        int64_t first_move_cutoffs;
+        int32_t aborted;
+     } SearchStats;
+
+     #define MAX_PLY ...
+
+     typedef struct search_params {
+        const int32_t* weights;
+        int32_t bias;
+        int32_t win_value;
+        const uint64_t* zobrist;
+        const uint64_t* zobrist_turn;
+        TTEntry* table;
+        uint64_t table_mask;
+        uint8_t generation;
+        int64_t* history;
+        uint16_t* killers;
+        int64_t max_nodes;
+        int64_t time_limit_ms;
+        int32_t pvs;
+        int32_t lmr_depth;
+        int32_t lmr_moves;
+        int32_t lmr_reduction;
+        int32_t count_stats;
+     } SearchParams;
+
+     int32_t negamaxSearch(const unsigned char board[9][9], unsigned char player, int depth,
+                           int32_t alpha, int32_t beta, const SearchParams* params, SearchStats* stats, int8_t best[4]);
+     int64_t playoutBatch(const unsigned char board[9][9], unsigned char player, int n, int max_plies,
+                          double greedy, uint64_t seed, const SearchParams* params,
+                          uint8_t winners[], int32_t values[]);
     """);
 
 ffibuilder.set_source("_legal_moves",
         """
         #include "legal.h"
+        #include "search.h"
         """,
 #        extra_compile_args = ["-O3",
 #           "-ftree-vectorize",
 #           "-msse2",
 #           "-mfpmath=sse"],
-        sources = ["legal.c"])
+        sources = ["legal.c", "search.c"])
 
 if __name__ == "__main__":
     ffibuilder.compile(verbose=True)
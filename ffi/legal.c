@@ -119,6 +119,84 @@ MoveNode* getLegalMoves(uchar_t board[9][9], uchar_t player) {
     return ret_list;
 }
 
+void freeMoveList(MoveNode* list) {
+    while (list != NULL) {
+        MoveNode* next = list->next;
+        free(list);
+        list = next;
+    }
+}
+
+int legalMovesInto(const uchar_t board[9][9], uchar_t player, int8_t out[][4], int max_moves) {
+    char visited[9][9];
+    // Every square gets pushed at most once, since we mark it visited when it's pushed.
+    Point to_visit[81];
+    int n = 0;
+
+#define EMIT(S, E) do {                                     \
+        if (n >= max_moves) return -1;                      \
+        out[n][0] = S.y; out[n][1] = S.x;                   \
+        out[n][2] = E.y; out[n][3] = E.x;                   \
+        n++;                                                \
+    } while (0)
+
+    int rem_points = 10;
+    for (int y = 0; y < 9 && rem_points > 0; y++) {
+        for (int x = 0; x < 9 && rem_points > 0; x++) {
+            if (board[y][x] != player) continue;
+            rem_points--;
+            memset(visited, 0, sizeof(visited));
+
+            const Point start = {y, x};
+            visited[y][x] = 1;
+            // Single steps. Like getLegalMoves, we can't hop back onto these squares.
+            for (int i = 0; i < 6; i++) {
+                Point adj = pointAdd(start, DIRECTIONS[i]);
+                if (!IN_BOUNDS(adj)) continue;
+                visited[adj.y][adj.x] = 1;
+                if (!board[adj.y][adj.x] && zoneLocks(start, adj, player))
+                    EMIT(start, adj);
+            }
+            // Hops. The piece has been picked up, so it can't be hopped over.
+            int top = 0;
+            to_visit[top++] = start;
+            while (top > 0) {
+                Point cur = to_visit[--top];
+                for (int i = 0; i < 6; i++) {
+                    Point direction = DIRECTIONS[i];
+                    Point o = pointAdd(cur, direction);
+                    Point d = pointAdd(o, direction);
+
+                    if (IN_BOUNDS(d) && board[o.y][o.x] &&
+                        !(o.y == y && o.x == x) &&
+                        !board[d.y][d.x] && !visited[d.y][d.x]) {
+
+                        visited[d.y][d.x] = 1;
+                        to_visit[top++] = d;
+                        if (zoneLocks(start, d, player))
+                            EMIT(start, d);
+                    }
+                }
+            }
+        }
+    }
+#undef EMIT
+    return n;
+}
+
+int legalMovesBatch(const uchar_t boards[][9][9], const uchar_t players[], int n,
+                    int8_t out[][4], int max_moves, int32_t offsets[]) {
+    int total = 0;
+    for (int i = 0; i < n; i++) {
+        offsets[i] = total;
+        int count = legalMovesInto(boards[i], players[i], out + total, max_moves - total);
+        if (count < 0) return -1;
+        total += count;
+    }
+    offsets[n] = total;
+    return total;
+}
+
 bool zoneLocks(Point start, Point end, uchar_t color) {
     const uchar_t start_zone = ZONE(start.y + start.x);
     const uchar_t end_zone   = ZONE(  end.y +   end.x);
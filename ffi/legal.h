@@ -20,6 +20,22 @@ typedef struct move2_node {
 
 
 MoveNode* getLegalMoves(unsigned char board[9][9], unsigned char player);
+void freeMoveList(MoveNode* list);
+
+// A player has at most 10 pieces, and each one can reach at most 80 squares.
+#define MAX_MOVES 800
+
+// Allocation-free version of getLegalMoves.
+// Writes each move as a row of {y0, x0, y1, x1} into out, and returns the number of moves.
+// Returns -1 if there are more than max_moves moves.
+int legalMovesInto(const unsigned char board[9][9], unsigned char player,
+                   int8_t out[][4], int max_moves);
+
+// legalMovesInto for n boards at once. players[i] is the side to move on boards[i].
+// The moves of board i end up in out[offsets[i]] up to out[offsets[i + 1]], so offsets needs n + 1 entries.
+// Returns the total number of moves, or -1 if there are more than max_moves.
+int legalMovesBatch(const unsigned char boards[][9][9], const unsigned char players[], int n,
+                    int8_t out[][4], int max_moves, int32_t offsets[]);
 
 // This stuff doesn't need to get exported
 Point pointAdd(Point a, Point b);
@@ -0,0 +1,356 @@
+#include <stdint.h>
+#include <stdbool.h>
+#include <string.h>
+#include <time.h>
+
+#include "legal.h"
+#include "search.h"
+
+#define NO_MOVE         0xFFFF
+#define EXACT           0
+#define LOWER           1
+#define UPPER           2
+#define ZONE(DIAG)      ((DIAG) <= 3) ? 2 : ((DIAG) >= 13)
+#define uchar_t         unsigned char
+// How often (in nodes) to look at the clock
+#define CHECK_INTERVAL  1024
+
+// The state of a search in progress. Everything is updated incrementally by makeMove/unmakeMove.
+typedef struct search_state {
+    uchar_t board[9][9];
+    uchar_t player;
+    uchar_t winner;
+    // Number of pieces (of any color) in each zone, for spotting wins
+    int zone_count[3];
+    // Piece-square score for player 1, not counting the bias
+    int32_t score;
+    uint64_t key;
+    const SearchParams* params;
+    SearchStats* stats;
+    // When the search has to stop, in milliseconds since whenever nowMs counts from
+    int64_t deadline_ms;
+} SearchState;
+
+static int64_t nowMs(void) {
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return (int64_t) ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+}
+
+// Check the node and time budgets. Once this returns true, every caller unwinds
+//   without storing anything, and the result of the search is garbage.
+static bool outOfBudget(SearchState* s) {
+    SearchStats* stats = s->stats;
+    if (stats->aborted) return true;
+    const SearchParams* p = s->params;
+    if (p->max_nodes > 0 && stats->nodes >= p->max_nodes)
+        stats->aborted = 1;
+    else if (p->time_limit_ms > 0 && stats->nodes % CHECK_INTERVAL == 0 && nowMs() >= s->deadline_ms)
+        stats->aborted = 1;
+    return stats->aborted;
+}
+
+static inline int cellZone(int y, int x) {
+    return ZONE(y + x);
+}
+
+static void makeMove(SearchState* s, const int8_t m[4]) {
+    const SearchParams* p = s->params;
+    const int from = m[0] * 9 + m[1], to = m[2] * 9 + m[3];
+    const uchar_t color = s->board[m[0]][m[1]];
+
+    s->board[m[0]][m[1]] = 0;
+    s->board[m[2]][m[3]] = color;
+    s->zone_count[cellZone(m[0], m[1])]--;
+    const int end_zone = cellZone(m[2], m[3]);
+    s->zone_count[end_zone]++;
+    s->score += p->weights[color * 81 + to] - p->weights[color * 81 + from];
+    s->key ^= p->zobrist[color * 81 + from] ^ p->zobrist[color * 81 + to]
+            ^ p->zobrist_turn[1] ^ p->zobrist_turn[2];
+
+    // Same rule as CheckersGame.move: landing in a home zone when the goal fills up wins.
+    const int goal = s->player % 2 + 1;
+    if (end_zone > 0 && s->zone_count[goal] == 10)
+        s->winner = s->player;
+    s->player = goal;
+}
+
+static void unmakeMove(SearchState* s, const int8_t m[4]) {
+    const SearchParams* p = s->params;
+    const int from = m[0] * 9 + m[1], to = m[2] * 9 + m[3];
+    const uchar_t color = s->board[m[2]][m[3]];
+
+    s->board[m[2]][m[3]] = 0;
+    s->board[m[0]][m[1]] = color;
+    s->zone_count[cellZone(m[2], m[3])]--;
+    s->zone_count[cellZone(m[0], m[1])]++;
+    s->score -= p->weights[color * 81 + to] - p->weights[color * 81 + from];
+    s->key ^= p->zobrist[color * 81 + from] ^ p->zobrist[color * 81 + to]
+            ^ p->zobrist_turn[1] ^ p->zobrist_turn[2];
+    s->winner = 0;
+    s->player = s->player % 2 + 1;
+}
+
+static inline uint16_t packMove(const int8_t m[4]) {
+    return (uint16_t) (((m[0] * 9 + m[1]) << 8) | (m[2] * 9 + m[3]));
+}
+
+static TTEntry* ttProbe(const SearchParams* p, uint64_t key) {
+    TTEntry* bucket = p->table + ((key & p->table_mask) << 1);
+    if (bucket[0].key == key && bucket[0].depth > 0) return bucket;
+    if (bucket[1].key == key && bucket[1].depth > 0) return bucket + 1;
+    return NULL;
+}
+
+static void ttStore(const SearchParams* p, uint64_t key, int32_t value, int depth, uint8_t flag, uint16_t move) {
+    TTEntry* e = p->table + ((key & p->table_mask) << 1);
+    // Depth-preferred slot first, then the always-replace slot, like TranspositionTable.store
+    if (!(e->key == key || e->depth <= 0 || e->generation != p->generation || depth >= e->depth))
+        e++;
+    *e = (TTEntry) {key, value, move, (int8_t) depth, flag, p->generation};
+}
+
+// Move ordering, same as MiniMaxer._order_moves: the principal move, then the killers,
+//   then history score and how far forward the move goes.
+#define ORDER_PRINCIPAL (1LL << 62)
+#define ORDER_KILLER1   (1LL << 61)
+#define ORDER_KILLER2   (1LL << 60)
+
+static void scoreMoves(const SearchState* s, int8_t moves[][4], int n, const uint16_t killers[2], uint16_t tt_move,
+                       int64_t scores[]) {
+    const SearchParams* p = s->params;
+    for (int i = 0; i < n; i++) {
+        const uint16_t packed = packMove(moves[i]);
+        if (packed == tt_move) scores[i] = ORDER_PRINCIPAL;
+        else if (packed == killers[0]) scores[i] = ORDER_KILLER1;
+        else if (packed == killers[1]) scores[i] = ORDER_KILLER2;
+        else {
+            int forward = (moves[i][0] + moves[i][1]) - (moves[i][2] + moves[i][3]);
+            if (s->player == 2) forward = -forward;
+            scores[i] = p->history[(packed >> 8) * 81 + (packed & 0xFF)] * 64 + forward;
+        }
+    }
+}
+
+// Bring the best scoring move in [i, n) to position i. The moves in between shift down,
+//   so that this works out the same as a stable sort.
+static void pickMove(int8_t moves[][4], int64_t scores[], int i, int n) {
+    int best = i;
+    for (int j = i + 1; j < n; j++)
+        if (scores[j] > scores[best]) best = j;
+    if (best == i) return;
+
+    int8_t move[4];
+    const int64_t score = scores[best];
+    memcpy(move, moves[best], 4);
+    memmove(moves[i + 1], moves[i], 4 * (best - i));
+    memmove(scores + i + 1, scores + i, sizeof(int64_t) * (best - i));
+    memcpy(moves[i], move, 4);
+    scores[i] = score;
+}
+
+static int32_t negamax(SearchState* s, int32_t alpha, int32_t beta, int depth, int ply, int8_t best[4]) {
+    const SearchParams* p = s->params;
+    s->stats->nodes++;
+    if (outOfBudget(s)) return 0;
+
+    const int32_t alpha_orig = alpha;
+    const uint64_t key = s->key;
+    TTEntry* tt = ttProbe(p, key);
+    uint16_t tt_move = NO_MOVE;
+    const bool count = p->count_stats;
+    if (count) s->stats->tt_probes++;
+    if (tt != NULL) {
+        if (count) s->stats->tt_hits++;
+        tt_move = tt->move;
+        if (tt->depth >= depth) {
+            bool cutoff = tt->flag == EXACT;
+            if (tt->flag == LOWER && tt->value > alpha) alpha = tt->value;
+            else if (tt->flag == UPPER && tt->value < beta) beta = tt->value;
+            if (cutoff || alpha >= beta) {
+                if (count) s->stats->tt_cutoffs++;
+                if (best != NULL && tt_move != NO_MOVE) {
+                    best[0] = (tt_move >> 8) / 9; best[1] = (tt_move >> 8) % 9;
+                    best[2] = (tt_move & 0xFF) / 9; best[3] = (tt_move & 0xFF) % 9;
+                }
+                return tt->value;
+            }
+        }
+    }
+
+    if (s->winner || depth == 0) {
+        if (count) s->stats->leaves++;
+        int32_t score = s->winner ? (s->winner == 1 ? p->win_value : -p->win_value)
+                                  : p->bias + s->score;
+        return s->player == 1 ? score : -score;
+    }
+
+    int8_t moves[MAX_MOVES][4];
+    int n = legalMovesInto((const uchar_t (*)[9]) s->board, s->player, moves, MAX_MOVES);
+
+    // The killer table only goes MAX_PLY deep. Anything deeper (NativeSearch.search doesn't allow it) goes without.
+    uint16_t no_killers[2] = {NO_MOVE, NO_MOVE};
+    uint16_t* killers = ply < MAX_PLY ? p->killers + 2 * ply : no_killers;
+    int64_t scores[MAX_MOVES];
+    scoreMoves(s, moves, n, killers, tt_move, scores);
+
+    int32_t value = -p->win_value * 2;
+    int best_index = -1;
+    for (int i = 0; i < n; i++) {
+        pickMove(moves, scores, i, n);
+        const uint16_t packed = packMove(moves[i]);
+        int reduction = 0;
+        if (p->lmr_reduction > 0 && i >= p->lmr_moves && depth >= p->lmr_depth
+                && packed != tt_move && packed != killers[0] && packed != killers[1]) {
+            int forward = (moves[i][0] + moves[i][1]) - (moves[i][2] + moves[i][3]);
+            if (s->player == 2) forward = -forward;
+            if (forward <= 0) {
+                reduction = p->lmr_reduction;
+                if (reduction > depth - 1) reduction = depth - 1;
+            }
+        }
+
+        makeMove(s, moves[i]);
+        int32_t move_val;
+        if (i == 0 || (!p->pvs && reduction == 0)) {
+            move_val = -negamax(s, -beta, -alpha, depth - 1, ply + 1, NULL);
+        } else {
+            // Try to show this move is no better than what we have, cheaply
+            const int32_t bound = p->pvs ? alpha + 1 : beta;
+            move_val = -negamax(s, -bound, -alpha, depth - 1 - reduction, ply + 1, NULL);
+            if (reduction > 0 && move_val > alpha && !s->stats->aborted)
+                move_val = -negamax(s, -bound, -alpha, depth - 1, ply + 1, NULL);
+            if (p->pvs && move_val > alpha && move_val < beta && !s->stats->aborted)
+                move_val = -negamax(s, -beta, -alpha, depth - 1, ply + 1, NULL);
+        }
+        unmakeMove(s, moves[i]);
+        if (s->stats->aborted) return 0;
+
+        if (move_val > value) {
+            value = move_val;
+            best_index = i;
+        }
+        if (value > alpha) alpha = value;
+        if (alpha >= beta) {
+            if (count) {
+                s->stats->beta_cutoffs++;
+                if (i == 0) s->stats->first_move_cutoffs++;
+            }
+            // Remember what caused the cutoff
+            if (packed != tt_move && packed != killers[0]) {
+                killers[1] = killers[0];
+                killers[0] = packed;
+            }
+            p->history[(packed >> 8) * 81 + (packed & 0xFF)] += depth * depth;
+            break;
+        }
+    }
+
+    uint8_t flag = EXACT;
+    if (value <= alpha_orig) flag = UPPER;
+    else if (value >= beta) flag = LOWER;
+    ttStore(p, key, value, depth, flag, best_index < 0 ? NO_MOVE : packMove(moves[best_index]));
+
+    if (best != NULL && best_index >= 0)
+        memcpy(best, moves[best_index], 4);
+    return value;
+}
+
+static void initState(SearchState* s, const uchar_t board[9][9], uchar_t player,
+                      const SearchParams* params, SearchStats* stats) {
+    memcpy(s->board, board, sizeof(s->board));
+    s->player = player;
+    s->winner = 0;
+    s->score = 0;
+    s->key = params->zobrist_turn[player];
+    memset(s->zone_count, 0, sizeof(s->zone_count));
+    for (int y = 0; y < 9; y++) {
+        for (int x = 0; x < 9; x++) {
+            const uchar_t color = board[y][x];
+            if (!color) continue;
+            s->zone_count[cellZone(y, x)]++;
+            s->score += params->weights[color * 81 + y * 9 + x];
+            s->key ^= params->zobrist[color * 81 + y * 9 + x];
+        }
+    }
+    s->params = params;
+    s->stats = stats;
+}
+
+int32_t negamaxSearch(const uchar_t board[9][9], uchar_t player, int depth,
+                      int32_t alpha, int32_t beta, const SearchParams* params, SearchStats* stats, int8_t best[4]) {
+    SearchState s;
+    initState(&s, board, player, params, stats);
+    s.deadline_ms = nowMs() + params->time_limit_ms;
+    stats->aborted = 0;
+
+    memset(best, -1, 4);
+    return negamax(&s, alpha, beta, depth, 0, best);
+}
+
+// splitmix64, to turn the seed and the playout number into a starting state for the generator
+static uint64_t mixSeed(uint64_t x) {
+    x += 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+
+// xorshift64*
+static inline uint64_t nextRandom(uint64_t* state) {
+    uint64_t x = *state;
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    *state = x;
+    return x * 0x2545F4914F6CDD1DULL;
+}
+
+// A number in [0, n)
+static inline int randomBelow(uint64_t* state, int n) {
+    return (int) ((nextRandom(state) >> 32) * (uint64_t) n >> 32);
+}
+
+int64_t playoutBatch(const uchar_t board[9][9], uchar_t player, int n, int max_plies,
+                     double greedy, uint64_t seed, const SearchParams* params,
+                     uint8_t winners[], int32_t values[]) {
+    // Compare against the top 53 bits of a random number, like a double in [0, 1) would
+    const uint64_t greedy_threshold = greedy >= 1 ? UINT64_MAX : (uint64_t) (greedy * 9007199254740992.0);
+    int8_t moves[MAX_MOVES][4];
+    int64_t total = 0;
+    for (int i = 0; i < n; i++) {
+        SearchState s;
+        initState(&s, board, player, params, NULL);
+        uint64_t rng = mixSeed(seed + (uint64_t) i) | 1;
+        for (int ply = 0; ply < max_plies && !s.winner; ply++) {
+            const int count = legalMovesInto((const uchar_t (*)[9]) s.board, s.player, moves, MAX_MOVES);
+            if (count <= 0) break;
+            int chosen;
+            if ((nextRandom(&rng) >> 11) < greedy_threshold) {
+                // The move that gains the most, picking one of the ties at random (reservoir sampling)
+                const int32_t* w = params->weights + s.player * 81;
+                int32_t best = INT32_MIN;
+                int ties = 0;
+                chosen = 0;
+                for (int j = 0; j < count; j++) {
+                    int32_t gain = w[moves[j][2] * 9 + moves[j][3]] - w[moves[j][0] * 9 + moves[j][1]];
+                    if (s.player == 2) gain = -gain;
+                    if (gain > best) {
+                        best = gain;
+                        chosen = j;
+                        ties = 1;
+                    } else if (gain == best && randomBelow(&rng, ++ties) == 0) {
+                        chosen = j;
+                    }
+                }
+            } else {
+                chosen = randomBelow(&rng, count);
+            }
+            makeMove(&s, moves[chosen]);
+            total++;
+        }
+        winners[i] = s.winner;
+        values[i] = s.params->bias + s.score;
+    }
+    return total;
+}
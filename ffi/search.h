@@ -0,0 +1,80 @@
+#pragma once
+#include <stdint.h>
+#include <stdbool.h>
+
+// This stuff gets exported
+
+// Transposition table entry, laid out like a bucket slot of the python TranspositionTable.
+// A depth of 0 means the slot is empty (leaves are never stored).
+typedef struct tt_entry {
+    uint64_t key;
+    int32_t value;
+    uint16_t move;
+    int8_t depth;
+    uint8_t flag;
+    uint8_t generation;
+} TTEntry;
+
+typedef struct search_stats {
+    int64_t nodes;
+    int64_t leaves;
+    int64_t tt_probes;
+    int64_t tt_hits;
+    // Nodes answered straight from the table
+    int64_t tt_cutoffs;
+    int64_t beta_cutoffs;
+    // Beta cutoffs on the first move tried
+    int64_t first_move_cutoffs;
+    // Set if the search ran out of nodes or time
+    int32_t aborted;
+} SearchStats;
+
+// Deepest search the killer move table has room for
+#define MAX_PLY 65
+
+// Everything the search needs besides the position. The history and killer tables are updated as it goes.
+typedef struct search_params {
+    // weights[p][y * 9 + x] is the value (for player 1) of player p having a piece on (y, x).
+    const int32_t* weights;
+    int32_t bias;
+    int32_t win_value;
+    // Zobrist keys, same layout as game.ZOBRIST and game.ZOBRIST_TURN
+    const uint64_t* zobrist;
+    const uint64_t* zobrist_turn;
+    // Transposition table: 2 * (table_mask + 1) entries
+    TTEntry* table;
+    uint64_t table_mask;
+    uint8_t generation;
+    // Move ordering: a history score per (from, to) cell pair (81 * 81),
+    //   and two killer moves per ply (2 * MAX_PLY), packed like game.pack_move.
+    int64_t* history;
+    uint16_t* killers;
+    // Give up once stats->nodes reaches max_nodes, or after time_limit_ms. 0 means no limit.
+    int64_t max_nodes;
+    int64_t time_limit_ms;
+    // Principal variation search: everything after the first move gets a null window first.
+    int32_t pvs;
+    // Late move reductions: search quiet moves (ones that don't go forward, and aren't the principal
+    //   or a killer move) lmr_reduction plies shallower, once lmr_moves moves have been tried
+    //   at a node with at least lmr_depth plies left. A reduction of 0 turns this off.
+    int32_t lmr_depth;
+    int32_t lmr_moves;
+    int32_t lmr_reduction;
+    // Whether to keep the stats besides nodes and aborted (which the budget needs)
+    int32_t count_stats;
+} SearchParams;
+
+// Negamax alpha-beta search of one position to a fixed depth, inside the window (alpha, beta).
+// Returns the value for the player to move, and writes the best move as {y0, x0, y1, x1} into best
+// (or -1s if there are no moves to make).
+int32_t negamaxSearch(const unsigned char board[9][9], unsigned char player, int depth,
+                      int32_t alpha, int32_t beta, const SearchParams* params, SearchStats* stats, int8_t best[4]);
+
+// Playouts for Monte Carlo tree search: n games from the position, each of at most max_plies moves.
+// Each move is, with probability greedy, the one that gains the most piece-square score for the player
+//   making it (ties broken at random), and otherwise a random legal move.
+// winners[i] is who won playout i (0 if nobody did in time), and values[i] is the piece-square evaluation
+//   for player 1 (bias included) of the position it ended in. Returns the total number of moves played.
+int64_t playoutBatch(const unsigned char board[9][9], unsigned char player, int n, int max_plies,
+                     double greedy, uint64_t seed, const SearchParams* params,
+                     uint8_t winners[], int32_t values[]);
@@ -7,6 +7,8 @@ class CheckersGame():
     """
    
     opposite = [0, 2, 1]
+    # The game logic is locked at 2 players for now
+    n_players = 2
 
     def __init__(self, board = None, to_move: int = 1):
         # The board is a numpy array so that we can copy it really fast
@@ -14,9 +16,37 @@ class CheckersGame():
             board = FULL_BOARD
             to_move = 1
         self._board = np.copy(board)
+        # The array above is kept as a view for the server and for heuristics,
+        #   but the real work is done on one 81-bit occupancy int per color.
+        #   Bit (y * 9 + x) is set if that color has a piece at (y, x).
+        self._pieces = [0] + [
+                sum(1 << int(c) for c in np.flatnonzero(self._board == p))
+                for p in (1, 2)]
         self.winner = None
         self.player_turn = to_move
         self.history = []
+        # 64 bit Zobrist key of the position, kept up to date by move/_unmove
+        self._key = ZOBRIST_TURN[to_move] ^ _xor_all(
+                ZOBRIST[p][c] for p in (1, 2) for c in _bits(self._pieces[p]))
+        # Progress aggregates for heuristics, also kept up to date by move/_unmove.
+        #   coordinate_sum[p] is the sum of y + x over player p's pieces,
+        #   in_goal[p] counts player p's pieces that are in p's goal,
+        #   and _diagonals[p][d] counts player p's pieces with y + x == d.
+        self.coordinate_sum = [0, 0, 0]
+        self.in_goal = [0, 0, 0]
+        self._diagonals = [[0] * 17 for p in range(3)]
+        for p in (1, 2):
+            for c in _bits(self._pieces[p]):
+                self.coordinate_sum[p] += DIAGONAL[c]
+                self.in_goal[p] += GOAL_MASKS[p] >> c & 1
+                self._diagonals[p][DIAGONAL[c]] += 1
+
+    @classmethod
+    def new_game(cls, n_players: int = 2):
+        """A game at the starting position. Raises ValueError for a number of players we can't do yet."""
+        if n_players != cls.n_players:
+            raise ValueError(f"only {cls.n_players} player games are supported")
+        return cls()
 
     def move(self, start, end, verify=True) -> None:
         """
@@ -40,15 +70,28 @@ class CheckersGame():
             assert self._board[start] == self.player_turn
             assert self.winner is None
        
+        s = start[0] * 9 + start[1]
+        e = end[0] * 9 + end[1]
+        pieces = self._pieces
+        # Only the player to move has pieces that can move. This is checked even without verify,
+        #   since moving a piece that isn't there would quietly corrupt _pieces and _key.
+        color = self.player_turn
+        assert pieces[color] >> s & 1, "no piece of the player to move there"
+
         # Move pieces
-        self._board[end] = self._board[start]
+        pieces[color] ^= (1 << s) | (1 << e)
+        zobrist = ZOBRIST[color]
+        self._key ^= zobrist[s] ^ zobrist[e] ^ ZOBRIST_TURN_FLIP
+        self._shift(color, s, e)
+        self._board[end] = color
         self._board[start] = 0
 
         # Check the winner
+        goal = ZONE_MASKS[CheckersGame.opposite[self.player_turn]]
         # Is the destination in a home zone?
-        if (FULL_BOARD[end] > 0
+        if (HOME_MASK >> e & 1
             # Is the home zone full?
-            and np.all(self._board[START_ZONES[CheckersGame.opposite[self.player_turn]]])):
+            and (pieces[1] | pieces[2]) & goal == goal):
                 # Then the game is over, and the winner is whoever's goal zone is full
                 # This rule prevents blocking: if you sit in an opponent's goal zone,
                 #   then your piece counts towards their completion.
@@ -63,10 +106,43 @@ class CheckersGame():
         'unmake' a recent move. Don't do this please.
         """
         (start, end) = self.history.pop()
-        self._board[start] = self._board[end]
+        s = start[0] * 9 + start[1]
+        e = end[0] * 9 + end[1]
+        color = 1 if self._pieces[1] >> e & 1 else 2
+        self._pieces[color] ^= (1 << s) | (1 << e)
+        zobrist = ZOBRIST[color]
+        self._key ^= zobrist[s] ^ zobrist[e] ^ ZOBRIST_TURN_FLIP
+        self._shift(color, e, s)
+        self._board[start] = color
         self._board[end] = 0
         self.winner = None
         self.player_turn = CheckersGame.opposite[self.player_turn]
+
+    def _shift(self, color, s, e):
+        """Update the progress aggregates for a piece of color moving from cell s to cell e."""
+        (ds, de) = (DIAGONAL[s], DIAGONAL[e])
+        self.coordinate_sum[color] += de - ds
+        goal = GOAL_MASKS[color]
+        self.in_goal[color] += (goal >> e & 1) - (goal >> s & 1)
+        diagonals = self._diagonals[color]
+        diagonals[ds] -= 1
+        diagonals[de] += 1
+
+    def rearmost(self, player) -> int:
+        """How many diagonals player's rearmost piece still has to go to reach its goal zone.
+           This is 0 once every piece is in (or past) the goal."""
+        diagonals = self._diagonals[player]
+        if player == 1:
+            # Player 1 heads for the top left corner, where y + x <= 3
+            for d in range(16, 3, -1):
+                if diagonals[d]:
+                    return d - 3
+        else:
+            # Player 2 heads for the bottom right corner, where y + x >= 13
+            for d in range(0, 13):
+                if diagonals[d]:
+                    return 13 - d
+        return 0
         
 
     def is_legal(self, start, end) -> bool:
@@ -80,10 +156,20 @@ class CheckersGame():
                 Returns:
                     bool
         """
-        return self.board(end) == 0                    \
-                and self.board(start) > 0              \
-                and self._check_zone_locks(start, end) \
-                and self.exists_path(start, end)
+        if not (self._index_on_board(start) and self._index_on_board(end)):
+            return False
+        s = start[0] * 9 + start[1]
+        e = end[0] * 9 + end[1]
+        pieces = self._pieces
+        if (pieces[1] | pieces[2]) >> e & 1:
+            return False
+        if pieces[1] >> s & 1:
+            color = 1
+        elif pieces[2] >> s & 1:
+            color = 2
+        else:
+            return False
+        return bool(ZONE_LOCKS[color][ZONES[s]] >> e & 1) and self._reaches(s, e)
     
     def get_legal(self, player):
         """Generator yielding the all legal moves for
@@ -96,12 +182,11 @@ class CheckersGame():
                     A generator yielding tuples of the form ((y0, x0), (y1, x1)).
 
         """
-        for start in map(tuple, np.argwhere(self._board == player)):
-            yield from (
-                    (start, end)
-                    for end in self.paths(start)
-                    if self._check_zone_locks(start, end)
-                )
+        locks = ZONE_LOCKS[player]
+        for s in _bits(self._pieces[player]):
+            start = CELLS[s]
+            for e in _bits(self._destinations(s) & locks[ZONES[s]]):
+                yield (start, CELLS[e])
 
     
     def paths(self, start):
@@ -114,44 +199,61 @@ class CheckersGame():
                 Returns:
                     Generator yielding (y, x) tuples of spaces that can be moved to.
         """
-        # This is probably a little slow
-        tupadd = lambda p, v: (p[0] + v[0], p[1] + v[1])
-        # First, we'll check adjacency moves.
-        adj = [tupadd(start, v) for v in DIRECTIONS]
-        yield from (p for p in adj if self.board(p) == 0)
-        # Now we check repeated hops.
-        # We do this by a breadth first search.
+        yield from (CELLS[c] for c in _bits(self._destinations(start[0] * 9 + start[1])))
+
+    def _destinations(self, s):
+        """Bitmask of every cell that the piece on cell s can reach,
+           ignoring zone locks. Single steps come from NEIGHBOR_MASKS,
+           and repeated hops are a depth first search over HOPS.
+        """
+        # Pick the piece up, so that nothing can hop over it
+        occupied = (self._pieces[1] | self._pieces[2]) & ~(1 << s)
+        steps = NEIGHBOR_MASKS[s] & ~occupied
 
         #TODO: Consensus on legality of hopping back to start and "skipping"
-        visited = set(adj)
-        to_visit = [start]
-        while len(to_visit):
-            pt = to_visit.pop(0)
-            if pt in visited:
-                continue
-
-            # We have to actually move a piece
-            # But this stops us from considering "start" even if we can
-            #   make some hops and get back to start
-            if pt is not start:
-                yield pt
-            
-            visited.add(pt)
-            # Compute the hop directions
-            dirs = ((tupadd(pt, v), tupadd(pt, tupadd(v, v))) for v in DIRECTIONS)
-            to_visit.extend(
-                    dest for over, dest in dirs
-                        if self.board(over) > 0
-                        and self.board(dest) == 0
-                        and dest not in visited
-                        and over != start
-                )
+        # Like the C version, landing next to the start (or on it) is off the table,
+        #   so those cells start out blocked. Everything we land on gets blocked too,
+        #   which doubles as the visited set.
+        start_blocked = blocked = occupied | NEIGHBOR_MASKS[s] | (1 << s)
+        to_visit = [s]
+        while to_visit:
+            for over, land, dest in HOPS[to_visit.pop()]:
+                if occupied & over and not blocked & land:
+                    blocked |= land
+                    to_visit.append(dest)
+        # Whatever got blocked along the way is where we can hop to
+        return steps | (blocked ^ start_blocked)
     
     def exists_path(self, start, end):
         """Checks if it is possible to move a piece from
            the start to the end.
         """
-        return end in self.paths(start)
+        if not (self._index_on_board(start) and self._index_on_board(end)):
+            return False
+        return self._reaches(start[0] * 9 + start[1], end[0] * 9 + end[1])
+
+    def _reaches(self, s, e):
+        """Whether the piece on cell s can get to cell e, ignoring zone locks.
+           The same search as _destinations, but it stops as soon as it lands on e.
+        """
+        occupied = (self._pieces[1] | self._pieces[2]) & ~(1 << s)
+        target = 1 << e
+        if occupied & target:
+            return False
+        if NEIGHBOR_MASKS[s] & target:
+            return True
+        blocked = occupied | NEIGHBOR_MASKS[s] | (1 << s)
+        if blocked & target:
+            return False
+        to_visit = [s]
+        while to_visit:
+            for over, land, dest in HOPS[to_visit.pop()]:
+                if occupied & over and not blocked & land:
+                    if land == target:
+                        return True
+                    blocked |= land
+                    to_visit.append(dest)
+        return False
 
     def _check_zone_locks(self, start, end):
         """There are various reasons that a piece may
@@ -185,8 +287,7 @@ class CheckersGame():
         return True
 
     def _index_on_board(self, point):
-        s = self._board.shape
-        return 0 <= point[0] < s[0] and 0 <= point[1] < s[1]
+        return 0 <= point[0] < 9 and 0 <= point[1] < 9
 
     def board(self, point):
         return self._board[point] if self._index_on_board(point) else -1
@@ -201,16 +302,18 @@ class CheckersGame():
     def hash(self):
         """
         The hash of a game consists of the board state plus whose turn it is.
+        This is a 64 bit Zobrist key, so it is the same in every process
+        and can be saved to disk.
         PLEASE NOTE: The CheckersGame class is MUTABLE.
         """
-        return hash((self._board.tobytes(), self.player_turn))
+        return self._key
         
     def __eq__(self, other):
         """
         PLEASE NOTE: THe CheckersGame class is MUTABLE.
         """
         if isinstance(other, CheckersGame):
-            return np.array_equal(self._board, other._board) and self.player_turn == other.player_turn
+            return self._pieces == other._pieces and self.player_turn == other.player_turn
         return NotImplemented
 
 # Fixed board layout
@@ -239,3 +342,86 @@ DIRECTIONS = [
     (-1, 1),
     (1, -1)
 ]
+
+def pack_move(move):
+    """Pack a ((y0, x0), (y1, x1)) move into 16 bits: (start cell << 8) | end cell."""
+    ((y0, x0), (y1, x1)) = move
+    return ((y0 * 9 + x0) << 8) | (y1 * 9 + x1)
+
+def unpack_move(packed):
+    """Inverse of pack_move."""
+    return (CELLS[packed >> 8], CELLS[packed & 0xFF])
+
+# Precomputed tables for the bitboards. Cell c is the point (c // 9, c % 9).
+CELLS = [(y, x) for y in range(9) for x in range(9)]
+
+def _on_board(y, x):
+    return 0 <= y < 9 and 0 <= x < 9
+
+# NEIGHBORS[c] are the cells one step away from c
+NEIGHBORS = [
+        tuple((y + dy) * 9 + x + dx for dy, dx in DIRECTIONS if _on_board(y + dy, x + dx))
+        for (y, x) in CELLS]
+NEIGHBOR_MASKS = [sum(1 << n for n in ns) for ns in NEIGHBORS]
+
+# HOPS[c] has one (over bit, landing bit, landing cell) triple per direction
+#   in which a piece on c could jump.
+HOPS = [
+        tuple((1 << ((y + dy) * 9 + x + dx),
+               1 << ((y + 2*dy) * 9 + x + 2*dx),
+               (y + 2*dy) * 9 + x + 2*dx)
+            for dy, dx in DIRECTIONS if _on_board(y + 2*dy, x + 2*dx))
+        for (y, x) in CELLS]
+
+# ZONE_MASKS[p] is the start zone of player p (and 0 is the neutral middle)
+ZONE_MASKS = [sum(1 << int(c) for c in np.flatnonzero(FULL_BOARD == p)) for p in range(3)]
+HOME_MASK = ZONE_MASKS[1] | ZONE_MASKS[2]
+# GOAL_MASKS[p] is the zone that player p is trying to fill
+GOAL_MASKS = [0, ZONE_MASKS[2], ZONE_MASKS[1]]
+# ZONES[c] is the zone that cell c is in
+ZONES = [int(z) for z in FULL_BOARD.flat]
+
+def _zone_lock_mask(color, start_zone):
+    """Cells that a piece of color in start_zone is allowed to end up on. Same rules as _check_zone_locks."""
+    goal = CheckersGame.opposite[color]
+    mask = 0
+    for (c, end_zone) in enumerate(ZONES):
+        if end_zone == start_zone or end_zone == goal or not (start_zone == goal or end_zone == color):
+            mask |= 1 << c
+    return mask
+
+# ZONE_LOCKS[color][zone] is a mask of the cells that a piece of color in zone may move to
+ZONE_LOCKS = [[0] * 3] + [[_zone_lock_mask(color, zone) for zone in range(3)] for color in (1, 2)]
+# DIAGONAL[c] is y + x, which is how far cell c is from the top left corner
+DIAGONAL = [y + x for (y, x) in CELLS]
+
+def _bits(mask):
+    """Yield the index of every set bit in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def _xor_all(keys):
+    ret = 0
+    for k in keys:
+        ret ^= k
+    return ret
+
+def _splitmix64(seed):
+    """Deterministic 64 bit generator, so that Zobrist keys don't depend on
+    the Python or numpy version (or on PYTHONHASHSEED)."""
+    mask = (1 << 64) - 1
+    while True:
+        seed = (seed + 0x9E3779B97F4A7C15) & mask
+        z = seed
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        yield z ^ (z >> 31)
+
+# ZOBRIST[p][c] is xored into the key when player p has a piece on cell c,
+#   and ZOBRIST_TURN[p] when it's player p's turn.
+_rng = _splitmix64(0x43686B72)
+ZOBRIST = [[0] * 81] + [[next(_rng) for _ in range(81)] for p in (1, 2)]
+ZOBRIST_TURN = [0, 0, next(_rng)]
+ZOBRIST_TURN_FLIP = ZOBRIST_TURN[1] ^ ZOBRIST_TURN[2]
@@ -0,0 +1,153 @@
+"""
+Matches between engines (MiniMaxer subclasses, or MCTS), played by the server itself.
+
+Engines think in a pool of worker processes, and their moves go into the room like anyone else's,
+so livegame.html can watch and HTTP clients can take the other seats.
+If the room has a time limit, each engine searches on a time budget that fits in it,
+and an engine that still runs out of time forfeits like any other player (and so does one that crashes).
+
+Register your engines with register() in a module that the worker processes import too:
+either this one, or one listed (comma separated) in the ENGINE_MODULES environment variable.
+"""
+import importlib
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Union
+import game
+from mcts import MCTS
+from minimax import MiniMaxer
+
+# How much of the time left on the clock an engine gets to search, and how long (in seconds)
+#   we keep back for getting the move to the room
+TIME_FRACTION = 0.8
+TIME_MARGIN = 0.05
+
+# name -> (MiniMaxer subclass, find_move keyword arguments)
+ENGINES: Dict[str, tuple] = {}
+
+def register(name: str, cls, **find_move_args):
+    """
+    Make an engine available for matches.
+
+        Parameters:
+            name           (str): What to call it in the API.
+            cls               : A MiniMaxer subclass (or anything else with its find_move, like MCTS).
+            find_move_args    : Passed to find_move. Give a depth; if the room has a time limit,
+                                a time_ms budget gets added and the depth becomes the most it searches.
+    """
+    ENGINES[name] = (cls, find_move_args)
+
+register("minimax", MiniMaxer, depth=4)
+register("minimax-deep", MiniMaxer, depth=8)
+register("mcts", MCTS)
+
+def import_engine_modules():
+    """Import the modules in ENGINE_MODULES, so that their engines get registered."""
+    for module in filter(None, os.environ.get("ENGINE_MODULES", "").split(",")):
+        importlib.import_module(module.strip())
+
+
+# Engines of this worker process, kept between moves so their transposition tables stay warm
+_engines: Dict[str, MiniMaxer] = {}
+
+def _engine_move(name: str, board, player: int, deadline: Union[float, None]):
+    """Runs in a worker: the move engine name picks for the position.
+    The time budget is worked out here, from the deadline (a time.time()), so that time spent
+    waiting for a free worker doesn't come out of the engine's share."""
+    (cls, args) = ENGINES[name]
+    if name not in _engines:
+        _engines[name] = cls()
+    args = dict(args)
+    if deadline is not None:
+        args["time_ms"] = max(1, 1000 * (TIME_FRACTION * (deadline - time.time()) - TIME_MARGIN))
+    return _engines[name].find_move(game.CheckersGame(board, player), **args)
+
+
+class MatchRunner:
+    """
+    Plays the engine seats of rooms. Each match gets a thread that waits for its engines' turns,
+    and the engines themselves run in a shared pool of processes.
+
+        Parameters:
+            store          : The rooms (see store.py).
+            timers         : The RoomTimers of the store, so they hear about the engines' moves.
+            workers   (int): Size of the process pool (default: one per core).
+    """
+
+    def __init__(self, store, timers, workers: Union[int, None] = None):
+        self.store = store
+        self.timers = timers
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self.running = 0
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, initializer=import_engine_modules)
+            return self._pool
+
+    def start(self, room, engines: List[Union[str, None]]):
+        """
+        Play the seats of room given by engines: one engine name per player, in turn order,
+        or None for seats that HTTP clients join as usual.
+        Raises KeyError for an engine that isn't registered.
+        """
+        for name in engines:
+            if name is not None and name not in ENGINES:
+                raise KeyError(name)
+        thread = threading.Thread(target=self._play, args=(room, list(engines)),
+                name=f"match-{room.room_id}", daemon=True)
+        with self._lock:
+            self.running += 1
+        thread.start()
+
+    def _play(self, room, engines):
+        try:
+            version = -1
+            while not room.finished():
+                if version == room.version:
+                    # Wait for somebody else to do something
+                    self.store.wait(room, version, 30)
+                    # The room might have been evicted while nothing was happening
+                    if self.store.get(room.room_id) is None:
+                        return
+                version = room.version
+                if not room.full():
+                    seat = len(room.players)
+                    if engines[seat] is not None:
+                        self.store.join(room)
+                        self.timers.watch(room)
+                    continue
+                name = engines[room.game.player_turn - 1]
+                if name is not None:
+                    self._move(room, name)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _move(self, room, name):
+        player = room.game.player_turn
+        future = self._process_pool().submit(_engine_move, name, room.game._board.copy(),
+                player, room.deadline())
+        try:
+            (start, end) = future.result()
+            # If the engine took too long, this forfeits instead
+            self.store.move(room, start, end)
+        except Exception:
+            # A broken engine (or a move it shouldn't have made) loses the game, rather than leaving
+            #   the room waiting for a move that's never coming
+            traceback.print_exc()
+            self.store.resign(room, player)
+        self.timers.watch(room)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,377 @@
+"""
+Monte Carlo tree search, as an alternative to MiniMaxer for positions with too many moves to search deeply.
+
+MCTS has the same find_move as MiniMaxer, so it can play in tournaments, self-play and server matches.
+Children are picked by PUCT, with priors that favor moves that make the most progress (by the piece-square
+tables). New leaves are valued by a batch of playouts, which run in C (NativeSearch.playouts),
+mostly greedy with some random moves, and cut off after playout_plies moves. A cut off playout counts
+as a win with a probability that grows with its piece-square evaluation.
+
+The tree lives in flat numpy arrays: the children of a node are next to each other, so a node only needs
+the index of its first child and how many there are. After a move, the part of the tree below the new position
+is kept for the next search (if the position is within two plies of the old root).
+
+With workers > 1, that many threads search the same tree. Selection and backpropagation take a lock,
+but the playouts run without the GIL, so the threads really do run in parallel. Nodes that a thread is
+in the middle of get a virtual loss, so the other threads look elsewhere.
+"""
+import math
+import threading
+import time
+from typing import List, Tuple, Union
+import numpy as np
+import game
+from ffi import legal_moves_array, NativeSearch # type: ignore
+from minimax import COORDINATE_SUM_BIAS, COORDINATE_SUM_TABLES, WIN_VALUE
+from stats import IterationStats, SearchStats
+
+Move = Tuple[Tuple[int, int], Tuple[int, int]]
+
+NO_MOVE = 0xFFFF
+_ZOBRIST = np.array(game.ZOBRIST, dtype=np.uint64)
+_ZOBRIST_TURN_FLIP = np.uint64(game.ZOBRIST_TURN[1] ^ game.ZOBRIST_TURN[2])
+
+
+class MCTS():
+
+    # Evaluation for the priors, the greedy playouts and cut off playouts, like MiniMaxer's
+    #   (the default is the coordinate-sum heuristic)
+    piece_square_tables = None
+    piece_square_bias = 0
+    # How much PUCT explores: the weight of prior / visits against the value of each child
+    c_puct = 1.5
+    # Priors are a softmax of how much each move gains for the player making it, divided by this
+    prior_temperature = 2.0
+    # Playouts per leaf, in one call to C, and how long each one can go on
+    playout_batch = 8
+    playout_plies = 200
+    # Chance that a playout move is the greedy one rather than a random one
+    playout_greedy = 0.9
+    # A playout that gets cut off counts as sigmoid(value_scale * evaluation) of a win for player 1
+    value_scale = 0.05
+    # Expand a leaf once it has been visited this many times (the root is always expanded)
+    expand_visits = 1
+    # Keep the tree between moves
+    reuse_tree = True
+    # Virtual losses per thread, in playouts
+    virtual_loss = 8
+    # Playouts per move if find_move doesn't get a time or node budget
+    default_playouts = 16000
+
+    def __init__(self, stats_callback = None):
+        """
+            Parameters:
+                stats_callback (function): Called with a SearchStats after every find_move.
+        """
+        self.stats: Union[SearchStats, None] = None
+        self.stats_callback = stats_callback
+        self.pv: List[Move] = []
+        self._native = None
+        self._lock = threading.Lock()
+        self._seed = 0
+        self._clear()
+
+
+    def _clear(self, capacity: int = 1 << 12):
+        """Throw the tree away."""
+        self.size = 0
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.first_child = np.empty(capacity, dtype=np.int32)
+        self.n_children = np.empty(capacity, dtype=np.int32)
+        # game.pack_move of the move into the node
+        self.move = np.empty(capacity, dtype=np.uint16)
+        # Zobrist key and side to move of the node's position, and who won there (0 if nobody has)
+        self.key = np.empty(capacity, dtype=np.uint64)
+        self.player = np.empty(capacity, dtype=np.uint8)
+        self.winner = np.empty(capacity, dtype=np.uint8)
+        self.prior = np.empty(capacity, dtype=np.float64)
+        # Playouts through the node, and the wins among them for the player who moved into it
+        self.visits = np.empty(capacity, dtype=np.float64)
+        self.wins = np.empty(capacity, dtype=np.float64)
+        self.virtual = np.empty(capacity, dtype=np.float64)
+
+
+    def _allocate(self, n: int) -> int:
+        """Make room for n more nodes, and return the index of the first one."""
+        if self.size + n > len(self.parent):
+            capacity = max(2 * len(self.parent), self.size + n)
+            for name in ("parent", "first_child", "n_children", "move", "key", "player", "winner",
+                    "prior", "visits", "wins", "virtual"):
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        first = self.size
+        self.size += n
+        s = slice(first, self.size)
+        self.first_child[s] = -1
+        self.n_children[s] = 0
+        self.winner[s] = 0
+        self.visits[s] = 0
+        self.wins[s] = 0
+        self.virtual[s] = 0
+        return first
+
+
+    def _new_root(self, board: game.CheckersGame):
+        self._clear(max(1 << 12, len(self.parent)))
+        self._allocate(1)
+        self.parent[0] = -1
+        self.move[0] = NO_MOVE
+        self.key[0] = board._key
+        self.player[0] = board.player_turn
+        self.winner[0] = board.winner or 0
+        self.prior[0] = 1.0
+
+
+    def _tables(self):
+        if self.piece_square_tables is None:
+            return (COORDINATE_SUM_TABLES, COORDINATE_SUM_BIAS)
+        return (self.piece_square_tables, self.piece_square_bias)
+
+
+    def _native_search(self) -> NativeSearch:
+        if self._native is None:
+            (tables, bias) = self._tables()
+            # The playouts don't use the transposition table, so keep it tiny
+            self._native = NativeSearch(tables, bias, WIN_VALUE, game.ZOBRIST, game.ZOBRIST_TURN, 0.01)
+        return self._native
+
+
+    def find_move(self, board: game.CheckersGame, depth: Union[int, None] = None,
+            native: Union[bool, None] = None, workers: int = 1,
+            time_ms: Union[float, None] = None, nodes: Union[int, None] = None, stats: bool = False):
+        """
+        Pick a move by Monte Carlo tree search.
+
+            Parameters:
+                board (CheckersGame): The position to move from.
+                depth          (int): Ignored. It's only here so that MCTS can stand in for a MiniMaxer.
+                native        (bool): Ignored too; the playouts always run in C.
+                workers        (int): Threads that search the tree together. With 1 (the default)
+                                      the result is deterministic.
+                time_ms      (float): Time budget in milliseconds.
+                nodes          (int): Playout budget. Without either budget, default_playouts.
+                                      Playouts from a reused tree don't count.
+                stats         (bool): Follow the principal variation down the tree. Off, pv is just the move.
+
+            Returns:
+                The root move with the most playouts.
+                Statistics about the search end up in self.stats, and get passed to self.stats_callback.
+        """
+        start = time.monotonic()
+        deadline = None if time_ms is None else start + time_ms / 1000
+        if nodes is None and time_ms is None:
+            nodes = self.default_playouts
+        self.stats = SearchStats(board.player_turn, True, workers)
+
+        if not (self.reuse_tree and self._reroot(board)):
+            self._new_root(board)
+        # Playouts that the tree already had from earlier searches
+        self.reused_playouts = int(self.visits[0])
+        self._playouts = 0
+        self._max_depth = 0
+
+        if workers <= 1:
+            self._search(board, deadline, nodes)
+        else:
+            threads = [threading.Thread(target=self._search, args=(board, deadline, nodes))
+                    for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        (first, n) = (self.first_child[0], self.n_children[0])
+        children = np.arange(first, first + n)
+        # Most playouts, then the best value among those
+        best = children[np.lexsort((self._values(children), self.visits[children]))[-1]]
+        move = self._unpack(self.move[best])
+        self.pv = self._principal_variation() if stats else [move]
+
+        now = time.monotonic()
+        win = float(self.wins[best] / max(self.visits[best], 1))
+        iteration = IterationStats(self._max_depth, self._points(win), move, self.pv, now - start,
+                self._playouts, self._playouts, 0, 0, 0, 0, 0, 0.0)
+        self.stats.iterations.append(iteration)
+        self.stats.time = now - start
+        if self.stats_callback is not None:
+            self.stats_callback(self.stats)
+        return move
+
+
+    def _search(self, root: game.CheckersGame, deadline: Union[float, None], playouts: Union[int, None]):
+        """Run iterations until the budget is up. Each thread calls this with its own copy of the board."""
+        board = game.CheckersGame(root._board, root.player_turn)
+        native = self._native_search()
+        while True:
+            with self._lock:
+                if playouts is not None and self._playouts >= playouts:
+                    return
+                if deadline is not None and self._playouts > 0 and time.monotonic() >= deadline:
+                    return
+                path = self._select(board)
+                leaf = path[-1]
+                seed = self._seed
+                self._seed += 1
+                self.virtual[path] += self.virtual_loss
+
+            batch = self.playout_batch
+            if self.winner[leaf]:
+                player1_wins = batch if self.winner[leaf] == 1 else 0.0
+            else:
+                (winners, values, _) = native.playouts(board, batch, self.playout_plies, self.playout_greedy, seed)
+                cut_off = 1 / (1 + np.exp(-self.value_scale * values.astype(np.float64)))
+                player1_wins = float(np.sum(np.where(winners == 0, cut_off, winners == 1)))
+
+            with self._lock:
+                self.virtual[path] -= self.virtual_loss
+                self.visits[path] += batch
+                # Each node counts wins for whoever moved into it
+                moved = 3 - self.player[path]
+                self.wins[path] += np.where(moved == 1, player1_wins, batch - player1_wins)
+                self._playouts += batch
+                self._max_depth = max(self._max_depth, len(path) - 1)
+            while board.history:
+                board._unmove()
+
+
+    def _select(self, board: game.CheckersGame) -> List[int]:
+        """
+        Walk down from the root by PUCT, making the moves on board, and expand the leaf it stops at
+        if it has been visited enough. Returns the nodes on the way.
+        """
+        node = 0
+        path = [0]
+        while True:
+            if self.winner[node]:
+                return path
+            if self.first_child[node] < 0:
+                if node != 0 and self.visits[node] < self.expand_visits:
+                    return path
+                self._expand(node, board)
+                if self.n_children[node] == 0:
+                    return path
+            node = self._best_child(node)
+            board.move(*self._unpack(self.move[node]), verify=False)
+            if board.winner is not None:
+                self.winner[node] = board.winner
+            path.append(node)
+
+
+    def _best_child(self, node: int) -> int:
+        first = self.first_child[node]
+        s = slice(first, first + self.n_children[node])
+        visits = self.visits[s] + self.virtual[s]
+        # Children that haven't been tried get their parent's value, from the other side
+        parent_visits = self.visits[node] + self.virtual[node]
+        unexplored = 1 - self.wins[node] / parent_visits if parent_visits > 0 else 0.5
+        q = np.divide(self.wins[s], visits, out=np.full(len(visits), unexplored), where=visits > 0)
+        u = self.c_puct * self.prior[s] * math.sqrt(max(parent_visits, 1)) / (1 + visits)
+        return first + int(np.argmax(q + u))
+
+
+    def _expand(self, node: int, board: game.CheckersGame):
+        moves = legal_moves_array(board).astype(np.intp)
+        n = len(moves)
+        first = self._allocate(n)
+        s = slice(first, first + n)
+        start = moves[:, 0] * 9 + moves[:, 1]
+        end = moves[:, 2] * 9 + moves[:, 3]
+        color = board.player_turn
+        self.parent[s] = node
+        self.move[s] = (start << 8) | end
+        self.key[s] = self.key[node] ^ _ZOBRIST[color, start] ^ _ZOBRIST[color, end] ^ _ZOBRIST_TURN_FLIP
+        self.player[s] = game.CheckersGame.opposite[color]
+        # Progress priors
+        tables = np.asarray(self._tables()[0], dtype=np.float64).reshape(3, 81)
+        gain = tables[color, end] - tables[color, start]
+        if color == 2:
+            gain = -gain
+        logits = gain / self.prior_temperature
+        prior = np.exp(logits - np.max(logits)) if n else logits
+        self.prior[s] = prior / np.sum(prior) if n else prior
+        self.first_child[node] = first
+        self.n_children[node] = n
+
+
+    def _reroot(self, board: game.CheckersGame) -> bool:
+        """
+        If board is the root, or a child or grandchild of it, make it the new root and drop the rest of the tree.
+        Returns whether it was there.
+        """
+        if self.size == 0:
+            return False
+        candidates = np.array([0])
+        for _ in range(3):
+            found = candidates[(self.key[candidates] == np.uint64(board._key))
+                    & (self.player[candidates] == board.player_turn)]
+            if len(found):
+                break
+            candidates = self._children(candidates)
+        else:
+            return False
+        root = int(found[0])
+        if root == 0:
+            return True
+
+        keep = np.zeros(self.size, dtype=bool)
+        frontier = np.array([root])
+        while len(frontier):
+            keep[frontier] = True
+            frontier = self._children(frontier)
+        index = np.cumsum(keep) - 1
+        # Children blocks are either kept whole or dropped whole, so they stay contiguous
+        for name in ("parent", "first_child", "n_children", "move", "key", "player", "winner",
+                "prior", "visits", "wins", "virtual"):
+            array = getattr(self, name)
+            array[:int(keep.sum())] = array[:self.size][keep]
+        self.size = int(keep.sum())
+        s = slice(0, self.size)
+        self.parent[s] = np.where(self.parent[s] >= 0, index[np.maximum(self.parent[s], 0)], -1)
+        self.parent[0] = -1
+        self.move[0] = NO_MOVE
+        self.first_child[s] = np.where(self.first_child[s] >= 0, index[np.maximum(self.first_child[s], 0)], -1)
+        return True
+
+
+    def _children(self, nodes: np.ndarray) -> np.ndarray:
+        """All the children of nodes, in one array."""
+        nodes = nodes[self.first_child[nodes] >= 0]
+        first = self.first_child[nodes]
+        counts = self.n_children[nodes]
+        offsets = np.cumsum(counts) - counts
+        return np.arange(np.sum(counts)) - np.repeat(offsets, counts) + np.repeat(first, counts)
+
+
+    def _values(self, nodes: np.ndarray) -> np.ndarray:
+        return self.wins[nodes] / np.maximum(self.visits[nodes], 1)
+
+
+    def _points(self, win: float) -> int:
+        """A win probability for the player to move, in heuristic points (like MiniMaxer's values)."""
+        win = min(max(win, 1e-9), 1 - 1e-9)
+        return int(max(-WIN_VALUE, min(WIN_VALUE, math.log(win / (1 - win)) / self.value_scale)))
+
+
+    def _principal_variation(self) -> List[Move]:
+        """The most visited line from the root."""
+        pv = []
+        node = 0
+        while self.first_child[node] >= 0 and self.n_children[node] > 0:
+            first = self.first_child[node]
+            node = first + int(np.argmax(self.visits[first:first + self.n_children[node]]))
+            if self.visits[node] == 0:
+                break
+            pv.append(self._unpack(self.move[node]))
+        return pv
+
+
+    @staticmethod
+    def _unpack(packed) -> Move:
+        return game.unpack_move(int(packed))
+
+
+    def close(self):
+        """Nothing to shut down, but MiniMaxer has one."""
+        pass
@@ -1,46 +1,500 @@
 import game
-from ffi import legal_moves, ffi # type: ignore
+from ffi import legal_moves, legal_moves_array, move_buffer, ffi, NativeSearch # type: ignore
 import numpy as np
-from dataclasses import dataclass
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from transposition import Transposition, TranspositionTable
+from stats import COUNTERS, IterationStats, SearchStats
 from typing import Tuple, List, Union
 
 WIN_VALUE = 10000
+NO_MOVE = 0xFFFF
+# Move ordering scores that put these moves ahead of everything else
+ORDER_PRINCIPAL = 1 << 62
+ORDER_KILLER1 = 1 << 61
+ORDER_KILLER2 = 1 << 60
+# Deepest iteration when searching on a time or node budget
+MAX_DEPTH = 64
+# How often (in nodes) the Python search checks its budget
+BUDGET_CHECK_INTERVAL = 1024
 
 Move = Tuple[Tuple[int, int], Tuple[int, int]]
 
 class MiniMaxer():
 
-    def __init__(self):
-        self.transposition_table = dict()
+    # Set this to a (3, 9, 9) array in your subclass to evaluate positions with piece-square tables:
+    #   piece_square_tables[p][y][x] is what a piece of player p on (y, x) is worth to player 1.
+    # If you do that and leave heuristic() alone, find_move can run the whole search in C.
+    piece_square_tables = None
+    # Added to the sum of the piece-square tables
+    piece_square_bias = 0
+    # When searching on a time budget, don't start a new iteration after this fraction of it has passed
+    soft_time_fraction = 0.5
+    # Score all the children of depth 1 nodes at once with heuristic_batch, instead of one by one
+    batch_frontier = True
+    # Set this if your order() takes (and returns) moves as an (N, 4) array of (y0, x0, y1, x1) rows
+    #   instead of a list of tuples. That saves building a list at every node.
+    order_accepts_arrays = False
+
+    # Search enhancements. They're all off by default, which gives plain alpha-beta.
+    #   compare_search.py shows what each of them does to node counts and move choice.
+    # Principal variation search: search every move after the first with a null window
+    #   (just enough to prove it isn't better), and re-search the ones that turn out to be.
+    use_pvs = False
+    # Search each iteration in a window of this many points around the last iteration's value,
+    #   and widen it only if the value falls outside. 0 turns this off.
+    aspiration_window = 0
+    # Late move reductions: search quiet moves (that don't go forward, and aren't the principal
+    #   move or a killer) lmr_reduction plies shallower, once lmr_moves moves have been tried
+    #   at a node with at least lmr_depth plies left. If a reduced move looks better than alpha,
+    #   it gets searched again at full depth. A reduction of 0 turns this off.
+    lmr_reduction = 0
+    lmr_depth = 3
+    lmr_moves = 3
+
+    # The class attributes above that change how a search goes. Parallel searches restart their
+    #   worker processes when any of these (or the engine's public attributes) change.
+    search_settings = ("piece_square_tables", "piece_square_bias", "batch_frontier", "order_accepts_arrays",
+            "use_pvs", "aspiration_window", "lmr_reduction", "lmr_depth", "lmr_moves")
+    # Public attributes that aren't, because searches write them, or only find_move itself reads them
+    _NOT_SETTINGS = ("pv", "stats", "stats_callback", "transposition_table", "opening_book", "race_database")
+
+    # Precomputed moves (see book.py), looked up before searching: set these to an OpeningBook
+    #   and a RaceDatabase. Positions they know are answered without a search.
+    opening_book = None
+    race_database = None
+
+    def __init__(self, tt_mb: float = 16, stats_callback = None):
+        """
+            Parameters:
+                tt_mb      (float): Memory budget of the transposition table, in megabytes.
+                stats_callback (function): Called with a SearchStats after every find_move.
+        """
+        self.transposition_table = TranspositionTable(tt_mb)
+        self._tt_mb = tt_mb
+        self._native = None
+        # Principal variation of the last search
+        self.pv: List[Move] = []
+        # For parallel searches: the pool, and the number of workers and settings it was started with
+        self._pool = None
+        self._pool_key = None
+        self._shared_alpha = None
+        self._search_id = 0
+        # Search budget
+        self._nodes = 0
+        self._node_limit = float("inf")
+        self._deadline = None
+        self._next_check = BUDGET_CHECK_INTERVAL
+        # Search statistics. The last search's are in self.stats.
+        self.stats: Union[SearchStats, None] = None
+        self.stats_callback = stats_callback
+        # Whether to count more than nodes (see find_move)
+        self._count_stats = True
+        self._leaves = 0
+        self._tt_cutoffs = 0
+        self._beta_cutoffs = 0
+        self._first_move_cutoffs = 0
+        self._tt_base = (0, 0)
+        self._worker_counters = (0,) * len(COUNTERS)
+        # Move ordering: two killer moves per ply, and a history score per (from, to) cell pair
+        self._killers = [[NO_MOVE, NO_MOVE] for _ in range(MAX_DEPTH + 1)]
+        self._history = np.zeros((81, 81), dtype=np.int64)
+        # One move buffer per ply, so move generation doesn't allocate
+        self._move_buffers = []
+
+
+    def find_move(self, board: game.CheckersGame, depth: Union[int, None] = None,
+            native: Union[bool, None] = None, workers: int = 1,
+            time_ms: Union[float, None] = None, nodes: Union[int, None] = None, stats: bool = False):
+        """
+        Pick a move by iterative deepening.
 
+            Parameters:
+                board (CheckersGame): The position to move from.
+                depth          (int): How many plies to search. If you give a time or node budget,
+                                      this is the deepest we'll go (default: MAX_DEPTH).
+                native        (bool): Whether to run the search in C (see native_minimax).
+                                      By default we do that whenever the subclass doesn't override
+                                      heuristic(), score() or _minimax().
+                workers        (int): Split the root moves over this many processes.
+                                      With 1 (the default) everything runs in this process,
+                                      and the result is deterministic.
+                                      Your subclass has to be picklable (defined at the top level of a module).
+                time_ms      (float): Time budget in milliseconds. We don't start another iteration after
+                                      soft_time_fraction of it, or if the last iteration times the observed
+                                      branching factor wouldn't fit. An iteration that is still running
+                                      when the budget is up gets thrown away.
+                nodes          (int): Node budget, for reproducible benchmarks. Only works with workers=1.
+                stats         (bool): Count everything in stats.COUNTERS and follow the principal variation
+                                      after every iteration. Off, the search only counts nodes (which the
+                                      budgets need), the other counters are 0, and pv is just the move.
+
+            Returns:
+                The best move of the deepest completed iteration. The first iteration always
+                runs to completion, so there is always a move.
+                Or, if the opening book or the race database has the position, their move.
+                Statistics about the search end up in self.stats, and get passed to self.stats_callback.
+        """
+        assert depth is not None or time_ms is not None or nodes is not None, \
+                "find_move needs a depth, time_ms or nodes"
+        assert nodes is None or workers <= 1, "node budgets only work with one worker"
+        if native is None:
+            native = self.can_search_natively()
+        if depth is None:
+            depth = MAX_DEPTH
+
+        start = time.monotonic()
+        for (source, table) in (("book", self.opening_book), ("race", self.race_database)):
+            found = table.lookup(board) if table is not None else None
+            if found is not None:
+                (move, val) = found
+                self.pv = [move]
+                self.stats = SearchStats(board.player_turn, native, workers, source=source)
+                self.stats.iterations.append(IterationStats(0, val, move, [move], 0.0, *(0,) * len(COUNTERS), 0.0))
+                self.stats.time = time.monotonic() - start
+                if self.stats_callback is not None:
+                    self.stats_callback(self.stats)
+                return move
+        hard_deadline = None if time_ms is None else start + time_ms / 1000
+        soft_deadline = None if time_ms is None else start + self.soft_time_fraction * time_ms / 1000
 
-    def find_move(self, board: game.CheckersGame, depth: int):
         board_copy = game.CheckersGame(board._board, board.player_turn)
         move = None
         val = 0
+        self._search_id += 1
+        if native:
+            self._native_search().new_search()
+        else:
+            self.transposition_table.new_search()
+        self.pv = []
+        self._count_stats = stats
+        self._reset_counters()
+        self._age_move_ordering()
+        self.stats = SearchStats(board.player_turn, native, workers)
+        last = None
         
         for d in range(1, depth+1):
-            (val, move) = self.minimax(board_copy, d)
-        print(f"Player {board.player_turn} has advantage of {val}")
+            # The first iteration is too cheap to bother with the budget, and we need a move
+            self._node_limit = float("inf") if d == 1 or nodes is None else nodes
+            self._deadline = None if d == 1 else hard_deadline
+            self._next_check = 0
+            iteration_start = (time.monotonic(), self._counters(native))
+            try:
+                if workers > 1:
+                    (val, move) = self._parallel_minimax(board_copy, d, native, workers, stats)
+                elif self.aspiration_window > 0 and last is not None:
+                    (val, move) = self._aspiration_search(board_copy, d, native, last.value)
+                elif native:
+                    (val, move) = self.native_minimax(board_copy, d)
+                else:
+                    (val, move) = self.minimax(board_copy, d)
+            except SearchAborted:
+                # Put the board back the way it was
+                while board_copy.history:
+                    board_copy._unmove()
+                self.stats.aborted = True
+                break
+
+            now = time.monotonic()
+            counts = [b - a for (a, b) in zip(iteration_start[1], self._counters(native))]
+            if workers <= 1:
+                self.pv = self.principal_variation(board_copy, d, native) if stats else [move]
+            iteration = IterationStats(d, val, move, self.pv, now - iteration_start[0], *counts,
+                    branching = counts[0] / last.nodes if last is not None and last.nodes > 0 else 0.0)
+            self.stats.iterations.append(iteration)
+
+            if hard_deadline is not None and d < depth:
+                if now >= soft_deadline:
+                    break
+                # Each iteration costs about the effective branching factor times the previous one
+                if iteration.branching > 0 and now + iteration.time * iteration.branching > hard_deadline:
+                    break
+            last = iteration
+
+        self._deadline = None
+        self._node_limit = float("inf")
+        self.stats.time = time.monotonic() - start
+        if self.stats_callback is not None:
+            self.stats_callback(self.stats)
         return move
 
 
-    def minimax(self, board: game.CheckersGame, depth: int):
-        (val, move) = self._minimax(board, -WIN_VALUE * 2, WIN_VALUE * 2, depth)
+    def _reset_counters(self):
+        self._nodes = self._leaves = self._tt_cutoffs = 0
+        self._beta_cutoffs = self._first_move_cutoffs = 0
+        self._tt_base = (self.transposition_table.probes, self.transposition_table.hits)
+        self._worker_counters = (0,) * len(COUNTERS)
+
+
+    def _counters(self, native: bool) -> Tuple[int, ...]:
+        """Running totals of the search counters (in the order of stats.COUNTERS)
+        since the start of this call to find_move, including those of any workers."""
+        if native:
+            s = self._native_search().stats
+            own = tuple(getattr(s, name) for name in COUNTERS)
+        elif self._count_stats:
+            tt = self.transposition_table
+            own = (self._nodes, self._leaves, tt.probes - self._tt_base[0], tt.hits - self._tt_base[1],
+                    self._tt_cutoffs, self._beta_cutoffs, self._first_move_cutoffs)
+        else:
+            own = (self._nodes,) + (0,) * (len(COUNTERS) - 1)
+        return tuple(a + b for (a, b) in zip(own, self._worker_counters))
+
+
+    def _check_budget(self):
+        """Raise SearchAborted if the search is out of nodes or time."""
+        if (self._nodes >= self._node_limit
+                or (self._deadline is not None and time.monotonic() >= self._deadline)):
+            raise SearchAborted()
+        self._next_check = min(self._node_limit, self._nodes + BUDGET_CHECK_INTERVAL)
+
+
+    def _parallel_minimax(self, board: game.CheckersGame, depth: int, native: bool, workers: int,
+            stats: bool = True):
+        """
+        Search each root move in a worker process. The workers share the best score so far
+        as their alpha bound, so later moves get searched with a narrower window.
+        """
+        pool = self._process_pool(workers)
+        moves = legal_moves(board)
+        assert len(moves) > 0
+        # Search the last iteration's best move first, and on its own, so that everything
+        #   else gets a good alpha bound.
+        if self.pv and self.pv[0] in moves:
+            moves.remove(self.pv[0])
+            moves.insert(0, self.pv[0])
+        self._shared_alpha.value = -WIN_VALUE * 2
+
+        # Workers are other processes, so they get the deadline as wall clock time
+        deadline = None if self._deadline is None else time.time() + (self._deadline - time.monotonic())
+        args = (board._board, board.player_turn, depth, native, self._search_id, deadline, stats)
+        futures = [pool.submit(_search_root_move, *args, moves[0])]
+        try:
+            results = [futures[0].result()]
+            futures += [pool.submit(_search_root_move, *args, m) for m in moves[1:]]
+            results += [f.result() for f in futures[1:]]
+        except SearchAborted:
+            for f in futures:
+                f.cancel()
+            raise
+        self._worker_counters = tuple(map(sum, zip(self._worker_counters, *(r[3] for r in results))))
+
+        # A move that failed low only gives an upper bound, so prefer exact scores on ties.
+        #   After that, ties go to the earliest move like in the serial search.
+        (val, _, pv, _) = max(results, key=lambda r: (r[0], r[1]))
+        self.pv = pv
+        return (val, pv[0])
+
+
+    def _process_pool(self, workers: int) -> ProcessPoolExecutor:
+        """The pool for parallel searches. The workers get a copy of the engine when they start,
+        so if it has been changed since then, they get replaced."""
+        key = (workers, self._settings())
+        if self._pool is None or self._pool_key != key:
+            self.close()
+            self._shared_alpha = multiprocessing.Value('i', 0)
+            self._pool = ProcessPoolExecutor(workers,
+                    initializer=_init_worker, initargs=(self, self._shared_alpha))
+            self._pool_key = key
+        return self._pool
+
+
+    def _settings(self) -> bytes:
+        """Everything the workers copy from us that changes how they search, pickled so it can be compared."""
+        settings = {name: getattr(self, name) for name in self.search_settings}
+        settings.update((name, value) for (name, value) in self.__dict__.items()
+                if not name.startswith("_") and name not in MiniMaxer._NOT_SETTINGS)
+        return pickle.dumps(settings)
+
+
+    def close(self):
+        """Shut down the worker processes of parallel searches, if there are any."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_key = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def __del__(self):
+        # Don't leave the workers running if nobody called close()
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+    def principal_variation(self, board: game.CheckersGame, depth: int, native: bool = False) -> List[Move]:
+        """Follow the best moves stored in the transposition table from board, for up to depth plies."""
+        board = game.CheckersGame(board._board, board.player_turn)
+        lookup = self._native_search().principal if native else self.transposition_table.principal
+        pv = []
+        while len(pv) < depth and board.winner is None:
+            move = lookup(board._key)
+            # Make sure this isn't a stale entry from some other position
+            if move is None or move not in legal_moves(board):
+                break
+            board.move(move[0], move[1], verify=False)
+            pv.append(move)
+        return pv
+
+
+    def __getstate__(self):
+        # Worker processes get their own tables and no pool
+        state = self.__dict__.copy()
+        for name in ("transposition_table", "_native", "_pool", "_pool_key", "_shared_alpha"):
+            del state[name]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.transposition_table = TranspositionTable(self._tt_mb)
+        self._native = None
+        self._pool = None
+        self._pool_key = None
+        self._shared_alpha = None
+
+
+    def _aspiration_search(self, board: game.CheckersGame, depth: int, native: bool, guess: int):
+        """
+        Search inside a window around guess (the last iteration's value). If the value falls outside it,
+        the result is only a bound, so widen that side of the window and search again.
+        The transposition table makes the re-searches fairly cheap.
+        """
+        search = self.native_minimax if native else self.minimax
+        delta = self.aspiration_window
+        (alpha, beta) = (max(guess - delta, -WIN_VALUE * 2), min(guess + delta, WIN_VALUE * 2))
+        while True:
+            (val, move) = search(board, depth, alpha, beta)
+            if val <= alpha and alpha > -WIN_VALUE * 2:
+                delta *= 4
+                alpha = max(val - delta, -WIN_VALUE * 2)
+            elif val >= beta and beta < WIN_VALUE * 2:
+                delta *= 4
+                beta = min(val + delta, WIN_VALUE * 2)
+            else:
+                return (val, move)
+
+
+    def minimax(self, board: game.CheckersGame, depth: int,
+            alpha: int = -WIN_VALUE * 2, beta: int = WIN_VALUE * 2):
+        (val, move) = self._minimax(board, alpha, beta, depth)
+        assert move is not None
+        return (val, move)
+
+
+    def native_minimax(self, board: game.CheckersGame, depth: int,
+            alpha: int = -WIN_VALUE * 2, beta: int = WIN_VALUE * 2):
+        """
+        Same as minimax, but move generation, the transposition table and evaluation all run in C.
+        Positions are evaluated with piece_square_tables (or the default coordinate-sum tables),
+        so overriding heuristic() has no effect here.
+        """
+        native = self._native_search()
+        max_nodes = 0
+        if self._node_limit != float("inf"):
+            max_nodes = max(1, int(self._node_limit))
+        time_limit_ms = 0
+        if self._deadline is not None:
+            time_limit_ms = max(1, int(1000 * (self._deadline - time.monotonic())))
+        native.set_pruning(self.use_pvs, self.lmr_depth, self.lmr_moves, self.lmr_reduction)
+        (val, move) = native.search(board, depth, alpha, beta, max_nodes=max_nodes, time_limit_ms=time_limit_ms,
+                count_stats=self._count_stats)
+        if native.stats.aborted:
+            raise SearchAborted()
         assert move is not None
         return (val, move)
 
 
+    def can_search_natively(self) -> bool:
+        """Whether native_minimax would give the same results as minimax for this class."""
+        cls = type(self)
+        return all(getattr(cls, name) is getattr(MiniMaxer, name)
+                for name in ("heuristic", "score", "_minimax"))
+
+
+    def _native_search(self) -> NativeSearch:
+        if self._native is None:
+            if self.piece_square_tables is None:
+                (tables, bias) = (COORDINATE_SUM_TABLES, COORDINATE_SUM_BIAS)
+            else:
+                (tables, bias) = (self.piece_square_tables, self.piece_square_bias)
+            self._native = NativeSearch(tables, bias, WIN_VALUE,
+                    game.ZOBRIST, game.ZOBRIST_TURN, self._tt_mb)
+        return self._native
+
+
+    def _age_move_ordering(self):
+        """Forget the killers, and fade out the history scores, between searches."""
+        for killers in self._killers:
+            killers[0] = killers[1] = NO_MOVE
+        self._history >>= 1
+
+
+    def _order_moves(self, board: game.CheckersGame, moves: np.ndarray, ply: int, principal: int) -> List[int]:
+        """
+        The move ordering pipeline. Returns the moves packed with game.pack_move, best first:
+        first the transposition table's principal move, then the killer moves of this ply,
+        then everything else by history score, and then by how far forward it goes.
+        If the subclass overrides order(), that replaces the history and forward scores.
+
+            Parameters:
+                moves (np.ndarray): (N, 4) array from legal_moves_array.
+                principal    (int): Packed principal move, or NO_MOVE.
+        """
+        if type(self).order is not MiniMaxer.order:
+            if self.order_accepts_arrays:
+                moves = np.asarray(self.order(board, moves))
+            else:
+                listed = [((y0, x0), (y1, x1)) for (y0, x0, y1, x1) in moves.tolist()]
+                moves = np.array(self.order(board, listed), dtype=np.int32).reshape(-1, 4)
+        m = moves.astype(np.int32)
+        start = m[:, 0] * 9 + m[:, 1]
+        end = m[:, 2] * 9 + m[:, 3]
+        packed = (start << 8) | end
+
+        if type(self).order is not MiniMaxer.order:
+            # Keep the subclass's order for everything else
+            score = np.zeros(len(packed), dtype=np.int64)
+        else:
+            forward = (m[:, 0] + m[:, 1]) - (m[:, 2] + m[:, 3])
+            if board.player_turn == 2:
+                forward = -forward
+            # A forward step is worth less than one point of history
+            score = self._history[start, end] * 64 + forward
+        (killer1, killer2) = self._killers[ply]
+        score[packed == killer2] = ORDER_KILLER2
+        score[packed == killer1] = ORDER_KILLER1
+        score[packed == principal] = ORDER_PRINCIPAL
+        return packed[np.argsort(-score, kind="stable")].tolist()
+
+
     def _minimax(self, board: game.CheckersGame,
-            alpha: int, beta: int, depth: int) -> Tuple[int, Union[Move, None]]:
+            alpha: int, beta: int, depth: int, ply: int = 0) -> Tuple[int, Union[Move, None]]:
         
+        self._nodes += 1
+        if self._nodes >= self._next_check:
+            self._check_budget()
+        count = self._count_stats
+
         # Transposition Table lookup
         alpha_orig = alpha
         # Lookup in the table
-        key = board.hash()
+        key = board._key
         tt = self.transposition_table.get(key)
         if tt is not None and tt.depth >= depth:
             if tt.flag == Transposition.EXACT:
+                if count:
+                    self._tt_cutoffs += 1
                 return (tt.value, tt.principal)
             if tt.flag == Transposition.LOWER:
                 alpha = max(alpha, tt.value)
@@ -48,29 +502,56 @@ class MiniMaxer():
                 beta = min(beta, tt.value)
 
             if alpha >= beta:
+                if count:
+                    self._tt_cutoffs += 1
                 return (tt.value, tt.principal)
         
         if board.winner is not None or depth == 0:
+            if count:
+                self._leaves += 1
             score =  self.score(board)
             return (score if board.player_turn == 1 else -score, None)
 
-        # legal_moves is a wrapper around a cffi function
-        moves = legal_moves(board)
-        
-        # Put the principal move first
+        # legal_moves_array is a wrapper around a cffi function, and writes into this ply's buffer
+        while len(self._move_buffers) <= ply:
+            self._move_buffers.append(move_buffer())
+        moves = legal_moves_array(board, self._move_buffers[ply])
+        if depth == 1 and self._batches_frontier():
+            (value, best_move) = self._frontier(board, moves, beta)
+            return self._store(key, value, depth, alpha_orig, beta, best_move)
+
+        principal = NO_MOVE
         if tt is not None and tt.principal is not None:
-            principal_index = moves.index(tt.principal)
-            moves = [tt.principal] + moves[:principal_index] + moves[principal_index+1:]
+            principal = game.pack_move(tt.principal)
+        moves = self._order_moves(board, moves, ply, principal)
         
-        # This routine can probably be optimized.
         # Negamax with alpha-beta pruning
         value = -WIN_VALUE * 2
         best_move = None
 
-        for move in moves:
+        killers = self._killers[ply]
+        reduce = self.lmr_reduction > 0 and depth >= self.lmr_depth
+        for (i, packed) in enumerate(moves):
+            move = game.unpack_move(packed)
+            reduction = 0
+            if (reduce and i >= self.lmr_moves and packed != principal
+                    and packed != killers[0] and packed != killers[1]):
+                # Only quiet moves: sideways or backwards for the player to move
+                forward = (move[0][0] + move[0][1]) - (move[1][0] + move[1][1])
+                if (forward if board.player_turn == 1 else -forward) <= 0:
+                    reduction = min(self.lmr_reduction, depth - 1)
+
             board.move(move[0], move[1], verify = False)
-            (move_val, _) = self._minimax(board, -beta, -alpha, depth - 1)
-            move_val = -move_val
+            if i == 0 or not (self.use_pvs or reduction):
+                move_val = -self._minimax(board, -beta, -alpha, depth - 1, ply + 1)[0]
+            else:
+                # Try to show this move is no better than what we have, cheaply
+                bound = alpha + 1 if self.use_pvs else beta
+                move_val = -self._minimax(board, -bound, -alpha, depth - 1 - reduction, ply + 1)[0]
+                if reduction and move_val > alpha:
+                    move_val = -self._minimax(board, -bound, -alpha, depth - 1, ply + 1)[0]
+                if self.use_pvs and alpha < move_val < beta:
+                    move_val = -self._minimax(board, -beta, -alpha, depth - 1, ply + 1)[0]
             board._unmove()
 
             if move_val > value:
@@ -80,22 +561,80 @@ class MiniMaxer():
             alpha = max(alpha, value) 
 
             if alpha >= beta:
-                # Record cutoff?
+                if count:
+                    self._beta_cutoffs += 1
+                    if i == 0:
+                        self._first_move_cutoffs += 1
+                # Remember what caused the cutoff
+                if packed != principal and packed != killers[0]:
+                    killers[1] = killers[0]
+                    killers[0] = packed
+                self._history[packed >> 8, packed & 0xFF] += depth * depth
                 break
 
         
+        return self._store(key, value, depth, alpha_orig, beta, best_move)
+
+
+    def _store(self, key: int, value: int, depth: int, alpha_orig: int, beta: int,
+            best_move: Union[Move, None]) -> Tuple[int, Union[Move, None]]:
         # Transposition Table store
         flag = Transposition.EXACT
         if value <= alpha_orig:
             flag = Transposition.UPPER
-        elif value <= beta:
+        elif value >= beta:
             flag = Transposition.LOWER
 
-        self.transposition_table[key] = Transposition(value, depth, flag, best_move)
+        self.transposition_table.store(key, value, depth, flag, best_move)
         
         return (value, best_move)
 
 
+    def _batches_frontier(self) -> bool:
+        """Whether to use _frontier at depth 1. Only if heuristic_batch is actually vectorized,
+        since the fallback can't prune."""
+        cls = type(self)
+        return (self.batch_frontier and cls.score is MiniMaxer.score
+                and (cls.heuristic is MiniMaxer.heuristic or cls.heuristic_batch is not MiniMaxer.heuristic_batch))
+
+
+    def _frontier(self, board: game.CheckersGame, moves: np.ndarray, beta: int) -> Tuple[int, Union[Move, None]]:
+        """
+        Negamax over the children of a depth 1 node, scoring all of them in one call to heuristic_batch.
+        Equivalent to searching them one by one, except that it doesn't stop at a cutoff
+        (so the value may be higher, which is still a valid lower bound) and doesn't look the children
+        up in the transposition table.
+        """
+        n = len(moves)
+        if n == 0:
+            return (-WIN_VALUE * 2, None)
+        self._nodes += n
+        if self._count_stats:
+            self._leaves += n
+
+        scores = self.heuristic_batch(board, moves)
+        m = moves.astype(np.intp)
+        start = m[:, 0] * 9 + m[:, 1]
+        end = m[:, 2] * 9 + m[:, 3]
+        # Same rule as CheckersGame.move: landing in a home zone when the goal fills up wins
+        player = board.player_turn
+        goal = game.CheckersGame.opposite[player]
+        occupied = board._pieces[1] | board._pieces[2]
+        filled = bin(occupied & game.ZONE_MASKS[goal]).count("1")
+        filled = filled - (_ZONES[start] == goal) + (_ZONES[end] == goal)
+        wins = (_ZONES[end] > 0) & (filled == _GOAL_SIZE)
+        scores = np.where(wins, WIN_VALUE if player == 1 else -WIN_VALUE, scores)
+
+        values = scores if player == 1 else -scores
+        i = int(np.argmax(values))
+        if self._count_stats and values[i] >= beta:
+            self._beta_cutoffs += 1
+            if values[0] >= beta:
+                self._first_move_cutoffs += 1
+        (y0, x0, y1, x1) = moves[i].tolist()
+        return (int(values[i]), ((y0, x0), (y1, x1)))
+
+
     def score(self, board: game.CheckersGame) -> int:
         """
         Score a board using terminal value or heuristic.
@@ -127,11 +666,52 @@ class MiniMaxer():
                     This value should be between -WIN_VALUE and WIN_VALUE.
 
         Override this method in your subclass! You should try to achieve a tradeoff between evaluation accuracy and runtime.
+        Or, set piece_square_tables instead and get the (much faster) native search for free.
+        The board keeps some aggregates up to date as moves are made, which are free to read:
+        board.coordinate_sum, board.in_goal and board.rearmost().
         """
+        if self.piece_square_tables is not None:
+            (y, x) = np.nonzero(board._board)
+            return int(self.piece_square_bias
+                    + np.sum(self.piece_square_tables[board._board[y, x], y, x]))
         # Naive heuristic: player 1 wants to minimize the coordinates of all pieces.
-        (y, x) = np.nonzero(board._board)
-        # Type checker isn't smart enough to figure out that the sum of an int array is an int
-        return 160 - (np.sum(y) + np.sum(x)) # type: ignore
+        return 160 - (board.coordinate_sum[1] + board.coordinate_sum[2])
+
+
+    def heuristic_batch(self, board: game.CheckersGame, moves: np.ndarray) -> np.ndarray:
+        """
+        heuristic() of every child of a position, in one go. The search uses this at depth 1.
+
+            Parameters:
+                board (CheckersGame): The parent position.
+                moves   (np.ndarray): (N, 4) array of moves for board.player_turn,
+                                      like legal_moves_array returns.
+
+            Returns:
+                values  (np.ndarray): (N,) array with heuristic() of the board after each move.
+
+        The default computes the default heuristic (or piece_square_tables) as a difference from the parent.
+        If you override heuristic(), this falls back to making each move and calling it,
+        and the search goes back to scoring depth 1 nodes one by one (with pruning).
+        So override this too if your heuristic can be vectorized.
+        """
+        if type(self).heuristic is not MiniMaxer.heuristic:
+            ret = np.empty(len(moves), dtype=np.int64)
+            for (i, (y0, x0, y1, x1)) in enumerate(moves.tolist()):
+                board.move((y0, x0), (y1, x1), verify=False)
+                ret[i] = self.heuristic(board)
+                board._unmove()
+            return ret
+
+        m = moves.astype(np.intp)
+        start = m[:, 0] * 9 + m[:, 1]
+        end = m[:, 2] * 9 + m[:, 3]
+        parent = self.heuristic(board)
+        if self.piece_square_tables is None:
+            return parent + (_DIAGONALS[start] - _DIAGONALS[end])
+        tables = np.asarray(self.piece_square_tables).reshape(3, 81)
+        color = board.player_turn
+        return parent + (tables[color, end] - tables[color, start])
 
 
     def order(self, board: game.CheckersGame, moves: List[Move]) -> List[Move]:
@@ -142,23 +722,90 @@ class MiniMaxer():
             Parameters:
                 board: (CheckersGame): The board from which the moves come.
                 moves:         (list): The list of legal moves for the current player.
+                                       If order_accepts_arrays is set, this is an (N, 4) array instead.
 
             Returns:
                 ordered_moves  (list): The same list of legal moves, but with the best moves
                     at the front.
 
         Override this method in your subclass! You should try to chieve a tradeoff between ordering accuracy and runtime.
+        The search still tries the transposition table's move and the killer moves before the rest of your order.
+        By default, moves are ordered by a history table and then by how far forward they go.
         """
         return moves
 
 
-@dataclass
-class Transposition:
-    value: int
-    depth: int
-    flag:  int
-    principal: Union[Move, None]
-
-    EXACT = 0
-    LOWER = 1
-    UPPER = 1
+def _coordinate_sum_tables():
+    """Piece-square tables that reproduce the default heuristic (for a full set of 20 pieces)."""
+    (y, x) = np.indices((9, 9))
+    tables = np.zeros((3, 9, 9), dtype=np.int32)
+    tables[1] = tables[2] = -(y + x)
+    return tables
+
+COORDINATE_SUM_TABLES = _coordinate_sum_tables()
+COORDINATE_SUM_BIAS = 160
+
+# Per-cell lookups for vectorized evaluation
+_DIAGONALS = np.array(game.DIAGONAL, dtype=np.int64)
+_ZONES = game.FULL_BOARD.ravel().astype(np.int64)
+_GOAL_SIZE = int(np.sum(_ZONES == 1))
+
+
+class SearchAborted(Exception):
+    """Raised inside a search that ran out of time or nodes."""
+
+
+# State of a worker process in a parallel search
+_worker_engine: Union[MiniMaxer, None] = None
+_worker_alpha = None
+
+def _init_worker(engine: MiniMaxer, shared_alpha):
+    global _worker_engine, _worker_alpha
+    # With fork, we inherit the parent's tables, and we don't want to share them
+    engine.__setstate__(engine.__getstate__())
+    _worker_engine = engine
+    _worker_alpha = shared_alpha
+
+def _search_root_move(board: np.ndarray, player: int, depth: int, native: bool, search_id: int,
+        deadline: Union[float, None], stats: bool, move: Move):
+    """Search one root move in a worker. Returns (value, exact, principal variation, counters).
+    Raises SearchAborted if the (wall clock) deadline passes."""
+    engine = _worker_engine
+    assert engine is not None and _worker_alpha is not None
+    engine._count_stats = stats
+    if engine._search_id != search_id:
+        engine._search_id = search_id
+        engine.transposition_table.new_search()
+        if native:
+            engine._native_search().new_search()
+
+    child = game.CheckersGame(board, player)
+    child.move(move[0], move[1], verify=False)
+    alpha = _worker_alpha.value
+    beta = WIN_VALUE * 2
+    time_limit_ms = 0
+    if deadline is not None:
+        time_limit_ms = int(1000 * (deadline - time.time()))
+        if time_limit_ms <= 0:
+            raise SearchAborted()
+    before = engine._counters(native)
+    if native:
+        search = engine._native_search()
+        search.set_pruning(engine.use_pvs, engine.lmr_depth, engine.lmr_moves, engine.lmr_reduction)
+        (val, _) = search.search(child, depth - 1, -beta, -alpha, time_limit_ms=time_limit_ms, count_stats=stats)
+        if search.stats.aborted:
+            raise SearchAborted()
+    else:
+        engine._next_check = 0
+        engine._node_limit = float("inf")
+        engine._deadline = None if deadline is None else time.monotonic() + time_limit_ms / 1000
+        (val, _) = engine._minimax(child, -beta, -alpha, depth - 1, 1)
+    counts = tuple(b - a for (a, b) in zip(before, engine._counters(native)))
+    val = -val
+
+    if val > alpha:
+        with _worker_alpha.get_lock():
+            if val > _worker_alpha.value:
+                _worker_alpha.value = val
+    pv = engine.principal_variation(child, depth - 1, native) if stats else []
+    return (val, val > alpha, [move] + pv, counts)
@@ -0,0 +1,289 @@
+"""
+A compact binary format for lots of games.
+
+Every game starts from the standard starting position. A move takes 2 bytes (game.pack_move: the start cell
+in the high byte and the end cell in the low byte), so a typical game fits in a few hundred bytes.
+
+File layout (all little endian):
+    file header   magic b"CCREC\\x00", u16 version
+    games         one after another, each:
+                      u32 size of the whole record in bytes
+                      u16 number of moves
+                      u8  winner (0 if nobody won)
+                      u8  number of opening moves (that were played at random, not by the engines)
+                      u32 time control: milliseconds per move (0 if none)
+                      u8  search depth (0 if none)
+                      u8  number of engine names, then for each: u8 length and that many bytes of UTF-8
+                      u16 moves
+    index         u64 offset of every game
+    footer        u64 number of games, u64 offset of the index, magic b"CCIDX\\x00"
+
+RecordWriter streams games into a file and writes the index when it's closed. Records reads a file through
+mmap, so opening even a huge archive is instant, and only the games you look at get read.
+If a writer never got closed (so there's no index), Records finds the games by walking the file instead.
+
+    python records.py info games.ccr
+    python records.py import tournament.jsonl games.ccr
+"""
+import argparse
+import mmap
+import os
+import struct
+from typing import Iterator, List, Sequence, Union
+import numpy as np
+import game
+
+MAGIC = b"CCREC\x00"
+INDEX_MAGIC = b"CCIDX\x00"
+VERSION = 1
+FILE_HEADER = struct.Struct("<6sH")
+GAME_HEADER = struct.Struct("<IHBBIBB")
+FOOTER = struct.Struct("<QQ6s")
+
+
+class GameRecord:
+    """One game read from a file. moves is a uint16 array of packed moves (a view into the file, if it came from Records)."""
+
+    def __init__(self, moves, winner: int = 0, engines: Sequence[str] = (), time_ms: int = 0,
+            depth: int = 0, opening_plies: int = 0):
+        self.moves = moves
+        self.winner = winner
+        self.engines = list(engines)
+        self.time_ms = time_ms
+        self.depth = depth
+        self.opening_plies = opening_plies
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def replay(self, plies: Union[int, None] = None, verify: bool = True) -> game.CheckersGame:
+        """
+        The game (as a CheckersGame, with its history) after plies moves, or at the end.
+        Raises an AssertionError at the first illegal move, unless verify is off (which is a lot faster).
+        """
+        board = game.CheckersGame()
+        for packed in self.moves[:plies].tolist():
+            (start, end) = game.unpack_move(packed)
+            board.move(start, end, verify=verify)
+        return board
+
+    def positions(self, verify: bool = True) -> Iterator[game.CheckersGame]:
+        """
+        Yield the position before every move, and then the final one.
+        It's the same CheckersGame every time, moved on between yields, so copy it if you want to keep it
+        (game.CheckersGame(board._board, board.player_turn)). verify is the same as for replay.
+        """
+        board = game.CheckersGame()
+        yield board
+        for packed in self.moves.tolist():
+            (start, end) = game.unpack_move(packed)
+            board.move(start, end, verify=verify)
+            yield board
+
+
+class RecordWriter:
+    """
+    Writes games to a file, one at a time. Use it as a context manager, or call close() at the end,
+    which writes the index.
+
+        Parameters:
+            path    (str): The file.
+            append (bool): Add to the games already in path instead of starting over.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.offsets: List[int] = []
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            offsets = _read_offsets(path)
+            self._file = open(path, "r+b")
+            end = _games_end(self._file, offsets)
+            # The new games go where the old index was
+            self._file.truncate(end)
+            self._file.seek(end)
+            self.offsets = offsets
+        else:
+            self._file = open(path, "wb")
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def write(self, moves, winner: int = 0, engines: Sequence[str] = (), time_ms: int = 0,
+            depth: int = 0, opening_plies: int = 0):
+        """
+        Add a game.
+
+            Parameters:
+                moves: Packed moves (game.pack_move), or ((y0, x0), (y1, x1)) moves.
+                winner        (int): The winner, or 0.
+                engines      (list): Names of the players, in turn order.
+                time_ms       (int): Time per move, in milliseconds.
+                depth         (int): Search depth.
+                opening_plies (int): How many of the moves were a random opening.
+        """
+        moves = list(moves)
+        if moves and not isinstance(moves[0], (int, np.integer)):
+            moves = [game.pack_move(move) for move in moves]
+        names = [name.encode("utf-8")[:255] for name in engines]
+        header_size = GAME_HEADER.size + sum(1 + len(name) for name in names)
+        size = header_size + 2 * len(moves)
+        data = bytearray(GAME_HEADER.pack(size, len(moves), winner, opening_plies,
+                int(time_ms), depth, len(names)))
+        for name in names:
+            data.append(len(name))
+            data += name
+        data += np.asarray(moves, dtype="<u2").tobytes()
+        self.offsets.append(self._file.tell())
+        self._file.write(data)
+
+    def write_game(self, board: game.CheckersGame, **kwargs):
+        """Add a game that was played from the starting position, from its history."""
+        self.write(board.history, board.winner or 0, **kwargs)
+
+    def close(self):
+        if self._file.closed:
+            return
+        index = self._file.tell()
+        self._file.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+        self._file.write(FOOTER.pack(len(self.offsets), index, INDEX_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_offsets(path: str) -> List[int]:
+    """The offsets of the games in path. Only the parts of the file that _find_offsets looks at get read."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # tolist copies them out, so nothing points into the map when it gets closed
+        return _find_offsets(data).tolist()
+
+
+def _find_offsets(data) -> np.ndarray:
+    """The offsets of the games, from the index if there is one, or else by walking from one game to the next."""
+    if len(data) < FILE_HEADER.size:
+        raise ValueError("not a game record file")
+    (magic, version) = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a game record file")
+    if version > VERSION:
+        raise ValueError(f"game record file version {version} is too new")
+    if len(data) >= FILE_HEADER.size + FOOTER.size:
+        (n, index, magic) = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+        if magic == INDEX_MAGIC and index + 8 * n + FOOTER.size == len(data):
+            return np.frombuffer(data, dtype="<u8", count=n, offset=index)
+    # No index, so the writer didn't get to finish. Keep the games that made it to the file in one piece.
+    offsets = []
+    offset = FILE_HEADER.size
+    while offset + GAME_HEADER.size <= len(data):
+        size = GAME_HEADER.unpack_from(data, offset)[0]
+        if size < GAME_HEADER.size or offset + size > len(data):
+            break
+        offsets.append(offset)
+        offset += size
+    return np.array(offsets, dtype=np.uint64)
+
+
+def _games_end(f, offsets: List[int]) -> int:
+    """Where the last game ends."""
+    if not offsets:
+        return FILE_HEADER.size
+    f.seek(offsets[-1])
+    return offsets[-1] + GAME_HEADER.unpack(f.read(GAME_HEADER.size))[0]
+
+
+class Records:
+    """
+    Read-only access to a game record file, through mmap.
+    records[i] is the i-th game (a GameRecord), and iterating goes through all of them in order.
+
+        Parameters:
+            path (str): The file.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+        self.offsets = _find_offsets(self._map)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> GameRecord:
+        offset = int(self.offsets[i])
+        (size, n_moves, winner, opening_plies, time_ms, depth, n_names) = GAME_HEADER.unpack_from(self._map, offset)
+        position = offset + GAME_HEADER.size
+        names = []
+        for _ in range(n_names):
+            length = self._map[position]
+            names.append(bytes(self._map[position + 1:position + 1 + length]).decode("utf-8"))
+            position += 1 + length
+        moves = np.frombuffer(self._map, dtype="<u2", count=n_moves, offset=position)
+        return GameRecord(moves, winner, names, time_ms, depth, opening_plies)
+
+    def __iter__(self) -> Iterator[GameRecord]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def positions(self) -> Iterator[game.CheckersGame]:
+        """Every position of every game, one after another (see GameRecord.positions)."""
+        for record in self:
+            yield from record.positions()
+
+    def close(self):
+        self.offsets = np.zeros(0, dtype=np.uint64)
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:
+                # Somebody still has a GameRecord's moves, which point into the map.
+                # It gets unmapped when the last of them is gone.
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="summarize a game record file")
+    info.add_argument("path")
+    convert = commands.add_parser("import", help="append the games of a tournament.py results file")
+    convert.add_argument("jsonl")
+    convert.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        from tournament import load
+        with RecordWriter(args.path, append=True) as writer:
+            for g in load(args.jsonl):
+                record = GameRecord(np.array(g["moves"], dtype=np.uint16), g["winner"], g["engines"],
+                        opening_plies=g["opening_plies"])
+                try:
+                    record.replay()
+                except AssertionError:
+                    raise SystemExit(f"game {g['key']} has an illegal move")
+                writer.write(record.moves, record.winner, record.engines, opening_plies=record.opening_plies)
+        print(f"{len(writer)} games in {args.path}")
+    else:
+        with Records(args.path) as records:
+            winners = [0, 0, 0]
+            plies = 0
+            for record in records:
+                winners[record.winner] += 1
+                plies += len(record)
+            print(f"{len(records)} games, {plies} moves, {os.path.getsize(args.path)} bytes")
+            print(f"first player won {winners[1]}, second player won {winners[2]}, unfinished {winners[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 from random import choices
 from string import ascii_letters, digits
+import threading
 import time
 from game import CheckersGame
+try:
+    from ffi import legal_moves
+except ImportError:
+    # The C extension isn't built, so fall back on the Python move generator
+    def legal_moves(game):
+        return list(game.get_legal(game.player_turn))
 
 class Room:
     AUTH_CORPUS = ascii_letters + digits
@@ -12,29 +19,117 @@ class Room:
         else:
             self.players = players
         self.time_limit = time_limit
+        # When the last move was made, and when the player to move started thinking
+        #   (which is when the room filled up, for the first move), as time.time()s.
         self.last_move = None
+        self.turn_started = None
+        # When the room was created, and when it last changed
+        self.created = self.updated = time.time()
+        # The color of the player who ran out of time, if that's how the game ended
+        self.forfeited = None
+        # The id the room is stored under (set by the store)
+        self.room_id = None
+        # Every change to the room (a join or a move) bumps the version and adds an event,
+        #   so that clients can ask for everything that happened since the version they have.
+        #   events[v - 1] is what happened to get to version v.
+        self.version = 0
+        self.events = []
+        # Notified whenever the version changes
+        self.changed = threading.Condition()
+        # Things built from the state of the room (like serialized responses), until it changes
+        self._cache = {}
 
-    def join(self):
-        assert not self.full()
-        # The bearer token is a 32 character string, where the last character is the player index
-        # This just makes sure we'll never have two players in one room with the same token
-        auth = ''.join(choices(Room.AUTH_CORPUS, k=31)) + str(len(self.players))
-        self.players.append(auth)
-        return (len(self.players) - 1, auth)
+    def join(self, auth=None, at=None):
+        """Add a player, and return (their index, their bearer token).
+        Pass auth and at (a time.time()) to replay someone who joined before."""
+        with self.changed:
+            assert not self.full()
+            if auth is None:
+                # The bearer token is a 32 character string, where the last character is the player index
+                # This just makes sure we'll never have two players in one room with the same token
+                auth = ''.join(choices(Room.AUTH_CORPUS, k=31)) + str(len(self.players))
+            self.players.append(auth)
+            self._changed(dict(type="join", joined=len(self.players)), at)
+            if self.full():
+                # The clock starts now
+                self.turn_started = self.updated
+            return (len(self.players) - 1, auth)
+
+    def move(self, start, end, played=None):
+        """Make a move, and let everyone who is waiting on the room know about it.
+        Raises an AssertionError if it isn't legal.
+        Doesn't look at the clock; see overdue.
+        Pass played (a time.time()) when replaying a move that was made earlier."""
+        with self.changed:
+            assert (tuple(start), tuple(end)) in self.legal_moves()
+            self.game.move(start, end, verify=False)
+            event = dict(type="move", start=list(start), end=list(end))
+            if self.game.winner is not None:
+                event["winner"] = self.game.winner
+            else:
+                event["turn"] = self.game.player_turn
+            self._changed(event, played)
+            self.last_move = self.turn_started = self.updated
+
+    def forfeit(self, at=None):
+        """End the game because the player to move ran out of time. The other player wins."""
+        with self.changed:
+            assert self.full() and self.game.winner is None
+            self.forfeited = self.game.player_turn
+            self.game.winner = CheckersGame.opposite[self.forfeited]
+            self._changed(dict(type="forfeit", player=self.forfeited, winner=self.game.winner), at)
+
+    def _changed(self, event, at=None):
+        # Call this with self.changed held
+        self.updated = time.time() if at is None else at
+        self.version += 1
+        event["version"] = self.version
+        self.events.append(event)
+        self._cache.clear()
+        self.changed.notify_all()
+
+    def cached(self, key, build):
+        """Return build() for the current version of the room, calling it only once per version and key."""
+        with self.changed:
+            if key not in self._cache:
+                self._cache[key] = build()
+            return self._cache[key]
+
+    def legal_moves(self):
+        """The set of ((y0, x0), (y1, x1)) moves the player to move can make (none if the game is over).
+        Computed once per position."""
+        return self.cached("legal_moves", lambda: frozenset(() if self.finished() else legal_moves(self.game)))
+
+    def events_since(self, version):
+        """The events that happened after version, oldest first."""
+        return self.events[max(version, 0):]
+
+    def wait(self, version, timeout=None):
+        """Block until the room has changed since version, or until timeout (in seconds) runs out.
+        Returns the current version."""
+        with self.changed:
+            # A version we haven't got to (from a confused client) would count as a change straight away,
+            #   and send the client right back here. Wait for the next change instead.
+            version = min(version, self.version)
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
 
     def full(self):
         return len(self.players) == self.game.n_players
 
-    def checkTimer(self):
-        """Check the turn timer and reset it if it hasn't gone off."""
-        if self.time_limit == 0:
-            return True
-        new_time = time.time()
-        if self.last_move is not None and new_time - self.last_move > self.time_limit:
-            # In this case, we should handle the forfeit here
-            return False
-        self.last_move = new_time
-        return True
+    def finished(self):
+        return self.game.winner is not None
+
+    def deadline(self):
+        """When the player to move runs out of time (a time.time()), or None if there is no clock running."""
+        if self.time_limit == 0 or not self.full() or self.finished():
+            return None
+        return self.turn_started + self.time_limit
+
+    def overdue(self, now=None):
+        """Whether the player to move has run out of time (and should forfeit)."""
+        deadline = self.deadline()
+        return deadline is not None and (time.time() if now is None else now) >= deadline
 
     def auth(self, key):
         """Check if the player is allowed to move.
@@ -46,5 +141,6 @@ class Room:
         except ValueError:
             return False
         # Make sure the token corresponds to the *right* user
-        return player == self.game.player_turn and self.full()
-        
+        # Player indices start at 0, and colors (which is what player_turn is) at 1
+        return player + 1 == self.game.player_turn and self.full() and self.game.winner is None
+
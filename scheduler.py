@@ -0,0 +1,158 @@
+"""
+Things the server has to do at some point in the future, without anyone asking:
+forfeit players who run out of time, and get rid of rooms that are finished or abandoned.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Dict, Hashable
+
+class Scheduler:
+    """
+    Calls functions at given times, one after another, on a single background thread.
+    The pending calls are kept in a heap, so scheduling one is O(log n) however many there are.
+    A call can be given a key, and then scheduling another call with the same key replaces it.
+    """
+
+    def __init__(self):
+        # [when, tie breaker, function, args, key], with function set to None once it's been replaced
+        self._heap = []
+        # Breaks ties between calls at the same time, so we never compare the functions
+        self._counter = itertools.count()
+        # The pending call for each key
+        self._keyed: Dict[Hashable, list] = {}
+        self._stale = 0
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._stale
+
+    def at(self, when: float, function, *args, key: Hashable = None):
+        """Call function(*args) at when (a time.time()), or right away if that has passed.
+        If key isn't None, this replaces the call that's pending for key, if there is one."""
+        with self._wakeup:
+            entry = [when, next(self._counter), function, args, key]
+            if key is not None:
+                replaced = self._keyed.get(key)
+                if replaced is not None:
+                    replaced[2] = None
+                    self._stale += 1
+                self._keyed[key] = entry
+            heapq.heappush(self._heap, entry)
+            # Replaced calls stay in the heap until they'd go off, so clear them out once they're most of it
+            if self._stale > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if entry[2] is not None]
+                heapq.heapify(self._heap)
+                self._stale = 0
+            # In case this is earlier than what the thread is waiting for
+            self._wakeup.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Stop the thread. Calls that haven't happened yet never will."""
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.time()):
+                    self._wakeup.wait(None if not self._heap else self._heap[0][0] - time.time())
+                if self._closed:
+                    return
+                entry = heapq.heappop(self._heap)
+                (_, _, function, args, key) = entry
+                if function is None:
+                    self._stale -= 1
+                    continue
+                if key is not None and self._keyed.get(key) is entry:
+                    del self._keyed[key]
+            try:
+                function(*args)
+            except Exception:
+                # Don't let one bad room stop the clock for everybody
+                traceback.print_exc()
+
+
+class RoomTimers:
+    """
+    Keeps an eye on the rooms of a store: forfeits players whose turn timer runs out,
+    evicts rooms from the store once they've been finished for finished_ttl seconds,
+    and abandons (deletes) rooms that haven't changed for idle_ttl seconds
+    (a turn timer that's running doesn't count as idle).
+
+    Call watch(room) whenever a room changes. Each room has one timer, which replaces the one
+    set for its previous version, so there's no need to cancel anything.
+
+        Parameters:
+            store: A store from store.py.
+            finished_ttl (float): Seconds to keep a room after its game ends.
+            idle_ttl     (float): Seconds to keep a room that nothing happens in.
+    """
+
+    def __init__(self, store, finished_ttl: float = 600, idle_ttl: float = 3600, scheduler = None):
+        self.store = store
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        # Which version of each room we've set a timer for
+        self._watched: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, room):
+        """Set the timer for the room's current state (unless it's set already)."""
+        with self._lock:
+            if self._watched.get(room.room_id) == room.version:
+                return
+            self._watched[room.room_id] = room.version
+        deadline = room.deadline()
+        if deadline is not None:
+            self.scheduler.at(deadline, self._timeout, room.room_id, room.version, key=room.room_id)
+        elif room.finished():
+            self.scheduler.at(room.updated + self.finished_ttl, self._expire, room.room_id, room.version,
+                    key=room.room_id)
+        else:
+            self.scheduler.at(room.updated + self.idle_ttl, self._expire, room.room_id, room.version,
+                    key=room.room_id)
+
+    def _current(self, room_id: str, version: int):
+        """The room, if it's still at version. Otherwise set a timer for its new state."""
+        room = self.store.get(room_id)
+        if room is None:
+            with self._lock:
+                self._watched.pop(room_id, None)
+            return None
+        if room.version != version:
+            # Something happened that we weren't told about (e.g. in another process)
+            self.watch(room)
+            return None
+        return room
+
+    def _timeout(self, room_id: str, version: int):
+        room = self._current(room_id, version)
+        if room is not None:
+            if self.store.forfeit(room) or room.version != version or room.deadline() is None:
+                self.watch(room)
+            else:
+                # We're a tiny bit early
+                self.scheduler.at(room.deadline() + 0.01, self._timeout, room_id, version, key=room_id)
+
+    def _expire(self, room_id: str, version: int):
+        room = self._current(room_id, version)
+        if room is None:
+            return
+        if room.finished():
+            self.store.evict(room_id)
+        elif not self.store.abandon(room, version):
+            # Somebody did something after all
+            self.watch(room)
+            return
+        with self._lock:
+            self._watched.pop(room_id, None)
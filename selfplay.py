@@ -0,0 +1,366 @@
+"""
+Self-play for tuning evaluations: engines play each other from random openings, and positions from their games
+go into shards of training data. tune() then fits piece-square tables to that data (Texel's tuning method).
+
+    python selfplay.py play --engine minimax:MiniMaxer,depth=3 --games 1000 --output data/
+    python selfplay.py tune data/ --output tuned.npz
+
+Each engine is module:Class,setting=value,... as in tournament.py, and every game picks an engine for each color
+at random. Every position an engine moves from is kept with probability --sample, along with the score of
+its search. During the first --explore-plies moves, an engine's move is replaced by a random one with probability
+--explore, so the games don't all go the same way.
+
+Shards are .npy files of exactly --shard-size positions each (only the last one can be shorter), holding a
+structured array with the fields of POSITION. np.load(path, mmap_mode="r") maps them without reading them,
+so you can train on more data than fits in memory. With --compress they're .npz files instead, which are
+smaller but have to be read in whole.
+
+To use tuned tables:
+
+    class Tuned(MiniMaxer):
+        piece_square_tables = np.load("tuned.npz")["tables"]
+        piece_square_bias = int(np.load("tuned.npz")["bias"])
+"""
+import argparse
+import glob
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Tuple, Union
+import numpy as np
+import game
+from ffi import legal_moves # type: ignore
+from minimax import COORDINATE_SUM_BIAS, COORDINATE_SUM_TABLES, WIN_VALUE
+from records import RecordWriter
+from tournament import MAX_PLIES, Engine, opening_moves
+
+# One training position: the board (y * 9 + x), whose turn it is, the search's score for player 1,
+#   and how the game ended (1 if player 1 won, -1 if player 2 won, 0 if nobody did within MAX_PLIES after the opening)
+POSITION = np.dtype([("board", np.uint8, 81), ("side", np.uint8), ("score", np.int32), ("result", np.int8)])
+
+
+# Engines of this worker process, kept between games so they don't have to allocate their tables every time
+_instances = {}
+
+def play(engines: List[Engine], number: int, seed: int, opening_plies: int, explore: float,
+        explore_plies: int, sample: float) -> Tuple[np.ndarray, dict]:
+    """
+    Play one game. Runs in a worker process.
+
+        Returns:
+            The sampled positions (a POSITION array), and the game, as a record for records.py.
+    """
+    rng = random.Random(seed * 1000003 + number + 1)
+    board = game.CheckersGame()
+    for move in opening_moves(seed, number, opening_plies):
+        board.move(*move, verify=False)
+    moves = [game.pack_move(move) for move in board.history]
+    players = {color: rng.choice(engines) for color in (1, 2)}
+    positions = []
+    # MAX_PLIES doesn't count the opening, the same as in tournament.play
+    while board.winner is None and len(moves) - opening_plies < MAX_PLIES:
+        color = board.player_turn
+        engine = players[color]
+        if engine.name not in _instances:
+            _instances[engine.name] = engine.cls()
+        instance = _instances[engine.name]
+        move = engine.find_move(instance, board)
+        if rng.random() < sample:
+            value = instance.stats.value
+            positions.append((board._board.ravel().copy(), color, value if color == 1 else -value, 0))
+        if len(moves) - opening_plies < explore_plies and rng.random() < explore:
+            move = rng.choice(legal_moves(board))
+        board.move(move[0], move[1], verify=False)
+        moves.append(game.pack_move(move))
+
+    data = np.array(positions, dtype=POSITION)
+    data["result"] = {None: 0, 1: 1, 2: -1}[board.winner]
+    names = [players[1].name, players[2].name]
+    same = players[1] == players[2]
+    record = dict(moves=moves, winner=board.winner or 0, engines=names, opening_plies=opening_plies,
+            time_ms=int(players[1].time_ms or 0) if same else 0, depth=(players[1].depth or 0) if same else 0)
+    return (data, record)
+
+
+class ShardWriter:
+    """
+    Collects positions and writes them out shard_size at a time, as shard-NNNNN.npy (or .npz) files in directory.
+    Numbering carries on after the shards that are already there. Call close() at the end to write the rest.
+    """
+
+    def __init__(self, directory: str, shard_size: int = 1 << 16, compress: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.compress = compress
+        self.written = 0
+        self._buffer = np.empty(shard_size, dtype=POSITION)
+        self._filled = 0
+        self._next = len(shard_paths(directory))
+
+    def write(self, positions: np.ndarray):
+        while len(positions):
+            n = min(len(positions), self.shard_size - self._filled)
+            self._buffer[self._filled:self._filled + n] = positions[:n]
+            self._filled += n
+            positions = positions[n:]
+            if self._filled == self.shard_size:
+                self._flush()
+
+    def _flush(self):
+        if self._filled == 0:
+            return
+        data = self._buffer[:self._filled]
+        path = os.path.join(self.directory, f"shard-{self._next:05d}")
+        # Write under another name first, so a shard is never seen half written
+        if self.compress:
+            np.savez_compressed(path + ".tmp.npz", positions=data)
+            os.replace(path + ".tmp.npz", path + ".npz")
+        else:
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, data)
+            os.replace(path + ".tmp", path + ".npy")
+        self.written += self._filled
+        self._next += 1
+        self._filled = 0
+
+    def close(self):
+        self._flush()
+
+
+def shard_paths(directory: str) -> List[str]:
+    """The finished shards in directory, in order."""
+    pattern = os.path.join(directory, "shard-" + "[0-9]" * 5)
+    return sorted(glob.glob(pattern + ".npy") + glob.glob(pattern + ".npz"))
+
+
+def load_shard(path: str) -> np.ndarray:
+    """A shard's positions. .npy shards are memory mapped."""
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            return f["positions"]
+    return np.load(path, mmap_mode="r")
+
+
+def generate(engines: List[Engine], games: int, output: str, seed: int = 0, opening_plies: int = 4,
+        explore: float = 0.1, explore_plies: int = 20, sample: float = 0.25, shard_size: int = 1 << 16,
+        compress: bool = False, records: Union[str, None] = None, workers: Union[int, None] = None,
+        progress = print) -> int:
+    """
+    Play games in a process pool, and write the sampled positions to shards in output.
+    The games themselves also go into the game record file records, if there is one.
+    Returns how many positions were written.
+    """
+    writer = ShardWriter(output, shard_size, compress)
+    record_writer = RecordWriter(records, append=True) if records is not None else None
+    workers = workers or os.cpu_count() or 1
+    results = {0: 0, 1: 0, 2: 0}
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            numbers = iter(range(games))
+            pending = set()
+            done = 0
+            while True:
+                # Only keep a few games queued, however many there are to play
+                for number in numbers:
+                    pending.add(pool.submit(play, engines, number, seed, opening_plies,
+                            explore, explore_plies, sample))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                (finished, pending) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    (data, record) = future.result()
+                    writer.write(data)
+                    if record_writer is not None:
+                        record_writer.write(**record)
+                    results[record["winner"]] += 1
+                    done += 1
+                    if done % 10 == 0 or done == games:
+                        progress(f"[{done}/{games}] {writer.written + writer._filled} positions, "
+                                f"wins {results[1]}-{results[2]}, unfinished {results[0]}")
+    finally:
+        writer.close()
+        if record_writer is not None:
+            record_writer.close()
+    return writer.written
+
+
+def _features(boards: np.ndarray) -> np.ndarray:
+    """(N, 81) boards -> (N, 162) indicators of a player 1 piece, then a player 2 piece, on each cell."""
+    return np.concatenate([boards == 1, boards == 2], axis=1).astype(np.float32)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(x, -50, 50)))
+
+
+def _batches(paths: List[str], batch_size: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    """Positions in random batches: shards in a random order, and each shard shuffled."""
+    for i in rng.permutation(len(paths)):
+        shard = load_shard(paths[i])
+        order = rng.permutation(len(shard))
+        for start in range(0, len(shard), batch_size):
+            # Sorted, so reading from a memory mapped shard goes forward through the file
+            yield shard[np.sort(order[start:start + batch_size])]
+
+
+def _targets(batch: np.ndarray, scale: float, result_weight: float) -> np.ndarray:
+    """What the evaluation should predict: a blend of the game result and the search score, as a win probability."""
+    result = (batch["result"].astype(np.float32) + 1) / 2
+    searched = _sigmoid(scale * batch["score"].astype(np.float32))
+    return result_weight * result + (1 - result_weight) * searched
+
+
+def _decided(batch: np.ndarray) -> np.ndarray:
+    """Positions whose search already found a win. There's nothing left for the evaluation to do there."""
+    return np.abs(batch["score"]) >= WIN_VALUE // 2
+
+
+def fit_scale(paths: List[str], tables: np.ndarray, bias: float, sample_size: int = 1 << 16, seed: int = 0) -> float:
+    """
+    Texel's K: the scale that turns evaluations (in heuristic points) into win probabilities, sigmoid(K * eval),
+    that best predict the game results with the starting tables.
+    """
+    rng = np.random.default_rng(seed)
+    batch = next(_batches(paths, sample_size, rng))
+    batch = batch[~_decided(batch)]
+    if len(batch) == 0:
+        raise ValueError("every sampled position is already decided, so there's nothing to fit K to")
+    x = _features(batch["board"].reshape(-1, 81))
+    evaluation = x @ tables[1:].reshape(162) + bias
+    result = (batch["result"].astype(np.float32) + 1) / 2
+    error = lambda k: np.mean((_sigmoid(np.exp(k) * evaluation) - result) ** 2)
+    # The error is unimodal in K, so a golden section search over log K finds it. If the answer is up against
+    #   an end of the range, the best K is past it, so move the range that way and look again.
+    (low, high) = (np.log(1e-5), np.log(10.0))
+    for _ in range(4):
+        k = _golden_section(error, low, high)
+        width = high - low
+        if k - low < 1e-3 * width:
+            (low, high) = (low - width, low)
+        elif high - k < 1e-3 * width:
+            (low, high) = (high, high + width)
+        # K = 0 predicts 1/2 everywhere. If that's as good, the error is flat and k is just wherever the search stopped.
+        elif error(k) < np.mean((0.5 - result) ** 2):
+            return float(np.exp(k))
+        else:
+            break
+    raise ValueError(f"no K fits: the evaluation doesn't predict the game results (the search ended at "
+            f"K = {np.exp(k):g}). Too few games, or engines that are too weak?")
+
+
+def _golden_section(f, low: float, high: float, iterations: int = 60) -> float:
+    """Where the unimodal function f is lowest in [low, high]."""
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(iterations):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if f(a) < f(b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2
+
+def tune(paths: List[str], tables: Union[np.ndarray, None] = None, bias: Union[float, None] = None,
+        epochs: int = 5, batch_size: int = 4096, learning_rate: float = 0.5, result_weight: float = 0.5,
+        seed: int = 0, progress = print) -> Tuple[np.ndarray, int]:
+    """
+    Fit piece-square tables to self-play positions by minimizing the squared error between sigmoid(K * evaluation)
+    and a blend of each position's game result and search score, with Adam on minibatches.
+
+        Parameters:
+            paths    (list): Shard files.
+            tables (array): (3, 9, 9) tables to start from (default: the coordinate-sum heuristic).
+            bias    (float): The bias to start from.
+            epochs    (int): Passes over the data.
+            learning_rate (float): Adam's step size, in heuristic points.
+            result_weight (float): 1 to only fit game results, 0 to only fit search scores.
+
+        Returns:
+            The tables (ints, as the native search needs them) and the bias.
+    """
+    if tables is None:
+        (tables, bias) = (COORDINATE_SUM_TABLES, COORDINATE_SUM_BIAS)
+    bias = 0 if bias is None else bias
+    scale = fit_scale(paths, np.asarray(tables, dtype=np.float64), bias, seed=seed)
+    progress(f"K = {scale:.6f}")
+    weights = np.append(np.asarray(tables, dtype=np.float64)[1:].reshape(162), bias)
+    (m, v) = (np.zeros_like(weights), np.zeros_like(weights))
+    (beta1, beta2) = (0.9, 0.999)
+    rng = np.random.default_rng(seed)
+    step = 0
+    for epoch in range(epochs):
+        (total, count) = (0.0, 0)
+        for batch in _batches(paths, batch_size, rng):
+            batch = batch[~_decided(batch)]
+            if len(batch) == 0:
+                continue
+            x = _features(batch["board"].reshape(-1, 81))
+            x = np.concatenate([x, np.ones((len(x), 1), dtype=np.float32)], axis=1)
+            target = _targets(batch, scale, result_weight)
+            predicted = _sigmoid(scale * (x @ weights))
+            error = predicted - target
+            total += float(np.sum(error ** 2))
+            count += len(batch)
+            gradient = x.T @ (2 * error * predicted * (1 - predicted) * scale) / len(batch)
+            step += 1
+            m = beta1 * m + (1 - beta1) * gradient
+            v = beta2 * v + (1 - beta2) * gradient ** 2
+            weights -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-12)
+        progress(f"epoch {epoch + 1}: error {total / max(count, 1):.6f} over {count} positions")
+
+    ret = np.zeros((3, 9, 9), dtype=np.int32)
+    ret[1:] = np.rint(weights[:162]).reshape(2, 9, 9)
+    return (ret, int(np.rint(weights[162])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("play", help="generate positions by self-play")
+    p.add_argument("--engine", action="append", default=[], help="module:Class,setting=value,...")
+    p.add_argument("--games", type=int, default=100)
+    p.add_argument("--output", default="selfplay", help="directory for the shards (default selfplay)")
+    p.add_argument("--opening-plies", type=int, default=4, help="random moves per opening (default 4)")
+    p.add_argument("--explore", type=float, default=0.1, help="chance of a random move (default 0.1)")
+    p.add_argument("--explore-plies", type=int, default=20, help="moves after the opening that can be random (default 20)")
+    p.add_argument("--sample", type=float, default=0.25, help="fraction of positions to keep (default 0.25)")
+    p.add_argument("--shard-size", type=int, default=1 << 16, help="positions per shard (default 65536)")
+    p.add_argument("--compress", action="store_true", help="write compressed .npz shards")
+    p.add_argument("--records", help="also append the games to this game record file (see records.py)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    t = commands.add_parser("tune", help="fit piece-square tables to the positions")
+    t.add_argument("directory")
+    t.add_argument("--epochs", type=int, default=5)
+    t.add_argument("--batch-size", type=int, default=4096)
+    t.add_argument("--learning-rate", type=float, default=0.5)
+    t.add_argument("--result-weight", type=float, default=0.5, help="1 fits game results only, 0 search scores only")
+    t.add_argument("--start", help="an .npz of tables and bias to start from (default: the coordinate-sum heuristic)")
+    t.add_argument("--output", default="tuned.npz")
+    t.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "play":
+        engines = [Engine.parse(text) for text in args.engine] or [Engine("minimax", depth=3)]
+        n = generate(engines, args.games, args.output, args.seed, args.opening_plies, args.explore,
+                args.explore_plies, args.sample, args.shard_size, args.compress, args.records, args.workers)
+        print(f"{n} positions written to {args.output}")
+    else:
+        paths = shard_paths(args.directory)
+        if not paths:
+            parser.error(f"no shards in {args.directory}")
+        (tables, bias) = (None, None)
+        if args.start:
+            with np.load(args.start) as f:
+                (tables, bias) = (f["tables"], int(f["bias"]))
+        (tables, bias) = tune(paths, tables, bias, args.epochs, args.batch_size, args.learning_rate,
+                args.result_weight, args.seed)
+        np.savez(args.output, tables=tables, bias=bias)
+        print(f"tables written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
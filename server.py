@@ -1,12 +1,41 @@
+if __name__ == '__main__':
+    # Serve on gevent's event loop if it's there (see the bottom), which has to be set up before anything else
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        monkey = None
+
 from game import CheckersGame
 from room import Room
+from store import MemoryStore, SQLiteStore
+from scheduler import RoomTimers
+from matches import ENGINES, MatchRunner, import_engine_modules
 from string import ascii_uppercase
 from random import choices
+import json
+import os
 
-from flask import Flask, render_template, abort, url_for, request, redirect
+from flask import Flask, Response, render_template, abort, url_for, request, redirect
 
 app = Flask(__name__)
-games = dict()
+# Set ROOM_DB to the path of an SQLite database to keep rooms across restarts,
+#   and to run several server processes at once. Otherwise they're kept in memory.
+games = SQLiteStore(os.environ["ROOM_DB"]) if os.environ.get("ROOM_DB") else MemoryStore()
+# Forfeits players who run out of time, forgets rooms that are finished (after FINISHED_TTL seconds),
+#   and deletes rooms where nothing has happened for IDLE_TTL seconds
+timers = RoomTimers(games, finished_ttl=float(os.environ.get("FINISHED_TTL", 600)),
+        idle_ttl=float(os.environ.get("IDLE_TTL", 3600)))
+# Plays engines against each other (or against HTTP clients) in MATCH_WORKERS processes
+import_engine_modules()
+matches = MatchRunner(games, timers, workers=int(os.environ.get("MATCH_WORKERS", 0)) or None)
+
+# Longest a long-poll request waits for something to happen, in seconds
+LONG_POLL_TIMEOUT = 30
+# How often an idle event stream sends a keepalive comment, in seconds
+SSE_KEEPALIVE = 15
+# Ways the board can be sent, see encodeBoard
+BOARD_ENCODINGS = ("rows", "string", "sparse")
 
 @app.route('/')
 def home():
@@ -17,39 +46,180 @@ def home():
 @app.route("/room/<string:game_id>", methods=["GET"])
 def gameRoom(game_id):
     """Serve a page where the user can see a live representation of a game."""
-    if game_id not in games:
-        abort(404)
+    getRoom(game_id)
     # When we render, we need to embed the game's info in the page's javascript
     return render_template('livegame.html', game_id = game_id)
 
 @app.route("/api/game/create", methods=["POST"])
 def apiGameCreate():
     # This page can be send data either as json or as a form
-    payload = request.json if request.json else request.form
+    payload = request.get_json(silent=True) or request.form
     if "players" not in payload:
         abort(400)
-    n_players = int(payload["players"])
-    time_limit = max(payload.get("time", 0, type=int), 0)
-    if n_players not in [2, 3, 4, 6]:
+    try:
+        n_players = int(payload["players"])
+        time_limit = max(int(payload.get("time", 0)), 0)
+        game = CheckersGame.new_game(n_players)
+    except ValueError:
         abort(400)
 
     # We've checked the request, let's go ahead and generate an ID for the room.
-    new_id = generateId(games.keys())
-    games[new_id] = Room(CheckersGame.new_game(n_players), time_limit=time_limit)
+    new_id = createRoom(game, time_limit).room_id
     # And now we redirect the user to the newly-created room.
     return redirect(url_for("gameRoom", game_id=new_id))
 
 
+@app.route("/api/match/create", methods=["POST"])
+def apiMatchCreate():
+    """Create a room where the server plays some (or all) of the seats with its own engines."""
+    payload = request.get_json(silent=True)
+    if not payload or not isinstance(payload.get("players"), list):
+        abort(400)
+    engines = payload["players"]
+    try:
+        time_limit = max(int(payload.get("time", 0)), 0)
+        game = CheckersGame.new_game(len(engines))
+    except ValueError:
+        abort(400)
+    if any(name is not None and name not in ENGINES for name in engines):
+        abort(400)
+
+    room = createRoom(game, time_limit)
+    matches.start(room, engines)
+    return redirect(url_for("gameRoom", game_id=room.room_id))
+
+
+@app.route("/api/engines", methods=["GET"])
+def apiEngines():
+    """The engines that can play in matches."""
+    return dict(engines=sorted(ENGINES), running=matches.running)
+
+
+def createRoom(game, time_limit):
+    """Make a room for game, and store it under a new ID."""
+    room = Room(game, time_limit=time_limit)
+    new_id = generateId(games)
+    # Another process might have taken the same ID in the meantime
+    while not games.add(new_id, room):
+        new_id = generateId(games)
+    timers.watch(room)
+    return room
+
+
 @app.route("/api/game/<string:game_id>", methods=["GET", "HEAD"])
 def apiGameState(game_id):
-    """Return the current state of a game, encoded as JSON."""
-    if game_id not in games:
+    """Return the current state of a game, encoded as JSON.
+    With ?since=<version>, wait until the room has changed since that version (or until ?timeout= seconds
+    have passed), and include the events since then."""
+    room = getRoom(game_id)
+    encoding = boardEncoding()
+    since = request.args.get("since", type=int)
+    if since is None:
+        # Serialized once per version of the room, and not at all if the client has it already
+        (etag, body) = room.cached(encoding, lambda: (
+                f"{room.version}-{encoding}", json.dumps(gameState(room, encoding))))
+        response = Response(body, mimetype="application/json", headers={"Cache-Control": "no-cache"})
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    timeout = min(request.args.get("timeout", LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    games.wait(room, since, max(timeout, 0))
+    info = gameState(room, encoding)
+    info["events"] = room.events_since(since)
+    return info
+
+
+@app.route("/api/game/<string:game_id>/events", methods=["GET"])
+def apiGameEvents(game_id):
+    """Server-sent events: the state of the game (as a "state" event), and then an event for every
+    join and move as it happens. Reconnecting clients pick up where they left off with the Last-Event-ID
+    header (or ?since=<version>). Once the game is over, an "end" event closes the stream."""
+    room = getRoom(game_id)
+    encoding = boardEncoding()
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+
+    def stream(version):
+        if version is None:
+            info = gameState(room, encoding)
+            version = info["version"]
+            yield f"event: state\nid: {version}\ndata: {json.dumps(info)}\n\n"
+        # Nobody can have seen a version the room hasn't got to
+        version = min(version, room.version)
+        while True:
+            for event in room.events_since(version):
+                version = event["version"]
+                yield f"id: {version}\ndata: {json.dumps(event)}\n\n"
+            if room.game.winner is not None:
+                yield f"event: end\nid: {version}\ndata: {{}}\n\n"
+                return
+            if games.wait(room, version, SSE_KEEPALIVE) == version:
+                if room.room_id not in games:
+                    # Deleted for being idle
+                    return
+                # Comments keep proxies from closing the connection
+                yield ": keepalive\n\n"
+
+    return Response(stream(since), mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/game/<string:game_id>/legal", methods=["GET", "HEAD"])
+def apiGameLegal(game_id):
+    """The moves that the player to move can make, as a list of [[y0, x0], [y1, x1]]."""
+    room = getRoom(game_id)
+
+    def serialize():
+        info = dict(version = room.version,
+                moves = sorted([list(start), list(end)] for (start, end) in room.legal_moves()))
+        if room.full() and not room.finished():
+            info["turn"] = room.game.player_turn
+        return (f"{room.version}-legal", json.dumps(info))
+    (etag, body) = room.cached("legal_json", serialize)
+    response = Response(body, mimetype="application/json", headers={"Cache-Control": "no-cache"})
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def getRoom(game_id):
+    """The room with this id, or a 404 if there isn't one."""
+    room = games.get(game_id)
+    if room is None:
         abort(404)
-    room = games[game_id]
+    return room
+
+
+def boardEncoding():
+    """The board encoding asked for with ?board=, see encodeBoard."""
+    encoding = request.args.get("board", "rows")
+    if encoding not in BOARD_ENCODINGS:
+        abort(400)
+    return encoding
+
+
+def encodeBoard(board, encoding):
+    """
+    Encode a board (a 9x9 array) for JSON.
+        "rows":   a list of 9 rows of 9 ints (the default).
+        "string": a string of 81 digits, row by row.
+        "sparse": a [y, x, color] list with one entry per piece.
+    """
+    if encoding == "string":
+        return "".join(map(str, board.flat))
+    if encoding == "sparse":
+        (ys, xs) = board.nonzero()
+        return [[y, x, int(board[y, x])] for (y, x) in zip(ys.tolist(), xs.tolist())]
+    return board.tolist()
+
+
+def gameState(room, encoding="rows"):
+    """The state of the game in a room, as a dict ready to be sent as JSON."""
     # Maybe we also want like, "last move"?
-    info = dict(board = room.game._board.tolist(),
+    info = dict(board = encodeBoard(room.game._board, encoding),
             n_players = room.game.n_players,
-            last_played = room.last_move)
+            last_played = room.last_move,
+            version = room.version)
     if room.time_limit > 0:
         info["time_limit"] = room.time_limit
 
@@ -60,19 +230,26 @@ def apiGameState(game_id):
     elif room.game.winner is not None:
         info["state"] = "finished"
         info["winner"] = room.game.winner
+        if room.forfeited is not None:
+            info["forfeited"] = room.forfeited
     else:
         info["state"] = "playing"
         info["turn"] = room.game.player_turn
+        if room.deadline() is not None:
+            info["deadline"] = room.deadline()
     return info
 
 @app.route("/api/game/<string:game_id>/join", methods=["POST"])
 def apiGameJoin(game_id):
-    if game_id not in games:
-        abort(404)
-    room = games[game_id]
+    room = getRoom(game_id)
     if room.full():
         abort(400)
-    (player_index, auth) = room.join()
+    try:
+        (player_index, auth) = games.join(room)
+    except AssertionError:
+        # Someone else got the last seat
+        abort(400)
+    timers.watch(room)
     return dict(player=player_index, token=auth)
 
 @app.route("/api/game/<string:game_id>/move", methods=["POST"])
@@ -81,9 +258,7 @@ def apiGameMove(game_id):
     # And when the room is full
     # They have to supply the secret key they were given when they joined
     # If it isn't their turn OR the secret key is wrong, return an error code.
-    if game_id not in games:
-        abort(404)
-    room = games[game_id]
+    room = getRoom(game_id)
 
     try:
         # This will throw an error if it doesn't exist
@@ -95,33 +270,67 @@ def apiGameMove(game_id):
     except:
         abort (401)
     # Ok, the user has provided authentication that we understand.
+    # Turn them away early if it isn't their turn. The store checks again while it holds the room,
+    #   since the turn might change before it gets there.
     if not room.auth(token):
         abort(403)
-    # OK. The user's authentication is valid.
-    # We know that it's their turn.
-    # Now we can ask the game class if this move is legal.
+    # The room checks the move against its (cached) set of legal moves.
+    try:
+        start = parseCell(request.json["move"]["start"])
+        end   = parseCell(request.json["move"]["end"])
+    except:
+        abort(400)
     try:
         # Now we can make the move!
-        start = tuple(request.json["move"]["start"])
-        end   = tuple(request.json["move"]["end"])
-        room.checkTimer()
-        room.game.move(start, end)
+        # This also wakes up everyone waiting for the room to change
+        in_time = games.move(room, start, end, token)
+    except PermissionError:
+        abort(403)
     except:
         abort(400)
+    timers.watch(room)
+    if not in_time:
+        # Too late, so they forfeit
+        abort(403)
     
     return ''
 
+def parseCell(cell):
+    """A [y, x] cell from a request, as a tuple. Raises a ValueError unless it's two integers
+    (so 2.9 doesn't quietly turn into 2)."""
+    if not isinstance(cell, list) or len(cell) != 2:
+        raise ValueError("a cell is [y, x]")
+    # bool is a subclass of int, but true isn't a coordinate
+    if not all(isinstance(c, int) and not isinstance(c, bool) for c in cell):
+        raise ValueError("coordinates have to be integers")
+    return tuple(cell)
+
+@app.route("/api/stats", methods=["GET"])
+def apiStats():
+    """How many rooms there are in each state, and how many timers are waiting to go off."""
+    return dict(rooms=games.counts(), timers=len(timers.scheduler))
+
 # This is a helper function; it's not routed to any endpoint
 def generateId(existing):
-    """Generate a random 5-letter ID that's not already in a list."""
-    # There are 11 million strings of five letters
-    assert len(existing) < 1e6
-    random_str = lambda: ''.join(choices(ascii_uppercase, k=5))
-    candidate = random_str()
-    while candidate in existing:
-        # Try again!
-        candidate = random_str()
-    return candidate
+    """Generate a random 5-letter ID that's not already in existing."""
+    # There are 11 million strings of five letters, and finished rooms get evicted,
+    #   so it would take a lot of live rooms for this to need more than one try.
+    for _ in range(100):
+        candidate = ''.join(choices(ascii_uppercase, k=5))
+        if candidate not in existing:
+            return candidate
+    raise RuntimeError("can't find a free room ID")
+
+# Keep an eye on the games that were going on before a restart
+for room_id in games.active():
+    timers.watch(games.get(room_id))
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    if monkey is not None:
+        # Every waiting long-poll or event stream client is just a greenlet
+        from gevent.pywsgi import WSGIServer
+        print("Serving on http://127.0.0.1:5000/")
+        WSGIServer(("", 5000), app).serve_forever()
+    else:
+        # Without gevent, every waiting client holds a thread (see the README)
+        app.run(debug=True, threaded=True)
@@ -49,18 +49,55 @@ function attachListeners() {
         
     }
 
-    const POLL_INTERVAL = 10000
-    async function poll() {
-        let url = `/api/game/${GAME_ID}`
+    // The server pushes the state of the game once, and then every move as it happens
+    let board = null
 
-        let response = await fetch(url)
-        let json = await response.json()
-        requestAnimationFrame(time => {
-            drawBoard(json.board)
-            setTimeout(poll, POLL_INTERVAL)
+    function draw() {
+        requestAnimationFrame(time => drawBoard(board))
+    }
+
+    function applyEvent(event) {
+        if (event.type == "move") {
+            const [[y0, x0], [y1, x1]] = [event.start, event.end]
+            board[y1][x1] = board[y0][x0]
+            board[y0][x0] = 0
+        }
+    }
+
+    if (window.EventSource) {
+        const source = new EventSource(`/api/game/${GAME_ID}/events`)
+        source.addEventListener("state", e => {
+            board = JSON.parse(e.data).board
+            draw()
         })
+        source.onmessage = e => {
+            applyEvent(JSON.parse(e.data))
+            draw()
+        }
+        // The game is over, so don't let the browser reconnect
+        source.addEventListener("end", e => source.close())
+    } else {
+        // No server-sent events, so long-poll instead
+        async function poll(version) {
+            let url = `/api/game/${GAME_ID}`
+            if (version !== undefined)
+                url += `?since=${version}`
+            let json
+            try {
+                let response = await fetch(url)
+                json = await response.json()
+            } catch (e) {
+                // Try again in a bit
+                setTimeout(() => poll(version), 5000)
+                return
+            }
+            board = json.board
+            draw()
+            if (json.state != "finished")
+                poll(json.version)
+        }
+        poll()
     }
-    poll()
 
 }
 
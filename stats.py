@@ -0,0 +1,110 @@
+from dataclasses import dataclass, field, asdict
+from typing import List, Tuple, Union
+
+Move = Tuple[Tuple[int, int], Tuple[int, int]]
+
+# The counters that the searches keep, in the order MiniMaxer._counters returns them
+COUNTERS = ("nodes", "leaves", "tt_probes", "tt_hits", "tt_cutoffs", "beta_cutoffs", "first_move_cutoffs")
+
+
+@dataclass
+class IterationStats:
+    """What one iteration of iterative deepening did."""
+    depth: int
+    value: int
+    move: Union[Move, None]
+    pv: List[Move]
+    # Seconds
+    time: float
+    nodes: int
+    leaves: int
+    tt_probes: int
+    tt_hits: int
+    # Nodes that returned straight out of the transposition table
+    tt_cutoffs: int
+    beta_cutoffs: int
+    # Beta cutoffs that happened on the first move we tried. This is how good the move ordering is.
+    first_move_cutoffs: int
+    # Nodes of this iteration over nodes of the previous one
+    branching: float
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / self.time if self.time > 0 else 0.0
+
+    @property
+    def cutoff_rate(self) -> float:
+        """Fraction of interior nodes that failed high."""
+        interior = self.nodes - self.leaves - self.tt_cutoffs
+        return self.beta_cutoffs / interior if interior > 0 else 0.0
+
+    @property
+    def first_move_rate(self) -> float:
+        """Fraction of beta cutoffs that happened on the first move."""
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        ret = asdict(self)
+        ret.update(nps=self.nps, cutoff_rate=self.cutoff_rate, first_move_rate=self.first_move_rate)
+        return ret
+
+
+@dataclass
+class SearchStats:
+    """Statistics for one call to MiniMaxer.find_move.
+    Unless it was called with stats=True, only nodes, time, depth, value and move are filled in."""
+    player: int
+    native: bool
+    workers: int
+    iterations: List[IterationStats] = field(default_factory=list)
+    # Whether an iteration was thrown away because the budget ran out
+    aborted: bool = False
+    # Seconds, for the whole search (including an aborted iteration)
+    time: float = 0.0
+    # Where the move came from: "search", or "book" or "race" if it was looked up (see book.py)
+    source: str = "search"
+
+    @property
+    def depth(self) -> int:
+        return self.iterations[-1].depth if self.iterations else 0
+
+    @property
+    def value(self) -> Union[int, None]:
+        return self.iterations[-1].value if self.iterations else None
+
+    @property
+    def move(self) -> Union[Move, None]:
+        return self.iterations[-1].move if self.iterations else None
+
+    @property
+    def pv(self) -> List[Move]:
+        return self.iterations[-1].pv if self.iterations else []
+
+    @property
+    def nodes(self) -> int:
+        return sum(i.nodes for i in self.iterations)
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / self.time if self.time > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        """Plain dict (JSON friendly), for monitoring."""
+        return dict(player=self.player, native=self.native, workers=self.workers,
+                aborted=self.aborted, source=self.source, time=self.time, depth=self.depth, value=self.value,
+                nodes=self.nodes, nps=self.nps,
+                iterations=[i.to_dict() for i in self.iterations])
+
+    def __str__(self):
+        lines = [f"Player {self.player}: value {self.value} at depth {self.depth}"
+                 f" ({self.nodes} nodes in {self.time:.3f}s, {self.nps:.0f} nodes/s)"]
+        for i in self.iterations:
+            lines.append(f"  depth {i.depth:2d}: value {i.value:6d}  nodes {i.nodes:9d}"
+                         f"  {i.nps:9.0f}/s  ebf {i.branching:5.2f}"
+                         f"  tt {i.tt_hits}/{i.tt_probes} ({i.tt_cutoffs} cut)"
+                         f"  cutoffs {i.cutoff_rate:.2f} (first {i.first_move_rate:.2f})")
+        if self.source != "search":
+            lines.append(f"  (looked up: {self.source})")
+        if self.aborted:
+            lines.append("  (last iteration aborted)")
+        return '\n'.join(lines)
@@ -0,0 +1,425 @@
+"""
+Where the server keeps its rooms.
+
+MemoryStore keeps them in a dict, so they only live as long as the process.
+SQLiteStore keeps each room in a database file, as a header (settings and player tokens) plus an append-only
+log of moves, 2 bytes each (game.pack_move). Any process can rebuild a room by replaying its log, so several
+server processes can share one database, and rooms survive restarts.
+
+Both have the same interface; the server only ever changes rooms through join and move.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+import game
+from room import Room
+from typing import Dict, Union
+
+
+def _check_turn(room: Room, token):
+    """Raise a PermissionError unless token is None or belongs to the player to move.
+    Call this holding the room's lock, so that the turn can't change before the move is made."""
+    if token is not None and not room.auth(token):
+        raise PermissionError("not your turn")
+
+
+class MemoryStore:
+    """Rooms in a dict, for a single server process."""
+
+    def __init__(self):
+        self.rooms: Dict[str, Room] = {}
+
+    def __contains__(self, room_id) -> bool:
+        return room_id in self.rooms
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def add(self, room_id: str, room: Room) -> bool:
+        """Store a new room under room_id. Returns False (and doesn't store it) if the id is taken."""
+        if room_id in self.rooms:
+            return False
+        room.room_id = room_id
+        self.rooms[room_id] = room
+        return True
+
+    def get(self, room_id: str) -> Union[Room, None]:
+        """The room with this id, up to date, or None if there isn't one."""
+        return self.rooms.get(room_id)
+
+    def join(self, room: Room):
+        """Room.join, and save it."""
+        return room.join()
+
+    def move(self, room: Room, start, end, token = None) -> bool:
+        """Room.move, and save it. Raises an AssertionError if the move isn't legal.
+        If token is given, it has to be the bearer token of the player to move (checked while nobody else
+        can change the room), or this raises a PermissionError.
+        If the player to move is out of time, they forfeit instead, and this returns False."""
+        with room.changed:
+            _check_turn(room, token)
+            if room.overdue():
+                room.forfeit()
+                return False
+            room.move(start, end)
+            return True
+
+    def forfeit(self, room: Room) -> bool:
+        """Room.forfeit, and save it, if the player to move is out of time. Returns whether they were."""
+        with room.changed:
+            if not room.overdue():
+                return False
+            room.forfeit()
+            return True
+
+    def resign(self, room: Room, player: int) -> bool:
+        """Room.forfeit, and save it, if it's player's turn (however much time they have left).
+        Returns whether it was."""
+        with room.changed:
+            if room.finished() or not room.full() or room.game.player_turn != player:
+                return False
+            room.forfeit()
+            return True
+
+    def wait(self, room: Room, version: int, timeout: float) -> int:
+        """Room.wait, but it also notices changes made by other processes."""
+        return room.wait(version, timeout)
+
+    def evict(self, room_id: str):
+        """Forget a room, to save memory."""
+        self.rooms.pop(room_id, None)
+
+    def delete(self, room_id: str):
+        self.rooms.pop(room_id, None)
+
+    def abandon(self, room: Room, version: int) -> bool:
+        """Delete a room that nobody has touched since version. Returns False if somebody has."""
+        with room.changed:
+            if room.version != version or room.finished():
+                return False
+            self.delete(room.room_id)
+            return True
+
+    def active(self):
+        """The ids of the rooms whose games aren't over."""
+        return [room_id for (room_id, room) in list(self.rooms.items()) if not room.finished()]
+
+    def counts(self) -> Dict[str, int]:
+        """How many rooms are waiting for players, playing, or finished, and how many are in memory."""
+        rooms = list(self.rooms.values())
+        waiting = sum(not room.full() for room in rooms)
+        finished = sum(room.finished() for room in rooms)
+        return dict(waiting=waiting, playing=len(rooms) - waiting - finished, finished=finished,
+                in_memory=len(rooms))
+
+
+class SQLiteStore:
+    """
+    Rooms in an SQLite database, which any number of server processes can share.
+
+    Waiting clients never touch the database. One watcher thread per store checks, every poll_interval,
+    whether any other process has written to it, and if so, brings the rooms that somebody is waiting on
+    up to date (with one query to find out which of them changed), which wakes their waiters.
+
+        Parameters:
+            path            (str): The database file. It's created if it doesn't exist.
+            poll_interval (float): How often (in seconds) the watcher looks for changes
+                                   made by other processes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rooms (
+            id TEXT PRIMARY KEY,
+            n_players INTEGER NOT NULL,
+            time_limit INTEGER NOT NULL,
+            created REAL NOT NULL,
+            -- The players' bearer tokens, all 32 characters long, one after another
+            players TEXT NOT NULL DEFAULT '',
+            -- When the room filled up
+            started REAL,
+            -- The winner, who ran out of time (if that's how it ended), and when the game ended
+            winner INTEGER,
+            forfeit INTEGER,
+            finished REAL
+        );
+        CREATE TABLE IF NOT EXISTS moves (
+            room TEXT NOT NULL,
+            ply INTEGER NOT NULL,
+            -- game.pack_move of the move
+            move INTEGER NOT NULL,
+            -- Room.last_move after the move
+            played REAL,
+            PRIMARY KEY (room, ply)
+        ) WITHOUT ROWID;
+    """
+    TOKEN_LENGTH = 32
+
+    def __init__(self, path: str, poll_interval: float = 0.25):
+        self.path = path
+        self.poll_interval = poll_interval
+        # Connections that aren't in use. There are only ever as many as there have been queries at once
+        #   (not one per thread, or per greenlet under gevent, like with a threading.local).
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        # Rooms this process has seen, as of their last refresh
+        self._rooms: Dict[str, Room] = {}
+        self._lock = threading.Lock()
+        # The rooms that clients are waiting on, and how many clients, for the watcher
+        self._waiting: Dict[str, list] = {}
+        self._watcher = None
+        with self._connection() as db:
+            db.executescript(SQLiteStore.SCHEMA)
+            # Databases from before there were clocks
+            columns = [row[1] for row in db.execute("PRAGMA table_info(rooms)")]
+            for column in ("started REAL", "winner INTEGER", "forfeit INTEGER", "finished REAL"):
+                if column.split()[0] not in columns:
+                    db.execute(f"ALTER TABLE rooms ADD COLUMN {column}")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection is only ever used by one thread at a time, but not always the same one
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def _connection(self):
+        """Borrow a connection for a query (or a transaction)."""
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = self._connect()
+        try:
+            yield db
+        finally:
+            self._idle.put(db)
+
+    def __contains__(self, room_id) -> bool:
+        with self._connection() as db:
+            return db.execute("SELECT 1 FROM rooms WHERE id = ?", (room_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._connection() as db:
+            return db.execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+
+    def add(self, room_id: str, room: Room) -> bool:
+        """Store a new room (with no players or moves yet) under room_id.
+        Returns False (and doesn't store it) if the id is taken."""
+        assert not room.players and not room.game.history
+        with self._connection() as db:
+            cursor = db.execute(
+                    "INSERT OR IGNORE INTO rooms (id, n_players, time_limit, created) VALUES (?, ?, ?, ?)",
+                    (room_id, room.game.n_players, room.time_limit, time.time()))
+        if cursor.rowcount == 0:
+            return False
+        room.room_id = room_id
+        with self._lock:
+            self._rooms[room_id] = room
+        return True
+
+    def get(self, room_id: str) -> Union[Room, None]:
+        """The room with this id, up to date, or None if there isn't one."""
+        room = self._rooms.get(room_id)
+        if room is None:
+            with self._connection() as db:
+                row = db.execute("SELECT n_players, time_limit FROM rooms WHERE id = ?", (room_id,)).fetchone()
+            if row is None:
+                return None
+            (n_players, time_limit) = row
+            room = Room(game.CheckersGame.new_game(n_players), time_limit=time_limit)
+            room.room_id = room_id
+            with self._lock:
+                room = self._rooms.setdefault(room_id, room)
+        self._refresh(room_id, room)
+        return room
+
+    def _refresh(self, room_id: str, room: Room, db: Union[sqlite3.Connection, None] = None):
+        """Replay whatever other processes added to the room since we last looked."""
+        if db is None:
+            with self._connection() as db:
+                return self._refresh(room_id, room, db)
+        with room.changed:
+            row = db.execute("SELECT players, created, started, forfeit, finished FROM rooms WHERE id = ?",
+                    (room_id,)).fetchone()
+            if row is None:
+                return
+            (tokens, created, started, forfeit, finished) = row
+            n = SQLiteStore.TOKEN_LENGTH
+            for i in range(len(room.players) * n, len(tokens), n):
+                room.join(tokens[i:i + n], started if i + n == len(tokens) and started else created)
+            for (packed, played) in db.execute(
+                    "SELECT move, played FROM moves WHERE room = ? AND ply >= ? ORDER BY ply",
+                    (room_id, len(room.game.history))):
+                (start, end) = game.unpack_move(packed)
+                room.move(start, end, played)
+            if forfeit is not None and not room.finished():
+                room.forfeit(finished)
+
+    def _transaction(self, room: Room, change):
+        """Run change() on an up to date room while holding the database's write lock.
+        If anything goes wrong, forget our copy of the room, since it might be half changed."""
+        room_id = room.room_id
+        with room.changed, self._connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh(room_id, room, db)
+                ret = change(db, room_id)
+                db.execute("COMMIT")
+                return ret
+            except (AssertionError, PermissionError):
+                # An illegal move (or somebody else's turn), which didn't change anything
+                db.execute("ROLLBACK")
+                raise
+            except BaseException:
+                db.execute("ROLLBACK")
+                with self._lock:
+                    self._rooms.pop(room_id, None)
+                raise
+
+    def join(self, room: Room):
+        """Room.join, and save it."""
+        def change(db, room_id):
+            (index, auth) = room.join()
+            db.execute("UPDATE rooms SET players = players || ?, started = ? WHERE id = ?",
+                    (auth, room.turn_started, room_id))
+            return (index, auth)
+        return self._transaction(room, change)
+
+    def move(self, room: Room, start, end, token = None) -> bool:
+        """Room.move, and save it. Raises an AssertionError if the move isn't legal.
+        If token is given, it has to be the bearer token of the player to move (checked while nobody else
+        can change the room), or this raises a PermissionError.
+        If the player to move is out of time, they forfeit instead, and this returns False."""
+        def change(db, room_id):
+            _check_turn(room, token)
+            if room.overdue():
+                self._save_forfeit(db, room_id, room)
+                return False
+            ply = len(room.game.history)
+            room.move(start, end)
+            db.execute("INSERT INTO moves (room, ply, move, played) VALUES (?, ?, ?, ?)",
+                    (room_id, ply, game.pack_move((start, end)), room.last_move))
+            if room.finished():
+                db.execute("UPDATE rooms SET winner = ?, finished = ? WHERE id = ?",
+                        (room.game.winner, room.updated, room_id))
+            return True
+        return self._transaction(room, change)
+
+    def forfeit(self, room: Room) -> bool:
+        """Room.forfeit, and save it, if the player to move is out of time. Returns whether they were."""
+        def change(db, room_id):
+            if not room.overdue():
+                return False
+            self._save_forfeit(db, room_id, room)
+            return True
+        return self._transaction(room, change)
+
+    def resign(self, room: Room, player: int) -> bool:
+        """Room.forfeit, and save it, if it's player's turn (however much time they have left).
+        Returns whether it was."""
+        def change(db, room_id):
+            if room.finished() or not room.full() or room.game.player_turn != player:
+                return False
+            self._save_forfeit(db, room_id, room)
+            return True
+        return self._transaction(room, change)
+
+    def _save_forfeit(self, db, room_id, room):
+        room.forfeit()
+        db.execute("UPDATE rooms SET winner = ?, forfeit = ?, finished = ? WHERE id = ?",
+                (room.game.winner, room.forfeited, room.updated, room_id))
+
+    def wait(self, room: Room, version: int, timeout: float) -> int:
+        """Room.wait, but it also notices changes made by other processes (see the class docstring)."""
+        room_id = room.room_id
+        with self._lock:
+            self._waiting.setdefault(room_id, [room, 0])[1] += 1
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="room-watcher", daemon=True)
+                self._watcher.start()
+        try:
+            return room.wait(version, timeout)
+        finally:
+            with self._lock:
+                self._waiting[room_id][1] -= 1
+                if self._waiting[room_id][1] == 0:
+                    del self._waiting[room_id]
+
+    def _watch(self):
+        """The watcher thread: refresh the rooms that clients are waiting on when another process changes them."""
+        db = self._connect()
+        # The database's data_version when we last looked, and the rooms we looked at then
+        last = None
+        checked = set()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                # Goes up whenever another connection commits (ours never writes)
+                version = db.execute("PRAGMA data_version").fetchone()[0]
+                with self._lock:
+                    waiting = {room_id: room for (room_id, (room, _)) in self._waiting.items()}
+                # Rooms that somebody only just started waiting on get looked at even if nothing was written since,
+                #   in case something was written between their get() and now
+                if version == last and checked.issuperset(waiting):
+                    continue
+                (last, checked) = (version, set(waiting))
+                if not waiting:
+                    continue
+                rows = db.execute(f"""
+                        SELECT id, length(players) / {SQLiteStore.TOKEN_LENGTH}, forfeit IS NOT NULL,
+                            (SELECT COUNT(*) FROM moves WHERE moves.room = rooms.id)
+                        FROM rooms WHERE id IN (SELECT value FROM json_each(?))""", (json.dumps(list(waiting)),))
+                for (room_id, players, forfeit, moves) in rows.fetchall():
+                    room = waiting[room_id]
+                    if (players, bool(forfeit), moves) != (
+                            len(room.players), room.forfeited is not None, len(room.game.history)):
+                        self._refresh(room_id, room, db)
+            except Exception:
+                # Try again next time, rather than leave everybody waiting forever
+                traceback.print_exc()
+
+    def evict(self, room_id: str):
+        """Forget our copy of a room, to save memory. It stays in the database, and get() brings it back."""
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def delete(self, room_id: str):
+        with self._connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM moves WHERE room = ?", (room_id,))
+            db.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+            db.execute("COMMIT")
+        self.evict(room_id)
+
+    def abandon(self, room: Room, version: int) -> bool:
+        """Delete a room that nobody has touched since version (in any process). Returns False if somebody has."""
+        def change(db, room_id):
+            if room.version != version or room.finished():
+                return False
+            db.execute("DELETE FROM moves WHERE room = ?", (room_id,))
+            db.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+            return True
+        if not self._transaction(room, change):
+            return False
+        self.evict(room.room_id)
+        return True
+
+    def active(self):
+        """The ids of the rooms whose games aren't over."""
+        with self._connection() as db:
+            return [row[0] for row in db.execute("SELECT id FROM rooms WHERE winner IS NULL")]
+
+    def counts(self) -> Dict[str, int]:
+        """How many rooms are waiting for players, playing, or finished, and how many are in memory."""
+        full = f"length(players) = {SQLiteStore.TOKEN_LENGTH} * n_players"
+        with self._connection() as db:
+            (waiting, playing, finished) = db.execute(f"""
+                SELECT
+                    COALESCE(SUM(winner IS NULL AND NOT {full}), 0),
+                    COALESCE(SUM(winner IS NULL AND {full}), 0),
+                    COALESCE(SUM(winner IS NOT NULL), 0)
+                FROM rooms""").fetchone()
+        return dict(waiting=waiting, playing=playing, finished=finished, in_memory=len(self._rooms))
@@ -0,0 +1,298 @@
+"""
+Offline tournaments between MiniMaxer subclasses.
+
+    python tournament.py --engine minimax:MiniMaxer,depth=3 --engine minimax:MiniMaxer,depth=5,name=deep \\
+            --openings 20 --output results.jsonl
+
+Each engine is module:Class, followed by comma separated settings: name, depth, time_ms, nodes and native
+(which get passed to find_move). Engines play each other (round-robin) or only the first engine (gauntlet),
+from --openings random openings, each once with either color. Games run in a process pool, one per core by default.
+
+Every finished game is appended to the --output file as a line of JSON, so an interrupted tournament picks up
+where it left off when you run the same command again. Only games played with the same seed, opening plies and
+engine settings count as done (and in the ratings), so changing any of them plays the games again. At the end (or with --report on an existing file)
+it prints each engine's Elo with a 95% confidence interval, its average time per move and its nodes per second.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Union
+import game
+from ffi import legal_moves # type: ignore
+from minimax import MiniMaxer
+
+# Games that go on longer than this are draws
+MAX_PLIES = 300
+
+
+@dataclass
+class Engine:
+    """An engine and how it searches. The class has to be importable (defined at the top level of a module)."""
+    name: str
+    cls: type = MiniMaxer
+    depth: Union[int, None] = None
+    time_ms: Union[float, None] = None
+    nodes: Union[int, None] = None
+    native: Union[bool, None] = None
+
+    @staticmethod
+    def parse(text: str) -> "Engine":
+        """Parse module:Class,setting=value,... (see the module docstring)."""
+        (path, *settings) = text.split(",")
+        (module, _, name) = path.partition(":")
+        cls = getattr(importlib.import_module(module), name or "MiniMaxer")
+        args = dict(setting.split("=", 1) for setting in settings)
+        engine = Engine(args.pop("name", path), cls)
+        for (key, value) in args.items():
+            if key == "native":
+                engine.native = value.lower() in ("1", "true", "yes")
+            elif key in ("depth", "nodes"):
+                setattr(engine, key, int(value))
+            elif key == "time_ms":
+                engine.time_ms = float(value)
+            else:
+                raise ValueError(f"unknown engine setting {key}")
+        if engine.depth is None and engine.time_ms is None and engine.nodes is None:
+            engine.depth = 3
+        return engine
+
+    @property
+    def spec(self) -> str:
+        """The class and settings, in the same form as parse takes them (without the name)."""
+        settings = [f"{key}={getattr(self, key)}" for key in ("depth", "time_ms", "nodes", "native")
+                if getattr(self, key) is not None]
+        return ",".join([f"{self.cls.__module__}:{self.cls.__qualname__}"] + settings)
+
+    def find_move(self, instance: MiniMaxer, board: game.CheckersGame):
+        return instance.find_move(board, self.depth, native=self.native, time_ms=self.time_ms, nodes=self.nodes)
+
+
+@dataclass
+class Pairing:
+    """One game of the tournament: engines[0] plays color 1, from opening number opening
+    (opening_plies random moves, picked with seed)."""
+    engines: tuple
+    opening: int
+    seed: int = 0
+    opening_plies: int = 4
+    # Engine.spec of each engine
+    specs: tuple = ()
+
+    @property
+    def key(self) -> str:
+        """Identifies the game in the results file. It has everything that the game depends on,
+        so resuming with different settings (or different engines under the same names) plays new games
+        instead of counting the old ones."""
+        return "|".join([*self.engines, str(self.opening), f"seed={self.seed}", f"plies={self.opening_plies}",
+                *self.specs])
+
+
+def schedule(engines: List[Engine], openings: int, gauntlet: bool = False, seed: int = 0,
+        opening_plies: int = 4) -> List[Pairing]:
+    """Every pair of engines (or the first engine against each of the others) plays every opening twice,
+    once with each color."""
+    if gauntlet:
+        pairs = [(engines[0], other) for other in engines[1:]]
+    else:
+        pairs = [(a, b) for (i, a) in enumerate(engines) for b in engines[i + 1:]]
+    return [Pairing((first.name, second.name), opening, seed, opening_plies, (first.spec, second.spec))
+            for opening in range(openings)
+            for (a, b) in pairs
+            for (first, second) in ((a, b), (b, a))]
+
+
+def opening_moves(seed: int, number: int, plies: int) -> List[tuple]:
+    """plies random moves from the start. The same seed and number always give the same ones."""
+    rng = random.Random(seed * 1000003 + number)
+    board = game.CheckersGame()
+    for _ in range(plies):
+        board.move(*rng.choice(legal_moves(board)), verify=False)
+    return board.history
+
+
+def opening(seed: int, number: int, plies: int) -> game.CheckersGame:
+    """The position after opening_moves(seed, number, plies), without the history."""
+    board = game.CheckersGame()
+    for move in opening_moves(seed, number, plies):
+        board.move(*move, verify=False)
+    return game.CheckersGame(board._board, board.player_turn)
+
+
+def play(engines: Dict[str, Engine], pairing: Pairing) -> dict:
+    """
+    Play one game. Runs in a worker process. Returns the record that goes into the results file.
+    Its moves start from the starting position, so they include the opening_plies random ones.
+    """
+    (seed, opening_plies) = (pairing.seed, pairing.opening_plies)
+    board = opening(seed, pairing.opening, opening_plies)
+    players = {color: engines[name] for (color, name) in zip((1, 2), pairing.engines)}
+    instances = {color: players[color].cls() for color in (1, 2)}
+    stats = {name: dict(moves=0, time=0.0, nodes=0) for name in pairing.engines}
+    moves = [game.pack_move(move) for move in opening_moves(seed, pairing.opening, opening_plies)]
+    while board.winner is None and len(moves) - opening_plies < MAX_PLIES:
+        color = board.player_turn
+        instance = instances[color]
+        move = players[color].find_move(instance, board)
+        board.move(move[0], move[1], verify=False)
+        moves.append(game.pack_move(move))
+        s = stats[players[color].name]
+        s["moves"] += 1
+        s["time"] += instance.stats.time
+        s["nodes"] += instance.stats.nodes
+    for instance in instances.values():
+        instance.close()
+    return dict(key=pairing.key, engines=list(pairing.engines), opening=pairing.opening,
+            winner=board.winner or 0, plies=len(moves) - opening_plies, opening_plies=opening_plies,
+            moves=moves, stats=stats)
+
+
+def load(path: str) -> List[dict]:
+    """The games in a results file. A half written last line (from an interrupted run) is ignored."""
+    if not os.path.exists(path):
+        return []
+    games = []
+    with open(path) as f:
+        for line in f:
+            try:
+                games.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return games
+
+
+def run(engines: List[Engine], openings: int, output: str, gauntlet: bool = False, seed: int = 0,
+        opening_plies: int = 4, workers: Union[int, None] = None, progress = print) -> List[dict]:
+    """
+    Play a tournament, appending each game to output as it finishes. Games already in output are skipped.
+
+        Parameters:
+            engines (list): Engines, all with different names.
+            openings (int): How many random openings. Each pairing plays each of them with either color.
+            gauntlet (bool): Only play the first engine against each of the others.
+            seed     (int): Seed of the random openings.
+            opening_plies (int): Random moves at the start of each game.
+            workers  (int): Processes to play in (default: one per core).
+
+        Returns:
+            The games of this tournament in output (leaving out any that were played with other settings).
+    """
+    by_name = {engine.name: engine for engine in engines}
+    assert len(by_name) == len(engines), "engines need different names"
+    pairings = schedule(engines, openings, gauntlet, seed, opening_plies)
+    keys = {p.key for p in pairings}
+    done = {g["key"] for g in load(output)} & keys
+    todo = [p for p in pairings if p.key not in done]
+    if todo:
+        progress(f"{len(todo)} games to play ({len(done)} already done)")
+        with ProcessPoolExecutor(workers) as pool, open(output, "a+") as f:
+            # Finish off a line that an interrupted run was writing, so it doesn't swallow the next game
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != "\n":
+                    f.write("\n")
+            futures = [pool.submit(play, by_name, p) for p in todo]
+            for (i, future) in enumerate(as_completed(futures)):
+                record = future.result()
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                progress(f"[{i + 1}/{len(todo)}] {record['engines'][0]} vs {record['engines'][1]}: "
+                        f"{['draw', 'first player wins', 'second player wins'][record['winner']]}"
+                        f" in {record['plies']} plies")
+    return [g for g in load(output) if g["key"] in keys]
+
+
+def _elo(score: float) -> float:
+    """Elo difference that gives an expected score of score."""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def ratings(games: List[dict], iterations: int = 1000) -> Dict[str, dict]:
+    """
+    Elo ratings (averaging 0), by maximum likelihood under the Bradley-Terry model, with draws as half a win each.
+    Also a 95% confidence interval for each engine, from the spread of its results,
+    plus its score, average time per move and nodes per second.
+    """
+    names = sorted({name for g in games for name in g["engines"]})
+    # scores[a][b]: points a took from b, and played[a][b]: games between them
+    scores = {a: {b: 0.0 for b in names} for a in names}
+    played = {a: {b: 0 for b in names} for a in names}
+    points = {a: [] for a in names}
+    totals = {a: dict(moves=0, time=0.0, nodes=0) for a in names}
+    for g in games:
+        (a, b) = g["engines"]
+        result = {0: 0.5, 1: 1.0, 2: 0.0}[g["winner"]]
+        scores[a][b] += result
+        scores[b][a] += 1 - result
+        played[a][b] += 1
+        played[b][a] += 1
+        points[a].append(result)
+        points[b].append(1 - result)
+        for (name, s) in g["stats"].items():
+            for key in ("moves", "time", "nodes"):
+                totals[name][key] += s[key]
+
+    # Minorization-maximization for the Bradley-Terry strengths
+    strength = {a: 1.0 for a in names}
+    for _ in range(iterations):
+        new = {}
+        for a in names:
+            wins = sum(scores[a].values())
+            denominator = sum(played[a][b] / (strength[a] + strength[b]) for b in names if played[a][b])
+            # Keep engines that never scored (or never lost) finite
+            new[a] = max(wins, 0.5) / denominator if denominator > 0 else strength[a]
+        mean = math.exp(sum(math.log(s) for s in new.values()) / len(new))
+        strength = {a: s / mean for (a, s) in new.items()}
+
+    ret = {}
+    for a in names:
+        n = len(points[a])
+        score = sum(points[a]) / n
+        deviation = math.sqrt(sum((p - score) ** 2 for p in points[a]) / n / n)
+        margin = (_elo(score + 1.96 * deviation) - _elo(score - 1.96 * deviation)) / 2
+        t = totals[a]
+        ret[a] = dict(elo=400 * math.log10(strength[a]), margin=margin, games=n, score=score,
+                move_ms=1000 * t["time"] / max(t["moves"], 1), nps=t["nodes"] / t["time"] if t["time"] > 0 else 0.0)
+    return ret
+
+
+def report(games: List[dict]) -> str:
+    rows = sorted(ratings(games).items(), key=lambda item: -item[1]["elo"])
+    lines = [f"{'engine':<24}{'games':>6}{'score':>8}{'elo':>14}{'ms/move':>10}{'nodes/s':>12}"]
+    for (name, r) in rows:
+        lines.append(f"{name:<24}{r['games']:>6}{r['score']:>8.1%}{r['elo']:>+8.0f} ±{r['margin']:>4.0f}"
+                f"{r['move_ms']:>10.1f}{r['nps']:>12.0f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", action="append", default=[], help="module:Class,setting=value,...")
+    parser.add_argument("--openings", type=int, default=10, help="random openings per pairing (default 10)")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random moves per opening (default 4)")
+    parser.add_argument("--gauntlet", action="store_true", help="only play the first engine against the others")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--output", default="tournament.jsonl", help="results file (default tournament.jsonl)")
+    parser.add_argument("--report", action="store_true", help="just print the ratings from the results file")
+    args = parser.parse_args()
+
+    if args.report:
+        games = load(args.output)
+    else:
+        if len(args.engine) < 2:
+            parser.error("need at least two engines")
+        engines = [Engine.parse(text) for text in args.engine]
+        games = run(engines, args.openings, args.output, args.gauntlet, args.seed,
+                args.opening_plies, args.workers)
+    if games:
+        print(report(games))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import numpy as np
+from typing import NamedTuple, Tuple, Union
+from game import pack_move, unpack_move
+
+Move = Tuple[Tuple[int, int], Tuple[int, int]]
+
+NO_MOVE = 0xFFFF
+
+
+class Transposition(NamedTuple):
+    value: int
+    depth: int
+    flag:  int
+    principal: Union[Move, None]
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+
+class TranspositionTable():
+    """
+    A fixed-size transposition table, so that a long-running bot doesn't grow forever.
+
+    Entries live in preallocated numpy columns (key, value, depth, flag, principal move
+    and generation) instead of python objects. The table is split into buckets of two slots:
+    the first slot prefers deeper searches, and the second one is always replaced.
+    Call new_search() before every move, so that entries from old searches get replaced first.
+    """
+
+    # key + value + depth + flag + move + generation
+    ENTRY_BYTES = 8 + 4 + 1 + 1 + 2 + 1
+
+    def __init__(self, size_mb: float = 16):
+        # Round the number of buckets down to a power of two so that indexing is a mask
+        n_buckets = max(1, int(size_mb * 2**20) // (2 * TranspositionTable.ENTRY_BYTES))
+        n_buckets = 1 << (n_buckets.bit_length() - 1)
+        self._mask = n_buckets - 1
+
+        n = 2 * n_buckets
+        self.keys   = np.zeros(n, dtype=np.uint64)
+        self.values = np.zeros(n, dtype=np.int32)
+        # A depth of -1 marks an empty slot
+        self.depths = np.full(n, -1, dtype=np.int8)
+        self.flags  = np.zeros(n, dtype=np.uint8)
+        self.moves  = np.full(n, NO_MOVE, dtype=np.uint16)
+        self.generations = np.zeros(n, dtype=np.uint8)
+        self.generation = 0
+
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.overwrites = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in
+                (self.keys, self.values, self.depths, self.flags, self.moves, self.generations))
+
+    def new_search(self):
+        """Age the table. Entries stored before this call are the first to be replaced."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        self.depths.fill(-1)
+        self.moves.fill(NO_MOVE)
+        self.probes = self.hits = self.collisions = self.overwrites = 0
+
+    def _find(self, key: int) -> int:
+        """Index of the slot holding key, or -1."""
+        i = (key & self._mask) << 1
+        keys = self.keys
+        depths = self.depths
+        if keys[i] == key and depths[i] >= 0:
+            return i
+        if keys[i + 1] == key and depths[i + 1] >= 0:
+            return i + 1
+        if depths[i] >= 0 or depths[i + 1] >= 0:
+            # The bucket is in use, but by other positions
+            self.collisions += 1
+        return -1
+
+    def get(self, key: int) -> Union[Transposition, None]:
+        """
+        Look up a position by its Zobrist key.
+
+            Parameters:
+                key (int): CheckersGame.hash() of the position.
+
+            Returns:
+                The stored Transposition, or None if the position isn't in the table.
+        """
+        self.probes += 1
+        i = self._find(key)
+        if i < 0:
+            return None
+        self.hits += 1
+        move = int(self.moves[i])
+        return Transposition(int(self.values[i]), int(self.depths[i]), int(self.flags[i]),
+                None if move == NO_MOVE else unpack_move(move))
+
+    def principal(self, key: int) -> Union[Move, None]:
+        """The best move stored for a position, without touching the counters."""
+        i = (key & self._mask) << 1
+        for j in (i, i + 1):
+            if self.keys[j] == key and self.depths[j] >= 0 and self.moves[j] != NO_MOVE:
+                return unpack_move(int(self.moves[j]))
+        return None
+
+    def store(self, key: int, value: int, depth: int, flag: int, principal: Union[Move, None]):
+        """Save a search result, replacing whatever the bucket's policy allows."""
+        i = (key & self._mask) << 1
+        # Use the depth-preferred slot if it holds this same position, if it is empty or stale,
+        #   or if we searched at least as deep. Otherwise fall back to the always-replace slot.
+        old_depth = self.depths[i]
+        if not (self.keys[i] == key or old_depth < 0
+                or self.generations[i] != self.generation or depth >= old_depth):
+            i += 1
+        if self.depths[i] >= 0 and self.keys[i] != key:
+            self.overwrites += 1
+
+        self.keys[i] = key
+        self.values[i] = value
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = NO_MOVE if principal is None else pack_move(principal)
+        self.generations[i] = self.generation
+
+    def counters(self) -> dict:
+        return dict(probes=self.probes, hits=self.hits,
+                collisions=self.collisions, overwrites=self.overwrites)